@@ -1,11 +1,11 @@
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional
+import math
 import secrets
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import jwt
-import bcrypt
 from sqlalchemy.orm import Session
 
 from app.api.deps import get_current_user
@@ -15,10 +15,13 @@ from app.models.user import User
 from pydantic import BaseModel, EmailStr
 
 from app.schemas.user import UserCreate, UserResponse
-from app.services.redis_client import get_redis
+from app.services import rate_limiter
+from app.services.rate_limiter import Limit, RateLimitResult
 from app.services.security import generate_token_with_expiry, hash_token
 from app.services.email import send_verification_email, send_reset_email
 from app.services.generations import get_or_create_balance
+from app.services.passwords import PasswordPoolBusy, hash_password, needs_rehash, verify_password
+from app.services.user_cache import invalidate_user
 
 
 class RefreshTokenRequest(BaseModel):
@@ -35,7 +38,6 @@ class RefreshTokenRequest(BaseModel):
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 settings = get_settings()
-redis_client = get_redis()
 
 VERIFICATION_TTL_MINUTES = 30
 RESET_TTL_MINUTES = 30
@@ -57,29 +59,55 @@ DISPOSABLE_DOMAINS = {
 }
 
 
+def _password_pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервис перегружен, попробуйте позже",
+        headers={"Retry-After": "1"},
+    )
+
+
 def _hash_password(password: str) -> str:
-    # Truncate password to 72 bytes (bcrypt limit)
-    password_bytes = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+    try:
+        return hash_password(password)
+    except PasswordPoolBusy:
+        raise _password_pool_busy()
 
 
 def _verify_password(plain_password: str, hashed_password: str) -> bool:
-    # Truncate password to 72 bytes (bcrypt limit)
-    password_bytes = plain_password.encode('utf-8')[:72]
-    hashed_bytes = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hashed_bytes)
+    try:
+        return verify_password(plain_password, hashed_password)
+    except PasswordPoolBusy:
+        raise _password_pool_busy()
 
 
-def _rate_limit(key: str, limit: int, expire_seconds: int) -> None:
-    current = redis_client.incr(key)
-    if current == 1:
-        redis_client.expire(key, expire_seconds)
-    if current > limit:
+def _rehash_if_needed(db: Session, user: User, plain_password: str) -> None:
+    """Пересчитать хэш, если поменялась PASSWORD_BCRYPT_ROUNDS. Не мешает логину при сбое."""
+    if not needs_rehash(user.hashed_password):
+        return
+    try:
+        user.hashed_password = hash_password(plain_password)
+        db.add(user)
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        print(f"[auth] password rehash skipped for user {user.id}: {exc}")
+
+
+def _rate_limit(*limits: Limit, detail: str = "Слишком много запросов") -> Optional[RateLimitResult]:
+    """Проверить все лимиты одним обращением к Redis; при превышении — 429 с Retry-After."""
+    result = rate_limiter.check(limits)
+    if result is not None and not result.allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Слишком много запросов",
+            detail=detail,
+            headers={
+                "Retry-After": str(max(1, math.ceil(result.retry_after))),
+                "X-RateLimit-Remaining": str(result.remaining),
+                "X-RateLimit-Reset": str(math.ceil(result.reset_after)),
+            },
         )
+    return result
 
 
 def _is_disposable_domain(email: str) -> bool:
@@ -119,8 +147,10 @@ def register_user(
     ip = request.client.host if request.client else "unknown"
 
     # Anti-abuse: IP limits
-    _rate_limit(f"reg:ip:{ip}:day", REG_IP_LIMIT_DAY, 24 * 3600)
-    _rate_limit(f"reg:ip:{ip}:10m", REG_IP_LIMIT_10MIN, 600)
+    _rate_limit(
+        Limit(f"reg:ip:{ip}:day", REG_IP_LIMIT_DAY, 24 * 3600),
+        Limit(f"reg:ip:{ip}:10m", REG_IP_LIMIT_10MIN, 600),
+    )
 
     # Anti-abuse: domain limits
     if _is_disposable_domain(user_in.email):
@@ -129,8 +159,10 @@ def register_user(
             detail="Временные email-домены запрещены",
         )
     domain = user_in.email.split("@")[-1].lower()
-    _rate_limit(f"reg:domain:{domain}:day", REG_DOMAIN_LIMIT_DAY, 24 * 3600)
-    _rate_limit(f"reg:domain:{domain}:hour", REG_DOMAIN_LIMIT_HOUR, 3600)
+    _rate_limit(
+        Limit(f"reg:domain:{domain}:day", REG_DOMAIN_LIMIT_DAY, 24 * 3600),
+        Limit(f"reg:domain:{domain}:hour", REG_DOMAIN_LIMIT_HOUR, 3600),
+    )
 
     existing = db.query(User).filter(User.email == user_in.email).first()
     if existing:
@@ -180,6 +212,8 @@ def login(
             detail="Email не подтверждён",
         )
 
+    _rehash_if_needed(db, user, form_data.password)
+
     access_token = create_access_token(user.id)
     refresh_token = create_refresh_token(user.id)
 
@@ -262,6 +296,7 @@ def verify_email(
     user.email_verification_expires_at = None
     db.add(user)
     db.commit()
+    invalidate_user(user.id)
     access_token = create_access_token(user.id)
     refresh_token = create_refresh_token(user.id)
     return {
@@ -292,19 +327,20 @@ def resend_verification(
     ip = request.client.host if request.client else "unknown"
     email = payload.email.lower()
 
-    # cooldown per email
-    if redis_client.get(f"resend:cooldown:{email}"):
+    # cooldown per email + daily limits — одним атомарным вызовом
+    cooldown_key = f"resend:cooldown:{email}"
+    result = rate_limiter.check([
+        Limit(cooldown_key, 1, RESEND_COOLDOWN_SECONDS),
+        Limit(f"resend:email:{email}:day", RESEND_DAILY_LIMIT, 24 * 3600),
+        Limit(f"resend:ip:{ip}:day", RESEND_DAILY_LIMIT_IP, 24 * 3600),
+    ])
+    if result is not None and not result.allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Слишком часто, попробуйте позже",
+            detail="Слишком часто, попробуйте позже" if result.denied_by(cooldown_key) else "Слишком много запросов",
+            headers={"Retry-After": str(max(1, math.ceil(result.retry_after)))},
         )
 
-    # daily limits
-    _rate_limit(f"resend:email:{email}:day", RESEND_DAILY_LIMIT, 24 * 3600)
-    _rate_limit(f"resend:ip:{ip}:day", RESEND_DAILY_LIMIT_IP, 24 * 3600)
-
-    redis_client.setex(f"resend:cooldown:{email}", RESEND_COOLDOWN_SECONDS, "1")
-
     user = db.query(User).filter(User.email == email).first()
     if not user:
         return {"message": "OK"}  # не раскрываем
@@ -386,6 +422,7 @@ def reset_password(
     user.reset_token_expires_at = None
     db.add(user)
     db.commit()
+    invalidate_user(user.id)
     return {"message": "Пароль успешно обновлён"}
 
 
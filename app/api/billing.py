@@ -9,7 +9,7 @@ from app.api.deps import get_current_user
 from app.core.database import get_db
 from app.models.user import User
 from app.services.generations import (
-    get_or_create_balance,
+    get_balance_view,
     purchase_plan,
     PACKAGE_CREDITS,
     SUBSCRIPTION_CREDITS,
@@ -54,18 +54,7 @@ def get_balance(
     current_user: Annotated[User, Depends(get_current_user)],
     db: Annotated[Session, Depends(get_db)],
 ) -> BalanceResponse:
-    balance = get_or_create_balance(db, current_user)
-    return BalanceResponse(
-        email=balance.email,
-        remaining_std=balance.remaining_std,
-        used_std=balance.used_std,
-        remaining_hd=balance.remaining_hd,
-        used_hd=balance.used_hd,
-        current_plan=balance.current_plan,
-        package_plan_id=balance.package_plan_id,
-        purchased_at=balance.purchased_at,
-        plan_expires_at=balance.plan_expires_at,
-    )
+    return BalanceResponse(**get_balance_view(db, current_user))
 
 
 @router.post("/purchase", response_model=PurchaseResponse)
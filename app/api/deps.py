@@ -1,39 +1,40 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 
 from app.core.config import get_settings
-from app.core.database import get_db
+from app.core.database import SessionLocal, get_db
 from app.models.user import User
+from app.services.jwt_verify import TokenInvalid, decode_token
+from app.services.user_cache import cache_user, get_cached_user
 
 
 settings = get_settings()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+# Для SSE/WebSocket: токен может прийти query-параметром, т.к. EventSource не умеет заголовки
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 
-def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)],
-    db: Annotated[Session, Depends(get_db)],
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Не удалось подтвердить авторизацию",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+
+def _decode_user_id(token: Optional[str]) -> int:
+    credentials_exception = _credentials_exception()
+
     if not token:
         raise credentials_exception
     
     try:
-        payload = jwt.decode(
-            token,
-            settings.JWT_SECRET_KEY,
-            algorithms=[settings.JWT_ALGORITHM],
-        )
+        payload = decode_token(token, settings.JWT_SECRET_KEY)
         user_id_raw = payload.get("sub")
         if user_id_raw is None:
             raise credentials_exception
@@ -42,13 +43,62 @@ def get_current_user(
         user_id = int(user_id_raw) if isinstance(user_id_raw, (int, str)) else None
         if user_id is None:
             raise credentials_exception
-    except (JWTError, ValueError, TypeError):
+    except (TokenInvalid, ValueError, TypeError):
         raise credentials_exception
+    return user_id
+
+
+def _user_from_cache(db: Session, user_id: int) -> Optional[User]:
+    """
+    Собрать User из кэша без запроса к БД.
+
+    Объект привязывается к сессии как уже существующий: изменения сохраняются
+    обычным UPDATE, а не закэшированные поля (пароль, токены) догружаются при обращении.
+    """
+    cached = get_cached_user(user_id)
+    if cached is None:
+        return None
+    user = db.identity_map.get(identity_key(User, user_id))
+    if user is not None:
+        return user
+    user = User(**cached)
+    make_transient_to_detached(user)
+    db.add(user)
+    return user
+
+
+def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: Annotated[Session, Depends(get_db)],
+) -> User:
+    user_id = _decode_user_id(token)
+
+    user = _user_from_cache(db, user_id)
+    if user is not None:
+        return user
 
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
 
+    cache_user(user)
     return user
 
 
+def get_stream_user_id(token: Optional[str]) -> int:
+    """
+    Проверить токен для долгоживущего соединения (SSE/WebSocket) и вернуть id пользователя.
+
+    Сессию БД открываем только на время проверки, а не на всё время соединения.
+    """
+    user_id = _decode_user_id(token)
+    if get_cached_user(user_id) is not None:
+        return user_id
+    db = SessionLocal()
+    try:
+        exists = db.query(User.id).filter(User.id == user_id).first()
+    finally:
+        db.close()
+    if exists is None:
+        raise _credentials_exception()
+    return user_id
@@ -1,20 +1,84 @@
-from fastapi import APIRouter, HTTPException, Query, status, Response
+import re
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterator, Literal, Optional
 
-from app.services.s3 import download_file_from_s3
-from app.services.upscale import upscale_image_fast
+from fastapi import APIRouter, HTTPException, Query, Request, status, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+
+from app.core.config import get_settings
+from app.services.renditions import ensure_hd_rendition
+from app.services.s3 import create_presigned_url_download, open_file_stream
+
+settings = get_settings()
 
 router = APIRouter(prefix="/api", tags=["download"])
 
+# Один диапазон: bytes=0-99, bytes=100-, bytes=-500. Мульти-диапазоны не поддерживаем
+_SINGLE_RANGE_RE = re.compile(r"^bytes=(\d+-\d*|-\d+)$")
+
+
+def _requested_range(request: Request) -> Optional[str]:
+    """
+    Range, который можно передать в S3, или None — тогда отдаём объект целиком.
+
+    If-Range без HEAD к S3 не проверить, поэтому с ним Range игнорируется:
+    полный ответ 200 по RFC 9110 всегда допустим.
+    """
+    value = request.headers.get("range")
+    if not value or request.headers.get("if-range"):
+        return None
+    value = value.replace(" ", "")
+    return value if _SINGLE_RANGE_RE.match(value) else None
+
+
+def _if_modified_since(request: Request) -> Optional[datetime]:
+    # If-Modified-Since учитывается только без If-None-Match (RFC 9110, 13.1.3)
+    value = request.headers.get("if-modified-since")
+    if not value or request.headers.get("if-none-match"):
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_date(value) -> Optional[str]:
+    if isinstance(value, datetime):
+        return format_datetime(value, usegmt=True)
+    return value
+
+
+def _iter_body(body, chunk_size: int) -> Iterator[bytes]:
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def _content_disposition(key: str) -> str:
+    filename = key.split("/")[-1] if "/" in key else key
+    return f'attachment; filename="{filename}"'
+
 
 @router.get("/download")
 def download_file(
+    request: Request,
     key: str = Query(..., description="S3 key файла"),
     hd: bool = Query(False, description="Если true — апскейл перед скачиванием"),
+    mode: Optional[Literal["proxy", "redirect"]] = Query(
+        None,
+        description="proxy — отдать файл через API, redirect — 302 на presigned URL S3 (по умолчанию DOWNLOAD_MODE)",
+    ),
 ) -> Response:
     """
     Скачать сгенерированную картинку из S3 по ключу.
 
-    Отдаёт как attachment с filename из ключа.
+    Отдаёт как attachment с filename из ключа. Тело стримится из S3 кусками;
+    поддерживаются Range (206) и условные запросы по ETag/Last-Modified (304).
+    С hd=true отдаётся закэшированная HD-копия (и те же Range/304 для неё).
+    В режиме redirect API отвечает 302 на короткоживущую presigned-ссылку,
+    а байты идут клиенту напрямую из S3 (Range и 304 там тоже работают).
     """
     if not key or key.strip() == "":
         raise HTTPException(
@@ -22,27 +86,67 @@ def download_file(
             detail="Параметр key обязателен",
         )
 
-    file_bytes, content_type = download_file_from_s3(key)
-    if file_bytes is None:
+    # Опциональный апскейл при скачивании: HD-копия считается один раз и лежит в S3
+    source_key = key
+    if hd:
+        source_key = ensure_hd_rendition(key)
+        if source_key is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Файл не найден",
+            )
+
+    if (mode or settings.DOWNLOAD_MODE) == "redirect":
+        presigned_url = create_presigned_url_download(
+            source_key,
+            expires_in=settings.DOWNLOAD_PRESIGN_EXPIRES_SECONDS,
+            content_disposition=_content_disposition(key),
+        )
+        if not presigned_url:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Не удалось сгенерировать ссылку для скачивания",
+            )
+        # Ссылка одноразовая по смыслу: кэшировать редирект нельзя, она скоро истечёт
+        return RedirectResponse(
+            presigned_url,
+            status_code=status.HTTP_302_FOUND,
+            headers={"Cache-Control": "no-store"},
+        )
+
+    obj = open_file_stream(
+        source_key,
+        byte_range=_requested_range(request),
+        if_none_match=request.headers.get("if-none-match"),
+        if_modified_since=_if_modified_since(request),
+    )
+    if obj is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Файл не найден",
         )
 
-    # Опциональный апскейл при скачивании
-    if hd:
-        fmt = "webp" if (content_type and "webp" in content_type.lower()) else "png"
-        upscaled_bytes, upscaled_type = upscale_image_fast(file_bytes, output_format=fmt)
-        if upscaled_bytes:
-            file_bytes = upscaled_bytes
-            content_type = upscaled_type
+    headers = {"Accept-Ranges": "bytes"}
+    if obj.get("ETag"):
+        headers["ETag"] = obj["ETag"]
+    if obj.get("LastModified"):
+        headers["Last-Modified"] = _http_date(obj["LastModified"])
 
-    filename = key.split("/")[-1] if "/" in key else key
-    return Response(
-        content=file_bytes,
-        media_type=content_type or "image/png",
-        headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
-        },
-    )
+    if obj["StatusCode"] == status.HTTP_304_NOT_MODIFIED:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if obj["StatusCode"] == status.HTTP_416_RANGE_NOT_SATISFIABLE:
+        if obj.get("ContentLength") is not None:
+            headers["Content-Range"] = f"bytes */{obj['ContentLength']}"
+        return Response(status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, headers=headers)
+
+    headers["Content-Disposition"] = _content_disposition(key)
+    headers["Content-Length"] = str(obj["ContentLength"])
+    if obj.get("ContentRange"):
+        headers["Content-Range"] = obj["ContentRange"]
 
+    return StreamingResponse(
+        _iter_body(obj["Body"], settings.S3_DOWNLOAD_STREAM_CHUNK_SIZE),
+        status_code=obj["StatusCode"],
+        media_type=obj.get("ContentType") or "image/png",
+        headers=headers,
+    )
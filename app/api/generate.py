@@ -1,21 +1,37 @@
-from typing import Annotated, Optional
+import json
+import uuid
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, HttpUrl
-from celery.result import AsyncResult
+from celery.result import AsyncResult, GroupResult
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user, get_stream_user_id, oauth2_scheme_optional
+from app.core.config import get_settings
 from app.core.database import get_db
 from app.core.styles_catalog import STYLE_IDS
+from app.services.balance_cache import cache_balance
+from app.services.events import publish_task_event, stream_user_events
 from app.services.generations import consume_generation
+from app.services.redis_client import get_redis
+from app.services.user_cache import invalidate_user
+from app.models.generation_result import GenerationResult
 from app.models.upload import Upload
 from app.models.user import User
-from app.workers.tasks import generate_image_task
 from app.workers.celery_app import celery_app
+from app.workers.outbox import add_to_outbox, wake_relay
+from app.workers.queues import generation_queue
 
 router = APIRouter(prefix="/generate", tags=["generate"])
 
+settings = get_settings()
+
+BATCH_OWNER_PREFIX = "gen:batch:owner:"
+BATCH_OWNER_TTL_SECONDS = 7 * 24 * 3600
+
 
 class GenerateRequest(BaseModel):
     image_url: HttpUrl = Field(..., description="URL of the input image")
@@ -25,6 +41,10 @@ class GenerateRequest(BaseModel):
         description="ID сохраненного аплоада, чтобы записать after-изображение",
     )
     is_hd: bool = Field(False, description="Запросить HD-генерацию (спишет HD-кредит)")
+    new_variation: bool = Field(
+        False,
+        description="Сгенерировать новую вариацию, не используя ранее полученный результат",
+    )
 
 
 class GenerateResponse(BaseModel):
@@ -37,9 +57,38 @@ class TaskStatusResponse(BaseModel):
     filename: Optional[str] = Field(None, description="Filename of generated image in storage")
     style_id: Optional[str] = Field(None, description="Style id that was applied")
     style_meta: Optional[dict] = Field(None, description="Selected style variants (furniture/walls/lighting/camera)")
+    cached: Optional[bool] = Field(None, description="Result was served from the generation cache")
+    stage: Optional[str] = Field(None, description="Current pipeline stage (if status is STARTED)")
     error: Optional[str] = Field(None, description="Error message (if status is FAILURE)")
 
 
+class BatchGenerateRequest(BaseModel):
+    upload_id: int = Field(..., description="ID аплоада, для которого генерируем стили")
+    styles: List[str] = Field(..., min_length=1, description="Список style id, см. /styles")
+    is_hd: bool = Field(False, description="HD для всех стилей (спишет HD-кредит за каждый)")
+    new_variation: bool = Field(
+        False,
+        description="Сгенерировать новые вариации, не используя ранее полученные результаты",
+    )
+
+
+class BatchGenerateResponse(BaseModel):
+    batch_id: str = Field(..., description="ID пакета для /generate/batch/{batch_id}")
+    task_ids: List[str] = Field(..., description="Celery task IDs в порядке стилей")
+
+
+class BatchItemStatus(TaskStatusResponse):
+    task_id: str
+
+
+class BatchStatusResponse(BaseModel):
+    batch_id: str
+    status: str = Field(..., description="PENDING, STARTED, SUCCESS, PARTIAL, FAILURE")
+    total: int
+    completed: int
+    items: List[BatchItemStatus]
+
+
 @router.post("", response_model=GenerateResponse, status_code=status.HTTP_202_ACCEPTED)
 def create_generate_task(
     request: GenerateRequest,
@@ -65,68 +114,75 @@ def create_generate_task(
             detail="Неподдерживаемый стиль. Проверьте список в /styles",
         )
 
-    # Проверка и списание генерации
-    try:
-        consume_generation(db, current_user, is_hd=request.is_hd)
-    except ValueError as exc:
-        raise HTTPException(
-            status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail=str(exc),
-        )
-
-    # Проверяем, что upload принадлежит пользователю (если указан)
+    # Проверяем, что upload принадлежит пользователю (если указан), и сразу пишем стиль
     if request.upload_id is not None:
-        upload = (
+        updated = (
             db.query(Upload)
             .filter(
                 Upload.id == request.upload_id,
                 Upload.created_by == current_user.id,
             )
-            .first()
+            .update({Upload.style: style_id}, synchronize_session=False)
         )
-        if not upload:
+        if not updated:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Аплоад не найден",
             )
-        upload.style = style_id
-        db.add(upload)
-        db.commit()
+
+    # Проверка и списание генерации
+    try:
+        balance = consume_generation(db, current_user, is_hd=request.is_hd, commit=False)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=str(exc),
+        )
 
     # Обновляем счетчик генераций пользователя
-    current_user.generation_count = (current_user.generation_count or 0) + 1
+    # Инкремент в SQL: закэшированное значение счётчика могло устареть
+    current_user.generation_count = User.generation_count + 1
     db.add(current_user)
-    db.commit()
 
-    # Queue the task (пробрасываем upload_id чтобы записать after)
-    task = generate_image_task.delay(
-        str(request.image_url),
-        style_id,
-        request.upload_id,
-        current_user.id,
-        request.is_hd,
+    # Пайплайн (пробрасываем upload_id чтобы записать after) уходит в брокер через outbox;
+    # стадия generate — в очередь по тарифу и HD, чтобы платные задачи не ждали бесплатные
+    job_id = str(uuid.uuid4())
+    add_to_outbox(
+        db,
+        [
+            {
+                "job_id": job_id,
+                "image_url": str(request.image_url),
+                "style": style_id,
+                "upload_id": request.upload_id,
+                "user_id": current_user.id,
+                "is_hd": request.is_hd,
+                "new_variation": request.new_variation,
+                "generate_queue": generation_queue(balance, request.is_hd),
+            }
+        ],
     )
+    # Списание, аплоад, счётчик и задача — одним commit
+    user_id = current_user.id
+    db.commit()
+    wake_relay()
+    cache_balance(balance)
+    invalidate_user(user_id)
+    publish_task_event(user_id, job_id, "PENDING", style_id=style_id)
 
-    return GenerateResponse(task_id=task.id)
+    return GenerateResponse(task_id=job_id)
 
 
-@router.get("/status/{task_id}", response_model=TaskStatusResponse)
-def get_task_status(
-    task_id: str,
-    current_user: User = Depends(get_current_user),
-) -> TaskStatusResponse:
-    """
-    Get the status of a generation task.
-    
-    Requires authentication.
-    """
-    task_result = AsyncResult(task_id, app=celery_app)
-    
+def _task_status(task_result: AsyncResult) -> TaskStatusResponse:
     # Map Celery states to our response format
     if task_result.state == "PENDING":
         response = TaskStatusResponse(status="PENDING")
     elif task_result.state == "STARTED":
-        response = TaskStatusResponse(status="STARTED")
+        info = task_result.info
+        response = TaskStatusResponse(
+            status="STARTED",
+            stage=info.get("stage") if isinstance(info, dict) else None,
+        )
     elif task_result.state == "SUCCESS":
         result = task_result.result
         if isinstance(result, dict):
@@ -136,6 +192,7 @@ def get_task_status(
                 filename=result.get("filename"),
                 style_id=result.get("style_id"),
                 style_meta=result.get("style_meta"),
+                cached=result.get("cached"),
             )
         else:
             response = TaskStatusResponse(
@@ -154,3 +211,212 @@ def get_task_status(
     
     return response
 
+
+@router.get("/status/{task_id}", response_model=TaskStatusResponse)
+def get_task_status(
+    task_id: str,
+    current_user: User = Depends(get_current_user),
+) -> TaskStatusResponse:
+    """
+    Get the status of a generation task.
+    
+    Requires authentication.
+    """
+    return _task_status(AsyncResult(task_id, app=celery_app))
+
+
+@router.post("/batch", response_model=BatchGenerateResponse, status_code=status.HTTP_202_ACCEPTED)
+def create_generate_batch(
+    request: BatchGenerateRequest,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Annotated[Session, Depends(get_db)],
+) -> BatchGenerateResponse:
+    """
+    Сгенерировать несколько стилей для одного аплоада.
+
+    Кредиты списываются одной транзакцией за все стили, задачи уходят Celery group,
+    исходник скачивается один раз на весь пакет.
+    """
+    style_ids = list(dict.fromkeys(style.lower() for style in request.styles))
+    if len(style_ids) > settings.GENERATE_BATCH_MAX_STYLES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Не больше {settings.GENERATE_BATCH_MAX_STYLES} стилей за раз",
+        )
+    unknown = [style_id for style_id in style_ids if style_id not in STYLE_IDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Неподдерживаемые стили: {', '.join(unknown)}. Проверьте список в /styles",
+        )
+
+    upload = (
+        db.query(Upload)
+        .filter(
+            Upload.id == request.upload_id,
+            Upload.created_by == current_user.id,
+        )
+        .first()
+    )
+    if not upload:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Аплоад не найден",
+        )
+
+    try:
+        balance = consume_generation(db, current_user, is_hd=request.is_hd, count=len(style_ids), commit=False)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail=str(exc),
+        )
+
+    current_user.generation_count = User.generation_count + len(style_ids)
+    db.add(current_user)
+
+    batch_id = str(uuid.uuid4())
+    generate_queue = generation_queue(balance, request.is_hd)
+    jobs = [
+        {
+            "job_id": str(uuid.uuid4()),
+            "image_url": upload.before_url,
+            "style": style_id,
+            "upload_id": upload.id,
+            "user_id": current_user.id,
+            "is_hd": request.is_hd,
+            "new_variation": request.new_variation,
+            "generate_queue": generate_queue,
+            "batch_id": batch_id,
+        }
+        for style_id in style_ids
+    ]
+    add_to_outbox(db, jobs, batch_id=batch_id)
+    user_id = current_user.id
+    db.commit()
+    wake_relay()
+    cache_balance(balance)
+    invalidate_user(user_id)
+
+    # id задач выданы заранее, поэтому статус пакета доступен ещё до публикации group
+    group_result = GroupResult(
+        batch_id, [AsyncResult(job["job_id"], app=celery_app) for job in jobs], app=celery_app
+    )
+    group_result.save()
+    get_redis().setex(f"{BATCH_OWNER_PREFIX}{batch_id}", BATCH_OWNER_TTL_SECONDS, str(user_id))
+
+    task_ids = [child.id for child in group_result.results]
+    for task_id, style_id in zip(task_ids, style_ids):
+        publish_task_event(user_id, task_id, "PENDING", style_id=style_id, batch_id=batch_id)
+
+    return BatchGenerateResponse(batch_id=batch_id, task_ids=task_ids)
+
+
+@router.get("/batch/{batch_id}", response_model=BatchStatusResponse)
+def get_batch_status(
+    batch_id: str,
+    current_user: Annotated[User, Depends(get_current_user)],
+    db: Annotated[Session, Depends(get_db)],
+) -> BatchStatusResponse:
+    """
+    Сводный статус пакета: SUCCESS/FAILURE, если все задачи закончились одинаково, иначе PARTIAL.
+
+    Готовые результаты берутся из generation_results (по строке на стиль), поэтому
+    они видны и после того, как result backend забыл задачу.
+    """
+    owner = get_redis().get(f"{BATCH_OWNER_PREFIX}{batch_id}")
+    group_result = GroupResult.restore(batch_id, app=celery_app)
+    if owner != str(current_user.id) or group_result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Пакет не найден",
+        )
+
+    stored = {
+        result.job_id: result
+        for result in db.query(GenerationResult).filter(GenerationResult.batch_id == batch_id)
+    }
+    items = []
+    for child in group_result.results:
+        item = BatchItemStatus(task_id=child.id, **_task_status(child).model_dump())
+        result = stored.get(child.id)
+        if result and item.status != "SUCCESS":
+            item = BatchItemStatus(
+                task_id=child.id, status="SUCCESS", result_url=result.result_url, style_id=result.style
+            )
+        items.append(item)
+    states = {item.status for item in items}
+    completed = sum(1 for item in items if item.status in ("SUCCESS", "FAILURE"))
+    if completed == len(items):
+        overall = states.pop() if len(states) == 1 else "PARTIAL"
+    elif states == {"PENDING"}:
+        overall = "PENDING"
+    else:
+        overall = "STARTED"
+
+    return BatchStatusResponse(
+        batch_id=batch_id,
+        status=overall,
+        total=len(items),
+        completed=completed,
+        items=items,
+    )
+
+
+@router.get("/events")
+async def stream_generation_events(
+    request: Request,
+    token: Annotated[Optional[str], Depends(oauth2_scheme_optional)],
+    access_token: Optional[str] = Query(None, description="JWT, если клиент не может передать заголовок (EventSource)"),
+    last_event_id: Optional[str] = Query(None, description="Продолжить после этого события"),
+) -> StreamingResponse:
+    """
+    Server-Sent Events со сменами статусов всех задач генерации пользователя.
+
+    Заменяет поллинг /generate/status: одно соединение, heartbeat-комментарии,
+    докачка пропущенных событий по заголовку Last-Event-ID.
+    """
+    user_id = await run_in_threadpool(get_stream_user_id, token or access_token)
+    resume_from = request.headers.get("last-event-id") or last_event_id
+
+    async def event_source():
+        yield "retry: 3000\n\n"
+        async for event in stream_user_events(user_id, resume_from):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": heartbeat\n\n"
+                continue
+            event_id, payload = event
+            yield f"id: {event_id}\nevent: task\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/events/ws")
+async def generation_events_ws(
+    websocket: WebSocket,
+    access_token: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Query(None),
+) -> None:
+    """WebSocket-вариант /generate/events: сообщения {"type": "task"|"heartbeat", ...}."""
+    try:
+        user_id = await run_in_threadpool(get_stream_user_id, access_token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    try:
+        async for event in stream_user_events(user_id, last_event_id):
+            if event is None:
+                await websocket.send_json({"type": "heartbeat"})
+                continue
+            event_id, payload = event
+            await websocket.send_json({"type": "task", "id": event_id, "data": payload})
+    except WebSocketDisconnect:
+        pass
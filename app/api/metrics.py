@@ -0,0 +1,32 @@
+import hmac
+from typing import Annotated, Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+
+from app.core.config import get_settings
+from app.services import metrics
+
+settings = get_settings()
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+def require_metrics_token(
+    x_metrics_token: Annotated[Optional[str], Header()] = None,
+) -> None:
+    """Пускать к счётчикам только со служебным токеном: наружу они не отдаются."""
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_metrics_token or not hmac.compare_digest(x_metrics_token, settings.METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав")
+
+
+@router.get("", response_model=Dict[str, float], dependencies=[Depends(require_metrics_token)])
+def get_metrics() -> Dict[str, float]:
+    """
+    Сводные счётчики всех процессов API и воркеров.
+
+    Для таймеров отдаются пары `<name>:count` и `<name>:sum_ms`.
+    Нужен заголовок X-Metrics-Token со значением METRICS_TOKEN.
+    """
+    return metrics.snapshot()
@@ -1,8 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 from pydantic import BaseModel
 from typing import List
 
 from app.core.styles_catalog import get_public_styles
+from app.services.style_stats import popular_styles
 
 router = APIRouter(prefix="/styles", tags=["styles"])
 
@@ -13,6 +14,10 @@ class Style(BaseModel):
     description: str
 
 
+class PopularStyle(Style):
+    count: int
+
+
 @router.get("", response_model=List[Style])
 def get_styles() -> List[Style]:
     """
@@ -22,3 +27,14 @@ def get_styles() -> List[Style]:
     """
     return [Style(**style) for style in get_public_styles()]
 
+
+
+@router.get("/popular", response_model=List[PopularStyle])
+def get_popular_styles(limit: int = Query(10, ge=1, le=100)) -> List[PopularStyle]:
+    """
+    Styles ranked by number of generations.
+
+    Counters are served from Redis and include generations not yet flushed to the database.
+    No authentication required.
+    """
+    return [PopularStyle(**style) for style in popular_styles(limit)]
@@ -1,3 +1,5 @@
+import base64
+import binascii
 import re
 import uuid
 import io
@@ -5,24 +7,36 @@ from datetime import datetime, timedelta
 from typing import List, Optional
 import traceback
 
-from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Query, Response
 from pydantic import BaseModel, Field, field_validator
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
+from boto3.exceptions import S3UploadFailedError
 from botocore.exceptions import ClientError
+from starlette.concurrency import run_in_threadpool
 
 from app.api.deps import get_current_user
+from app.core.config import get_settings
 from app.core.database import get_db
+from app.models.generation_result import GenerationResult
 from app.models.upload import Upload
 from app.models.user import User
+from app.services.renditions import delete_renditions_for
 from app.services.s3 import (
     create_presigned_url_upload,
     delete_file_by_url,
     get_file_url,
     upload_fileobj_to_s3,
 )
+from app.workers.renditions import enqueue_renditions
+from app.workers.uploads import shared_result_urls
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
+settings = get_settings()
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 
 def normalize_filename(filename: str) -> str:
     """
@@ -81,47 +95,43 @@ class UploadResponse(BaseModel):
         populate_by_name = True
 
 
+class GenerationResultRecord(BaseModel):
+    task_id: str = Field(..., alias="job_id")
+    style: Optional[str]
+    result_url: str
+    thumb: Optional[str] = Field(None, alias="thumb_url", description="WebP-миниатюра результата")
+    preview: Optional[str] = Field(None, alias="preview_url", description="WebP-превью результата")
+    batch_id: Optional[str]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+        populate_by_name = True
+
+
 class UploadRecord(BaseModel):
     id: int
     before: str = Field(..., alias="before_url")
     after: Optional[str] = Field(None, alias="after_url")
+    before_thumb: Optional[str] = Field(None, alias="before_thumb_url", description="WebP-миниатюра исходника")
+    before_preview: Optional[str] = Field(None, alias="before_preview_url", description="WebP-превью исходника")
+    after_thumb: Optional[str] = Field(None, alias="after_thumb_url", description="WebP-миниатюра результата")
+    after_preview: Optional[str] = Field(None, alias="after_preview_url", description="WebP-превью результата")
     style: Optional[str]
     created_by: int
     created_at: datetime
     expires_at: Optional[datetime]
     days_left: Optional[int]
+    results: List[GenerationResultRecord] = Field(
+        default_factory=list,
+        description="Все результаты аплоада, у пакета стилей — по одному на стиль",
+    )
 
     class Config:
         from_attributes = True
         populate_by_name = True
 
 
-def _cleanup_expired_uploads(db: Session) -> None:
-    now = datetime.utcnow()
-    expired = (
-        db.query(Upload)
-        .filter(Upload.expires_at != None, Upload.expires_at < now)
-        .all()
-    )
-    for upload in expired:
-        for url in [upload.before_url, upload.after_url]:
-            if url:
-                try:
-                    delete_file_by_url(url)
-                except Exception as e:
-                    print(f"Failed to delete expired file {url} from S3: {e}")
-        db.delete(upload)
-    if expired:
-        db.commit()
-
-
-def _update_days_left(upload: Upload) -> None:
-    if upload.expires_at:
-        delta = upload.expires_at - datetime.utcnow()
-        days_left = max(0, int(delta.total_seconds() // 86400))
-        upload.days_left = days_left
-
-
 @router.post("/presign", response_model=PresignedUrlResponse)
 def create_presigned_url(
     request: PresignedUrlRequest,
@@ -219,23 +229,25 @@ async def upload_file(
     
     # Upload file to S3
     try:
-        # Read file content
-        file_content = await file.read()
-        
-        if not file_content:
+        # Тело запроса уже лежит в SpooledTemporaryFile (большие файлы — на диске),
+        # поэтому не читаем его целиком в память, а стримим в S3 кусками
+        file_size = file.size
+        if file_size is None:
+            file.file.seek(0, io.SEEK_END)
+            file_size = file.file.tell()
+
+        if not file_size:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Файл пустой"
             )
         
-        # Create file-like object from bytes
-        file_obj = io.BytesIO(file_content)
-        
-        # Upload to S3
-        upload_fileobj_to_s3(
-            file_obj,
+        # Upload to S3 (блокирующий boto3 — вне event loop)
+        await run_in_threadpool(
+            upload_fileobj_to_s3,
+            file.file,
             s3_filename,
-            content_type=content_type
+            content_type=content_type,
         )
         
         # Generate public URL
@@ -247,10 +259,10 @@ async def upload_file(
             created_by=current_user.id,
         )
         upload_record.set_expiry(30)
-        _update_days_left(upload_record)
         db.add(upload_record)
         db.commit()
         db.refresh(upload_record)
+        enqueue_renditions(upload_record.id, "before")
 
         return UploadResponse(
             file_url=file_url,
@@ -278,6 +290,14 @@ async def upload_file(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка S3 загрузки: {error_code} - {error_message}"
         )
+    except S3UploadFailedError as e:
+        error_trace = traceback.format_exc()
+        print(f"S3 upload failed: {e}")
+        print(f"Traceback: {error_trace}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка S3 загрузки: {str(e)}"
+        )
     except Exception as e:
         # Log full traceback for debugging
         error_trace = traceback.format_exc()
@@ -288,25 +308,112 @@ async def upload_file(
         )
 
 
+# Колонки для списка: без ORM-объектов и лишних полей
+_LIST_COLUMNS = (
+    Upload.id,
+    Upload.before_url,
+    Upload.after_url,
+    Upload.before_thumb_url,
+    Upload.before_preview_url,
+    Upload.after_thumb_url,
+    Upload.after_preview_url,
+    Upload.style,
+    Upload.created_by,
+    Upload.created_at,
+    Upload.expires_at,
+)
+
+
+def _encode_cursor(created_at: datetime, upload_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{upload_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, upload_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(upload_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректный cursor",
+        )
+
+
+def _days_left(expires_at: Optional[datetime], now: datetime) -> Optional[int]:
+    if not expires_at:
+        return None
+    return max(0, int((expires_at - now).total_seconds() // 86400))
+
+
 @router.get("", response_model=List[UploadRecord])
 def list_uploads(
+    response: Response,
+    limit: Optional[int] = Query(
+        None,
+        ge=1,
+        le=200,
+        description="Размер страницы; без limit и cursor возвращается вся история, как раньше",
+    ),
+    cursor: Optional[str] = Query(None, description="Значение заголовка X-Next-Cursor предыдущей страницы"),
+    style: Optional[str] = Query(None, description="Только аплоады с этим стилем"),
+    has_result: Optional[bool] = Query(None, description="true — только с результатом, false — только без"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ) -> List[UploadRecord]:
     """
-    Получить список аплоадов пользователя (последние сверху).
+    Получить страницу аплоадов пользователя (последние сверху).
+
+    Keyset-пагинация по (created_at, id) по индексу ix_uploads_created_by_created_at_id:
+    следующая страница запрашивается с cursor из заголовка X-Next-Cursor, заголовка
+    нет — страниц больше нет. Без limit и cursor отдаётся вся история (прежнее
+    поведение для старых клиентов, которые не читают заголовок); cursor без limit —
+    страница UPLOAD_LIST_DEFAULT_LIMIT. Фильтры style и has_result проверяются на том же
+    проходе по индексу. Просроченные записи удаляет uploads.reap_expired
+    по расписанию; до этого они просто не показываются.
     """
-    _cleanup_expired_uploads(db)
-    uploads = (
-        db.query(Upload)
-        .filter(Upload.created_by == current_user.id)
-        .order_by(Upload.created_at.desc())
-        .all()
+    if limit is None and cursor:
+        limit = settings.UPLOAD_LIST_DEFAULT_LIMIT
+    now = datetime.utcnow()
+    query = db.query(*_LIST_COLUMNS).filter(
+        Upload.created_by == current_user.id,
+        or_(Upload.expires_at.is_(None), Upload.expires_at >= now),
     )
-    for u in uploads:
-        _update_days_left(u)
-    db.commit()
-    return uploads
+    if style:
+        query = query.filter(Upload.style == style.lower())
+    if has_result is not None:
+        query = query.filter(Upload.after_url.is_not(None) if has_result else Upload.after_url.is_(None))
+    if cursor:
+        created_at, upload_id = _decode_cursor(cursor)
+        # created_at <= ... даёт границу диапазона индекса, остальное — фильтр внутри него
+        query = query.filter(
+            Upload.created_at <= created_at,
+            or_(Upload.created_at < created_at, and_(Upload.created_at == created_at, Upload.id > upload_id)),
+        )
+
+    query = query.order_by(Upload.created_at.desc(), Upload.id)
+    if limit is None:
+        rows = query.all()
+    else:
+        rows = query.limit(limit + 1).all()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = _encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    # Результаты всей страницы одним запросом по ix_generation_results_upload_id
+    results = {}
+    if rows:
+        for result in (
+            db.query(GenerationResult)
+            .filter(GenerationResult.upload_id.in_([row.id for row in rows]))
+            .order_by(GenerationResult.id)
+        ):
+            results.setdefault(result.upload_id, []).append(GenerationResultRecord.model_validate(result))
+    return [
+        UploadRecord(**row._mapping, days_left=_days_left(row.expires_at, now), results=results.get(row.id, []))
+        for row in rows
+    ]
 
 
 @router.delete("/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -333,14 +440,21 @@ def delete_upload(
             detail="Аплоад не найден",
         )
 
-    # Чистим S3 (если ссылки валидные)
-    for url in [upload.before_url, upload.after_url]:
+    # Чистим S3 (если ссылки валидные): исходник и все результаты, кроме общих с другими аплоадами
+    result_urls = {upload.after_url} | {
+        url for (url,) in db.query(GenerationResult.result_url).filter(GenerationResult.upload_id == upload.id)
+    }
+    result_urls.discard(None)
+    urls = [upload.before_url, *(result_urls - shared_result_urls(db, result_urls, [upload.id]))]
+    for url in urls:
         if url:
             try:
                 delete_file_by_url(url)
             except Exception as e:
                 # Не падаем если не удалось удалить, но логируем
                 print(f"Failed to delete file {url} from S3: {e}")
+            delete_renditions_for(url)
 
+    db.query(GenerationResult).filter(GenerationResult.upload_id == upload.id).delete(synchronize_session=False)
     db.delete(upload)
     db.commit()
@@ -18,6 +18,15 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = "HS256"
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
     JWT_REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    # Проверка JWT: "jose" или "hmac" (stdlib, только HS*); проверенные claims кэшируются до exp
+    JWT_VERIFY_BACKEND: str = "jose"
+    JWT_CLAIMS_CACHE_MAXSIZE: int = 10000
+    JWT_CLAIMS_CACHE_MAX_TTL_SECONDS: float = 300.0
+    # bcrypt: стоимость (при смене старые хэши пересчитываются при логине) и пул процессов
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE_LIMIT: int = 16  # ждущих сверх числа воркеров, дальше — 503
+    PASSWORD_HASH_TIMEOUT_SECONDS: float = 10.0
 
     # S3 Configuration - поддерживаем оба варианта имен (старые и новые)
     AWS_ACCESS_KEY_ID: Optional[str] = None
@@ -25,12 +34,129 @@ class Settings(BaseSettings):
     AWS_S3_BUCKET_NAME: Optional[str] = None
     AWS_S3_REGION: str = "us-east-1"
     AWS_S3_ENDPOINT_URL: Optional[str] = None
+    S3_MAX_POOL_CONNECTIONS: int = 20
+    S3_READ_CHUNK_SIZE: int = 8 * 1024 * 1024  # размер ranged GET при чтении из бакета
+    S3_READ_CONCURRENCY: int = 4
+    S3_DOWNLOAD_STREAM_CHUNK_SIZE: int = 256 * 1024  # кусок при отдаче /api/download клиенту
+    # /api/download: "proxy" — стримим через API, "redirect" — 302 на presigned URL
+    DOWNLOAD_MODE: str = "proxy"
+    DOWNLOAD_PRESIGN_EXPIRES_SECONDS: int = 300
+    # Загрузка: пиковая память на запрос ~ S3_UPLOAD_CHUNK_SIZE * S3_UPLOAD_MAX_CONCURRENCY
+    S3_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024
+    S3_UPLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024
+    S3_UPLOAD_MAX_CONCURRENCY: int = 2
 
     # Redis/Celery Configuration
     REDIS_URL: str = "redis://localhost:6379/0"
     CELERY_BROKER_URL: Optional[str] = None
     CELERY_RESULT_BACKEND: Optional[str] = None
 
+    # Общий HTTP-клиент воркеров (загрузка исходников, апскейлер)
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 20
+    HTTP_CLIENT_MAX_KEEPALIVE: int = 10
+    HTTP_CLIENT_KEEPALIVE_EXPIRY: float = 60.0
+    HTTP_CLIENT_CONNECT_TIMEOUT: float = 10.0
+    HTTP_CLIENT_READ_TIMEOUT: float = 60.0
+    HTTP_CLIENT_POOL_TIMEOUT: float = 10.0
+    HTTP_CLIENT_HTTP2: bool = True
+    HTTP_CLIENT_WARMUP_URLS: str = "https://api.stability.ai"  # comma-separated list
+
+    # Пакетная генерация: несколько стилей для одного аплоада
+    GENERATE_BATCH_MAX_STYLES: int = 5
+    SHARED_SOURCE_TTL_SECONDS: int = 600
+    SHARED_SOURCE_WAIT_SECONDS: float = 30.0
+
+    # События генерации (SSE / WebSocket)
+    EVENTS_HEARTBEAT_SECONDS: float = 15.0
+    EVENTS_STREAM_MAXLEN: int = 200
+    EVENTS_STREAM_TTL_SECONDS: int = 24 * 3600
+
+    # Метрики: как часто сбрасывать локальные счётчики в Redis
+    METRICS_FLUSH_INTERVAL_SECONDS: float = 5.0
+    # Токен для GET /metrics (заголовок X-Metrics-Token); без него эндпоинт отдаёт 404
+    METRICS_TOKEN: Optional[str] = None
+
+    # Кэш результатов генерации (одинаковый исходник + стиль + вариации + HD)
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+
+    # Кэш пользователя для get_current_user: память процесса + Redis
+    USER_CACHE_ENABLED: bool = True
+    USER_CACHE_LOCAL_MAXSIZE: int = 10000
+    USER_CACHE_LOCAL_TTL_SECONDS: float = 30.0
+    USER_CACHE_REDIS_TTL_SECONDS: int = 300
+
+    # Баланс генераций для /billing/balance: Redis с write-through после списаний и покупок
+    BALANCE_CACHE_ENABLED: bool = True
+    BALANCE_CACHE_TTL_SECONDS: int = 600
+    BALANCE_RECONCILE_BATCH_SIZE: int = 500
+
+    # Relay outbox задач генерации: размер пачки, опрос, если wakeup не пришёл, и число
+    # попыток для ошибок не брокера, после которых задача уходит в dead-letter с возвратом кредитов
+    OUTBOX_RELAY_BATCH_SIZE: int = 100
+    OUTBOX_RELAY_POLL_SECONDS: float = 1.0
+    OUTBOX_MAX_ATTEMPTS: int = 5
+
+    # Счётчики популярности стилей: перенос из Redis в style_stats и TTL итогов для /styles/popular
+    STYLE_STATS_FLUSH_SECONDS: float = 30.0
+    STYLE_STATS_TOTALS_TTL_SECONDS: int = 3600
+
+    # Удаление просроченных аплоадов по расписанию (celery beat)
+    UPLOAD_REAPER_INTERVAL_SECONDS: float = 900.0
+    UPLOAD_REAPER_BATCH_SIZE: int = 500
+    UPLOAD_REAPER_LOCK_SECONDS: int = 300
+
+    # Размер страницы GET /upload, если передан cursor без limit (без обоих — вся история)
+    UPLOAD_LIST_DEFAULT_LIMIT: int = 50
+
+    # Очереди генерации: concurrency и prefetch воркера для каждой очереди
+    GENERATE_QUEUE_PAID_HD_CONCURRENCY: int = 2
+    GENERATE_QUEUE_PAID_HD_PREFETCH: int = 1
+    GENERATE_QUEUE_PAID_CONCURRENCY: int = 4
+    GENERATE_QUEUE_PAID_PREFETCH: int = 1
+    GENERATE_QUEUE_FREE_HD_CONCURRENCY: int = 1
+    GENERATE_QUEUE_FREE_HD_PREFETCH: int = 1
+    GENERATE_QUEUE_FREE_CONCURRENCY: int = 2
+    GENERATE_QUEUE_FREE_PREFETCH: int = 2
+
+    # Стадии конвейера генерации: concurrency/prefetch и TTL промежуточных байтов
+    PIPELINE_FETCH_CONCURRENCY: int = 8
+    PIPELINE_FETCH_PREFETCH: int = 4
+    PIPELINE_UPSCALE_CONCURRENCY: int = 2
+    PIPELINE_UPSCALE_PREFETCH: int = 1
+    PIPELINE_STORE_CONCURRENCY: int = 8
+    PIPELINE_STORE_PREFETCH: int = 4
+    PIPELINE_FINALIZE_CONCURRENCY: int = 4
+    PIPELINE_FINALIZE_PREFETCH: int = 8
+    PIPELINE_BLOB_TTL_SECONDS: int = 2 * 3600
+
+    # Предобработка исходника перед Gemini (поворот по EXIF, уменьшение, пережатие)
+    SOURCE_PREPROCESS_ENABLED: bool = True
+    SOURCE_MAX_EDGE: int = 2048
+    SOURCE_JPEG_QUALITY: int = 88
+
+    # Уменьшенные копии для истории (WebP рядом с оригиналом в S3)
+    RENDITION_THUMB_EDGE: int = 320
+    RENDITION_PREVIEW_EDGE: int = 1024
+    RENDITION_WEBP_QUALITY: int = 80
+    RENDITIONS_CONCURRENCY: int = 4
+    RENDITIONS_PREFETCH: int = 2
+    RENDITIONS_BACKFILL_BATCH_SIZE: int = 200
+
+    # HD-копии для /api/download?hd=true: апскейл один раз, дальше отдаём из S3
+    HD_UPSCALE_LOCK_SECONDS: int = 90
+    HD_UPSCALE_WAIT_SECONDS: float = 75.0
+
+    # Общий для всех воркеров лимит запросов к Gemini (token bucket в Redis)
+    GEMINI_RATE_PER_SECOND: float = 2.0
+    GEMINI_RATE_MIN_PER_SECOND: float = 0.1
+    GEMINI_RATE_BURST: int = 5
+    GEMINI_RATE_DECREASE_FACTOR: float = 0.5  # на 429/503
+    GEMINI_RATE_INCREASE_STEP: float = 0.05  # после успешного вызова
+    GEMINI_PERMIT_MAX_WAIT_SECONDS: float = 60.0
+    GEMINI_THROTTLE_RETRIES: int = 2
+    GEMINI_TASK_MAX_RETRIES: int = 5
+
     # Stability AI Configuration
     AI_KEY: Optional[str] = None
     STABILITY_AI_KEY: Optional[str] = None
@@ -45,6 +171,15 @@ class Settings(BaseSettings):
     SMTP_USE_SSL: bool = False
     RESEND_API_KEY: Optional[str] = None
     RESEND_FROM: Optional[str] = None
+    # Письма уходят через очередь email пачками; False — отправка прямо в запросе
+    EMAIL_QUEUE_ENABLED: bool = True
+    EMAIL_BATCH_SIZE: int = 100
+    EMAIL_BATCH_WINDOW_SECONDS: float = 1.0
+    EMAIL_MAX_RETRIES: int = 6
+    EMAIL_RETRY_BACKOFF_MAX_SECONDS: int = 600
+    EMAIL_SMTP_IDLE_SECONDS: float = 60.0
+    EMAIL_CONCURRENCY: int = 2
+    EMAIL_PREFETCH: int = 4
 
     # Robokassa
     ROBOKASSA_LOGIN: Optional[str] = None
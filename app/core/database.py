@@ -75,6 +75,11 @@ def run_simple_migrations() -> None:
         # Индексы для выборок по пользователю и id
         "CREATE INDEX IF NOT EXISTS ix_uploads_created_by ON uploads (created_by)",
         "CREATE INDEX IF NOT EXISTS ix_uploads_id ON uploads (id)",
+        # Keyset-пагинация истории аплоадов: GET /upload?cursor=
+        """
+        CREATE INDEX IF NOT EXISTS ix_uploads_created_by_created_at_id
+        ON uploads (created_by, created_at DESC, id)
+        """,
         """
         ALTER TABLE uploads
         ADD COLUMN IF NOT EXISTS style VARCHAR(64)
@@ -83,10 +88,32 @@ def run_simple_migrations() -> None:
         ALTER TABLE uploads
         ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITHOUT TIME ZONE
         """,
+        # days_left считается при чтении; колонка осталась от старых версий и больше не пишется
         """
         ALTER TABLE uploads
         ADD COLUMN IF NOT EXISTS days_left INTEGER
         """,
+        # Частичный индекс для удаления просроченных аплоадов (uploads.reap_expired)
+        """
+        CREATE INDEX IF NOT EXISTS ix_uploads_expires_at
+        ON uploads (expires_at) WHERE expires_at IS NOT NULL
+        """,
+        """
+        ALTER TABLE uploads
+        ADD COLUMN IF NOT EXISTS before_thumb_url VARCHAR(512)
+        """,
+        """
+        ALTER TABLE uploads
+        ADD COLUMN IF NOT EXISTS before_preview_url VARCHAR(512)
+        """,
+        """
+        ALTER TABLE uploads
+        ADD COLUMN IF NOT EXISTS after_thumb_url VARCHAR(512)
+        """,
+        """
+        ALTER TABLE uploads
+        ADD COLUMN IF NOT EXISTS after_preview_url VARCHAR(512)
+        """,
         """
         CREATE TABLE IF NOT EXISTS generations (
             id SERIAL PRIMARY KEY,
@@ -147,6 +174,25 @@ def run_simple_migrations() -> None:
             count INTEGER NOT NULL DEFAULT 0
         )
         """,
+        """
+        CREATE TABLE IF NOT EXISTS style_stat_flushes (
+            flush_id VARCHAR(64) PRIMARY KEY,
+            applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (NOW())
+        )
+        """,
+        # Таблицы outbox и generation_results создаёт create_all; колонки — для уже существующих
+        """
+        ALTER TABLE IF EXISTS generation_outbox
+        ADD COLUMN IF NOT EXISTS dead_at TIMESTAMP WITHOUT TIME ZONE
+        """,
+        """
+        ALTER TABLE IF EXISTS generation_results
+        ADD COLUMN IF NOT EXISTS thumb_url VARCHAR(512)
+        """,
+        """
+        ALTER TABLE IF EXISTS generation_results
+        ADD COLUMN IF NOT EXISTS preview_url VARCHAR(512)
+        """,
     ]
 
     with engine.begin() as conn:
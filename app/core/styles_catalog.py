@@ -515,22 +515,24 @@ def get_public_styles() -> List[Dict[str, str]]:
     ]
 
 
-def _pick_variant(style: Dict[str, object], key: str) -> Optional[str]:
+def _pick_variant(style: Dict[str, object], key: str, rng: random.Random) -> Optional[str]:
     """Вернуть случайный вариант из указанной группы или None, если нет данных."""
     variants = style.get("variants") or {}
     options = variants.get(key) if isinstance(variants, dict) else None
     if not options:
         return None
-    return random.choice(options)  # type: ignore[arg-type]
+    return rng.choice(options)  # type: ignore[arg-type]
 
 
 def build_style_prompt(
     style_id: str,
     room_type: Optional[str] = None,
     room_negative: Optional[str] = None,
+    seed: Optional[str] = None,
 ) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, Optional[str]]]]:
     """
     Собрать промпт для стиля с добавлением случайных вариаций по мебели, стенам, свету и камере.
+    Если передан seed, вариации выбираются детерминированно (один и тот же seed — те же вариации).
     Возвращает (positive_prompt, negative_prompt, meta) или (None, None, None), если стиль не найден.
     """
     style_id = style_id.lower()
@@ -538,12 +540,13 @@ def build_style_prompt(
     if not style:
         return None, None, None
 
-    furniture = _pick_variant(style, "furniture")
-    walls = _pick_variant(style, "walls")
-    floors = _pick_variant(style, "floors")
-    ceiling = _pick_variant(style, "ceiling")
-    lighting = _pick_variant(style, "lighting")
-    camera = _pick_variant(style, "camera")
+    rng = random.Random(f"{style_id}:{seed}") if seed else random.Random()
+    furniture = _pick_variant(style, "furniture", rng)
+    walls = _pick_variant(style, "walls", rng)
+    floors = _pick_variant(style, "floors", rng)
+    ceiling = _pick_variant(style, "ceiling", rng)
+    lighting = _pick_variant(style, "lighting", rng)
+    camera = _pick_variant(style, "camera", rng)
 
     variant_parts = [
         furniture,
@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.api import auth, upload, generate, styles, download, billing, robokassa
+from app.api import auth, upload, generate, styles, download, billing, robokassa, metrics
 from app.core.config import get_settings
 from app.core.database import Base, engine, run_simple_migrations
 
@@ -26,6 +26,8 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Курсор следующей страницы GET /upload
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -41,5 +43,6 @@ app.include_router(download.router)
 app.include_router(billing.router)
 app.include_router(robokassa.router)
 app.include_router(robokassa.compat_router)
+app.include_router(metrics.router)
 
 
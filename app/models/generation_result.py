@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+from app.core.database import Base
+
+
+class GenerationResult(Base):
+    """Результат одной генерации для аплоада: у пакета стилей — по строке на стиль."""
+
+    __tablename__ = "generation_results"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(64), nullable=False, unique=True)  # task_id цепочки, повтор finalize не дублирует строку
+    upload_id = Column(Integer, ForeignKey("uploads.id", ondelete="CASCADE"), nullable=False, index=True)
+    batch_id = Column(String(64), nullable=True, index=True)
+    style = Column(String(64), nullable=True)
+    result_url = Column(String(512), nullable=False)
+    thumb_url = Column(String(512), nullable=True)
+    preview_url = Column(String(512), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
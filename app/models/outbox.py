@@ -0,0 +1,19 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String, Text
+
+from app.core.database import Base
+
+
+class GenerationOutbox(Base):
+    """Задачи генерации, записанные в одной транзакции со списанием; в Celery их публикует relay."""
+
+    __tablename__ = "generation_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_key = Column(String(64), nullable=False, unique=True)  # batch_id пакета или job_id одиночной генерации
+    payload = Column(Text, nullable=False)  # JSON: {"batch_id": ..., "jobs": [аргументы build_generation_pipeline]}
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    dead_at = Column(DateTime, nullable=True)  # dead-letter: relay больше не публикует, кредиты возвращены
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
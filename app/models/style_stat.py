@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String
 
 from app.core.database import Base
 
@@ -9,3 +11,12 @@ class StyleStat(Base):
     style_id = Column(String(64), primary_key=True, index=True)
     count = Column(Integer, nullable=False, default=0)
 
+
+class StyleStatFlush(Base):
+    """Применённые переносы счётчиков из Redis: повтор того же flush не удваивает приращения."""
+
+    __tablename__ = "style_stat_flushes"
+
+    flush_id = Column(String(64), primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
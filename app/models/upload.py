@@ -1,6 +1,5 @@
-from datetime import datetime
-
 from datetime import timedelta, datetime
+from typing import Optional
 
 from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
 from sqlalchemy.orm import relationship
@@ -14,15 +13,25 @@ class Upload(Base):
     id = Column(Integer, primary_key=True, index=True)
     before_url = Column(String(512), nullable=False)
     after_url = Column(String(512), nullable=True)
+    before_thumb_url = Column(String(512), nullable=True)
+    before_preview_url = Column(String(512), nullable=True)
+    after_thumb_url = Column(String(512), nullable=True)
+    after_preview_url = Column(String(512), nullable=True)
     style = Column(String(64), nullable=True)
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     expires_at = Column(DateTime, nullable=True)
-    days_left = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="uploads")
 
     def set_expiry(self, days: int = 30) -> None:
         self.expires_at = (self.created_at or datetime.utcnow()) + timedelta(days=days)
-        self.days_left = days
+
+    @property
+    def days_left(self) -> Optional[int]:
+        """Сколько полных дней осталось до удаления; считается при чтении, в БД не хранится."""
+        if not self.expires_at:
+            return None
+        delta = self.expires_at - datetime.utcnow()
+        return max(0, int(delta.total_seconds() // 86400))
 
@@ -1,53 +1,165 @@
 import httpx
 import io
+import time
 from typing import Dict, Optional, Tuple
 
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
 
 from app.core.config import get_settings
 from app.core.styles_catalog import build_style_prompt
+from app.services import metrics
+from app.services.http_client import get_http_client
+from app.services.image_preprocess import preprocess_source
+from app.services.rate_governor import GovernorBusy, gemini_governor
+from app.services.redis_client import get_binary_redis
+from app.services.s3 import get_own_bucket_key, read_file_from_s3
 
 settings = get_settings()
 client = genai.Client(api_key=settings.AI_KEY)
 
+# Ответы провайдера, после которых снижаем общую скорость запросов
+THROTTLE_STATUS_CODES = {429, 503}
+
+# Временные сбои провайдера: generate_image пробрасывает их как есть, чтобы стадия повторилась
+TRANSIENT_PROVIDER_ERRORS = (httpx.TransportError, genai_errors.ServerError)
+
+
+def fetch_source_image(image_url: str) -> Tuple[bytes, str]:
+    """
+    Получить исходное изображение. Возвращает (bytes, mime_type).
+
+    Файлы из нашего бакета читаем напрямую через boto3, по HTTP идём только за внешними ссылками.
+    """
+    s3_key = get_own_bucket_key(image_url)
+    if s3_key:
+        with metrics.timed("source_fetch:s3"):
+            data, content_type = read_file_from_s3(s3_key)
+        if data is not None:
+            return data, content_type or "image/jpeg"
+        print(f"[fetch_source_image] key {s3_key} not readable from bucket, falling back to HTTP")
+
+    with metrics.timed("source_fetch:http"):
+        img_response = get_http_client().get(image_url)
+        img_response.raise_for_status()
+    return img_response.content, img_response.headers.get("content-type", "image/jpeg")
+
+
+def fetch_shared_source(share_key: str, image_url: str) -> Tuple[bytes, str]:
+    """
+    Исходник, общий для нескольких задач (пакетная генерация одного аплоада).
+
+    Первая задача скачивает файл и кладёт в Redis, остальные ждут и читают копию.
+    При недоступности Redis каждая задача просто качает сама.
+    """
+    data_key = f"gen:src:{share_key}"
+    lock_key = f"{data_key}:lock"
+    deadline = time.monotonic() + settings.SHARED_SOURCE_WAIT_SECONDS
+    try:
+        redis_client = get_binary_redis()
+        while True:
+            data, mime = redis_client.hmget(data_key, "data", "mime")
+            if data is not None:
+                metrics.incr("source_fetch:shared_hit")
+                return data, mime.decode() if mime else "image/jpeg"
+            if redis_client.set(lock_key, b"1", nx=True, ex=60):
+                try:
+                    image_bytes, mime_type = fetch_source_image(image_url)
+                    pipe = redis_client.pipeline()
+                    pipe.hset(data_key, mapping={"data": image_bytes, "mime": mime_type})
+                    pipe.expire(data_key, settings.SHARED_SOURCE_TTL_SECONDS)
+                    pipe.execute()
+                    return image_bytes, mime_type
+                finally:
+                    redis_client.delete(lock_key)
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.2)
+    except Exception as exc:
+        if isinstance(exc, httpx.HTTPError):
+            raise
+        print(f"[fetch_shared_source] shared source unavailable, fetching directly: {exc}")
+    return fetch_source_image(image_url)
+
+
+def build_generation_prompt(
+    style: str,
+    variant_seed: Optional[str] = None,
+) -> Tuple[str, Optional[Dict[str, Optional[str]]]]:
+    """
+    Собрать промпт для Gemini и выбранные вариации стиля.
+
+    variant_seed фиксирует вариации (мебель/стены/свет/камера): одинаковый seed даёт одинаковый промпт.
+    """
+    style_prompt, negative_prompt, style_meta = build_style_prompt(style.lower(), seed=variant_seed)
+
+    base_prompt = (
+        "High quality interior visualization, detailed, professional lighting. "
+        "Do not change room layout: keep all walls, windows, doors and openings in their original places; "
+        "no new openings or relocated windows/doors. "
+        "Do not add or remove furniture or decor; only restyle materials, finishes and lighting."
+    )
+    if style_prompt:
+        prompt = f"{base_prompt} {style_prompt}"
+    else:
+        prompt = f"{base_prompt} Style: {style}"
+    return prompt, style_meta
+
+
+def _call_gemini(parts: list, timer_name: str = "gemini:generate"):
+    """
+    Вызов Gemini через общий для кластера rate governor.
+
+    На 429/503 скорость снижается и вызов повторяется после нового разрешения;
+    если очередь слишком длинная, бросается GovernorBusy, и задача переоткладывается.
+    """
+    for attempt in range(settings.GEMINI_THROTTLE_RETRIES + 1):
+        gemini_governor.acquire(max_wait=settings.GEMINI_PERMIT_MAX_WAIT_SECONDS)
+        try:
+            with metrics.timed(timer_name):
+                response = client.models.generate_content(
+                    model="gemini-2.5-flash-image",
+                    contents=parts,
+                )
+        except genai_errors.APIError as exc:
+            if exc.code not in THROTTLE_STATUS_CODES:
+                raise
+            gemini_governor.record_throttle()
+            if attempt == settings.GEMINI_THROTTLE_RETRIES:
+                raise GovernorBusy("gemini", retry_after=settings.GEMINI_PERMIT_MAX_WAIT_SECONDS) from exc
+            continue
+        gemini_governor.record_success()
+        return response
+
 
 def generate_image(
     image_url: str,
     style: str,
     prompt: Optional[str] = None,
+    style_meta: Optional[Dict[str, Optional[str]]] = None,
+    source: Optional[Tuple[bytes, str]] = None,
 ) -> Tuple[bytes, str, Optional[Dict[str, Optional[str]]]]:
     """
     Generate an image using Gemini based on input image and style.
-    
+
     Args:
         image_url: URL of the input image (optional, can be used for image-to-image)
         style: Style to apply (e.g., "anime", "realistic", "cartoon")
         prompt: Text prompt for generation (optional, will be auto-generated if not provided)
-    
+        style_meta: Style variants that were used to build `prompt` (returned as is)
+        source: Already fetched (image bytes, mime_type); image_url is not downloaded then
+
     Returns:
-        Tuple of (image bytes, mime_type)
+        Tuple of (image bytes, mime_type, style_meta)
     """
     try:
         if not settings.AI_KEY:
             raise ValueError("AI_KEY не настроен в переменных окружения")
 
         # Формируем prompt если не передан
-        style_meta: Optional[Dict[str, Optional[str]]] = None
-
-        style_prompt, negative_prompt, style_meta = build_style_prompt(style.lower())
-
         if not prompt:
-            base_prompt = (
-                "High quality interior visualization, detailed, professional lighting. "
-                "Do not change room layout: keep all walls, windows, doors and openings in their original places; "
-                "no new openings or relocated windows/doors. "
-                "Do not add or remove furniture or decor; only restyle materials, finishes and lighting."
-            )
-            if style_prompt:
-                prompt = f"{base_prompt} {style_prompt}"
-            else:
-                prompt = f"{base_prompt} Style: {style}"
+            prompt, style_meta = build_generation_prompt(style)
 
         if style_meta:
             print(
@@ -62,11 +174,14 @@ def generate_image(
             )
 
         # Загружаем исходное изображение
-        with httpx.Client() as http_client:
-            img_response = http_client.get(image_url, timeout=30.0)
-            img_response.raise_for_status()
-            image_bytes = img_response.content
-            mime_type = img_response.headers.get("content-type", "image/jpeg")
+        if source is None:
+            source = fetch_source_image(image_url)
+        image_bytes, mime_type = source
+
+        # Модели не нужно 12 Мп: поворачиваем, уменьшаем и пережимаем до отправки
+        original_size = len(image_bytes)
+        image_bytes, mime_type = preprocess_source(image_bytes, mime_type)
+        preprocessed = len(image_bytes) != original_size
 
         # Готовим части запроса к Gemini
         parts = [
@@ -74,9 +189,10 @@ def generate_image(
             types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
         ]
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash-image",
-            contents=parts,
+        # Отдельные таймеры, чтобы сравнивать задержку Gemini с предобработкой и без
+        response = _call_gemini(
+            parts,
+            timer_name="gemini:generate:preprocessed" if preprocessed else "gemini:generate:original",
         )
 
         # Забираем первое inline-изображение из ответа
@@ -94,6 +210,8 @@ def generate_image(
                     return buf.getvalue(), "image/png", style_meta
         raise Exception("Gemini не вернул изображение")
 
+    except (GovernorBusy, *TRANSIENT_PROVIDER_ERRORS):
+        raise
     except httpx.HTTPError as e:
         error_msg = f"HTTP error generating image: {e}"
         print(error_msg)
@@ -102,4 +220,3 @@ def generate_image(
         error_msg = f"Error generating image: {e}"
         print(error_msg)
         raise Exception(error_msg) from e
-
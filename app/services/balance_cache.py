@@ -0,0 +1,131 @@
+"""
+Модель чтения баланса генераций в Redis.
+
+GET /billing/balance опрашивается после каждой генерации. Раньше каждый такой
+запрос шёл в get_or_create_balance с commit и refresh. Теперь баланс читается
+из Redis, а в Postgres идём только при промахе, и то на чтение.
+
+Кэш обновляется write-through после commit в consume_generation, add_credits,
+purchase_plan и get_or_create_balance. Истёкшая подписка сбрасывается до
+бесплатного плана только в ответе: в БД сброс попадёт при следующем списании
+или покупке. Запись в кэш не упорядочена с commit, поэтому у ключа есть TTL,
+а reconcile_balances сверяет кэш с БД и удаляет расхождения.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.config import get_settings
+from app.services import metrics
+from app.services.redis_client import get_redis
+
+settings = get_settings()
+
+BALANCE_CACHE_PREFIX = "balance:"
+
+# Поля GenerationBalance, которые отдаёт /billing/balance
+BALANCE_FIELDS = (
+    "email",
+    "remaining_std",
+    "used_std",
+    "remaining_hd",
+    "used_hd",
+    "current_plan",
+    "package_plan_id",
+    "purchased_at",
+    "plan_expires_at",
+)
+_DATETIME_FIELDS = ("purchased_at", "plan_expires_at")
+
+
+def _key(user_id: int) -> str:
+    return f"{BALANCE_CACHE_PREFIX}{user_id}"
+
+
+def balance_snapshot(balance) -> Dict[str, Any]:
+    return {field: getattr(balance, field) for field in BALANCE_FIELDS}
+
+
+def _serialize(data: Dict[str, Any]) -> str:
+    return json.dumps(data, default=lambda value: value.isoformat())
+
+
+def _deserialize(raw: str) -> Dict[str, Any]:
+    data = json.loads(raw)
+    for field in _DATETIME_FIELDS:
+        if data.get(field):
+            data[field] = datetime.fromisoformat(data[field])
+    return data
+
+
+def apply_plan_expiry(data: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Сброс истёкшей подписки до бесплатного плана — как _refresh_if_expired, но без записи в БД."""
+    now = now or datetime.utcnow()
+    expires_at = data.get("plan_expires_at")
+    if expires_at and expires_at < now:
+        data = dict(
+            data,
+            remaining_std=1,
+            used_std=0,
+            remaining_hd=0,
+            used_hd=0,
+            current_plan="free",
+            plan_expires_at=None,
+            purchased_at=expires_at,
+        )
+    return data
+
+
+def get_cached_balance(user_id: int) -> Optional[Dict[str, Any]]:
+    """Баланс из Redis как есть (без сброса истёкшего плана) или None."""
+    if not settings.BALANCE_CACHE_ENABLED:
+        return None
+    try:
+        raw = get_redis().get(_key(user_id))
+    except Exception as exc:
+        print(f"[balance_cache] redis read failed: {exc}")
+        return None
+    if raw is None:
+        metrics.incr("balance_cache:miss")
+        return None
+    metrics.incr("balance_cache:hit")
+    return _deserialize(raw)
+
+
+def cache_balance(balance) -> None:
+    """Write-through: вызывать после commit изменения баланса."""
+    if not settings.BALANCE_CACHE_ENABLED or balance is None:
+        return
+    try:
+        get_redis().setex(
+            _key(balance.user_id), settings.BALANCE_CACHE_TTL_SECONDS, _serialize(balance_snapshot(balance))
+        )
+    except Exception as exc:
+        print(f"[balance_cache] redis write failed for {balance.user_id}: {exc}")
+
+
+def invalidate_balance(user_id: Optional[int]) -> None:
+    if not user_id:
+        return
+    try:
+        get_redis().delete(_key(user_id))
+    except Exception as exc:
+        print(f"[balance_cache] invalidation failed for {user_id}: {exc}")
+
+
+def find_drift(balances: Iterable) -> List[int]:
+    """
+    Сравнить закэшированные балансы с переданными строками из БД.
+
+    Возвращает user_id, у которых кэш расходится с БД; отсутствие ключа
+    расхождением не считается.
+    """
+    balances = list(balances)
+    if not balances:
+        return []
+    raw_values = get_redis().mget([_key(balance.user_id) for balance in balances])
+    drifted = []
+    for balance, raw in zip(balances, raw_values):
+        if raw is not None and _deserialize(raw) != balance_snapshot(balance):
+            drifted.append(balance.user_id)
+    return drifted
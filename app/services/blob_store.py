@@ -0,0 +1,43 @@
+from typing import Optional, Tuple
+
+from app.core.config import get_settings
+from app.services.redis_client import get_binary_redis
+
+settings = get_settings()
+
+BLOB_PREFIX = "blob:"
+
+
+class BlobMissing(Exception):
+    """Промежуточные данные истекли или были удалены до того, как их прочитали."""
+
+
+def put_blob(name: str, data: bytes, mime_type: str, ttl: Optional[int] = None) -> str:
+    """
+    Положить байты во временное хранилище и вернуть ссылку на них.
+
+    Через брокер Celery передаётся только ссылка, сами изображения живут в Redis с TTL.
+    """
+    ref = f"{BLOB_PREFIX}{name}"
+    pipe = get_binary_redis().pipeline()
+    pipe.hset(ref, mapping={"data": data, "mime": mime_type})
+    pipe.expire(ref, ttl or settings.PIPELINE_BLOB_TTL_SECONDS)
+    pipe.execute()
+    return ref
+
+
+def get_blob(ref: str) -> Tuple[bytes, str]:
+    data, mime = get_binary_redis().hmget(ref, "data", "mime")
+    if data is None:
+        raise BlobMissing(ref)
+    return data, mime.decode() if mime else "application/octet-stream"
+
+
+def delete_blobs(*refs: Optional[str]) -> None:
+    refs = [ref for ref in refs if ref]
+    if not refs:
+        return
+    try:
+        get_binary_redis().delete(*refs)
+    except Exception as exc:
+        print(f"[blob_store] failed to delete {refs}: {exc}")
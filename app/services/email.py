@@ -1,13 +1,72 @@
+"""
+Транзакционные письма (подтверждение email, сброс пароля).
+
+Эндпоинты только ставят письмо в очередь: сообщение кладётся в Redis-список
+email:outbox, а задача email.flush_outbox раз в EMAIL_BATCH_WINDOW_SECONDS
+забирает накопившиеся письма и отправляет их пачкой через Resend Batch API.
+Забранные письма лежат в email:outbox:processing, пока не отправлены или не
+переданы на повтор, поэтому падение воркера посреди отправки их не теряет.
+Если Resend не настроен или пачка не ушла, письма уходят через SMTP по одному
+переиспользуемому соединению. Неотправленные повторяются с экспоненциальной паузой.
+"""
+import json
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
-from typing import Optional
+from typing import List, Mapping, Optional
 
+import httpx
 import resend
 
 from app.core.config import get_settings
+from app.services import metrics
+from app.services.http_client import get_http_client
+from app.services.redis_client import get_redis
 
 settings = get_settings()
 
+EMAIL_OUTBOX_KEY = "email:outbox"
+EMAIL_PROCESSING_KEY = "email:outbox:processing"
+EMAIL_FLUSH_SCHEDULED_KEY = "email:outbox:flush_scheduled"
+EMAIL_FLUSH_LOCK_KEY = "email:outbox:flush_lock"
+RESEND_BATCH_LIMIT = 100  # ограничение Resend на одну пачку
+
+
+class _PooledResendClient(resend.HTTPClient):
+    """HTTP-клиент для SDK Resend поверх общего пула соединений вместо requests на каждый вызов."""
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Mapping[str, str],
+        json: Optional[object] = None,
+        files: Optional[dict] = None,
+        data: Optional[dict] = None,
+    ):
+        try:
+            resp = get_http_client().request(
+                method,
+                url,
+                headers=headers,
+                json=json if data is None and files is None else None,
+                data=data,
+                files=files,
+            )
+        except httpx.HTTPError as exc:
+            raise RuntimeError(f"Request failed: {exc}") from exc
+        return resp.content, resp.status_code, resp.headers
+
+
+resend.default_http_client = _PooledResendClient()
+
+
+def _resend_sender() -> Optional[str]:
+    if not settings.RESEND_API_KEY:
+        return None
+    return settings.RESEND_FROM or settings.SMTP_FROM
+
 
 def _build_smtp_client():
     if not settings.SMTP_HOST:
@@ -22,26 +81,74 @@ def _build_smtp_client():
     return client
 
 
-def _send_via_resend(to_email: str, subject: str, body: str) -> bool:
-    api_key = settings.RESEND_API_KEY
-    sender = settings.RESEND_FROM or settings.SMTP_FROM
-    if not api_key or not sender:
-        return False
-    try:
-        resend.api_key = api_key
-        resend.Emails.send(
-            {
-                "from": sender,
-                "to": to_email,
-                "subject": subject,
-                "html": body,
-            }
-        )
-        print(f"[email:resend] sent to={to_email} subject={subject}")
-        return True
-    except Exception as exc:
-        print(f"[email:resend:error] {exc}")
-        return False
+_smtp_lock = threading.Lock()
+_smtp_client: Optional[smtplib.SMTP] = None
+_smtp_used_at = 0.0
+
+
+def _close_smtp_client() -> None:
+    global _smtp_client
+    if _smtp_client is not None:
+        try:
+            _smtp_client.quit()
+        except Exception:
+            pass
+        _smtp_client = None
+
+
+def _get_smtp_client() -> Optional[smtplib.SMTP]:
+    """
+    SMTP-соединение процесса: живое и недавно использованное переиспользуем,
+    иначе открываем новое и логинимся. Вызывать под _smtp_lock.
+    """
+    global _smtp_client
+    if _smtp_client is not None:
+        idle = time.monotonic() - _smtp_used_at
+        try:
+            if idle < settings.EMAIL_SMTP_IDLE_SECONDS and _smtp_client.noop()[0] == 250:
+                metrics.incr("email:smtp_reused")
+                return _smtp_client
+        except smtplib.SMTPException:
+            pass
+        _close_smtp_client()
+
+    client = _build_smtp_client()
+    if client is None:
+        return None
+    if settings.SMTP_USER and settings.SMTP_PASSWORD:
+        client.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+    metrics.incr("email:smtp_connections")
+    _smtp_client = client
+    return client
+
+
+def close_email_connections() -> None:
+    with _smtp_lock:
+        _close_smtp_client()
+
+
+def _send_via_resend_batch(messages: List[dict]) -> List[dict]:
+    """Отправить через Resend пачками по 100. Возвращает то, что не ушло."""
+    sender = _resend_sender()
+    if not sender:
+        return messages
+    resend.api_key = settings.RESEND_API_KEY
+    for start in range(0, len(messages), RESEND_BATCH_LIMIT):
+        chunk = messages[start:start + RESEND_BATCH_LIMIT]
+        params = [
+            {"from": sender, "to": message["to"], "subject": message["subject"], "html": message["body"]}
+            for message in chunk
+        ]
+        try:
+            if len(params) == 1:
+                resend.Emails.send(params[0])
+            else:
+                resend.Batch.send(params)
+        except Exception as exc:
+            print(f"[email:resend:error] {exc}")
+            return messages[start:]
+        print(f"[email:resend] sent {len(chunk)} messages")
+    return []
 
 
 def _send_via_smtp(to_email: str, subject: str, body: str) -> bool:
@@ -54,32 +161,110 @@ def _send_via_smtp(to_email: str, subject: str, body: str) -> bool:
     msg["Subject"] = subject
     msg.set_content(body)
 
-    client = _build_smtp_client()
-    if not client:
-        return False
+    global _smtp_used_at
+    with _smtp_lock:
+        # Второй заход — на случай, если сервер закрыл соединение между NOOP и отправкой
+        for attempt in range(2):
+            try:
+                client = _get_smtp_client()
+                if not client:
+                    return False
+                client.send_message(msg)
+                _smtp_used_at = time.monotonic()
+                print(f"[email:smtp] sent to={to_email} subject={subject}")
+                return True
+            except (smtplib.SMTPServerDisconnected, OSError) as exc:
+                _close_smtp_client()
+                if attempt:
+                    print(f"[email:smtp:error] {exc}")
+            except Exception as exc:
+                print(f"[email:smtp:error] {exc}")
+                _close_smtp_client()
+                return False
+    return False
 
-    try:
-        if settings.SMTP_USER and settings.SMTP_PASSWORD:
-            client.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-        client.send_message(msg)
-        print(f"[email:smtp] sent to={to_email} subject={subject}")
-        return True
-    except Exception as exc:
-        print(f"[email:smtp:error] {exc}")
-        return False
-    finally:
-        try:
-            client.quit()
-        except Exception:
-            pass
+
+def deliver_emails(messages: List[dict]) -> List[dict]:
+    """
+    Отправить пачку писем. Возвращает те, что отправить не удалось.
+
+    Без настроенных провайдеров письмо только логируется (как и раньше).
+    """
+    pending = _send_via_resend_batch(list(messages))
+
+    failed = []
+    smtp_configured = bool(settings.SMTP_HOST and settings.SMTP_FROM)
+    for message in pending:
+        if _send_via_smtp(message["to"], message["subject"], message["body"]):
+            continue
+        if _resend_sender() or smtp_configured:
+            failed.append(message)
+        else:
+            print(f"[email:log_only] to={message['to']} subject={message['subject']} body={message['body']}")
+
+    metrics.incr("email:sent", len(messages) - len(failed))
+    if failed:
+        metrics.incr("email:failed", len(failed))
+    return failed
+
+
+# Переложить до ARGV[1] писем из outbox в processing за один вызов
+_CLAIM_SCRIPT = """
+local moved = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not item then
+        break
+    end
+    moved[#moved + 1] = item
+end
+return moved
+"""
+
+
+def claim_outbox_batch() -> List[str]:
+    """
+    Забрать пачку писем на отправку. Сначала — оставшиеся в processing от
+    упавшего flush (flush работает под lock, так что чужих там нет), затем новые.
+    """
+    redis_client = get_redis()
+    pending = redis_client.lrange(EMAIL_PROCESSING_KEY, 0, settings.EMAIL_BATCH_SIZE - 1)
+    if pending:
+        metrics.incr("email:recovered", len(pending))
+        return pending
+    return redis_client.eval(_CLAIM_SCRIPT, 2, EMAIL_OUTBOX_KEY, EMAIL_PROCESSING_KEY, settings.EMAIL_BATCH_SIZE)
+
+
+def ack_outbox_batch(raw: List[str]) -> None:
+    """Убрать из processing письма, которые отправлены или переданы на повтор."""
+    pipe = get_redis().pipeline()
+    for item in raw:
+        pipe.lrem(EMAIL_PROCESSING_KEY, 1, item)
+    pipe.execute()
 
 
 def _send_email(to_email: str, subject: str, body: str) -> None:
-    if _send_via_resend(to_email, subject, body):
-        return
-    if _send_via_smtp(to_email, subject, body):
-        return
-    print(f"[email:log_only] to={to_email} subject={subject} body={body}")
+    """Поставить письмо в очередь; если очередь недоступна — отправить прямо сейчас."""
+    message = {"to": to_email, "subject": subject, "body": body}
+    if settings.EMAIL_QUEUE_ENABLED:
+        from app.workers.mail import schedule_outbox_flush
+
+        payload = json.dumps(message)
+        try:
+            get_redis().rpush(EMAIL_OUTBOX_KEY, payload)
+        except Exception as exc:
+            print(f"[email] outbox unavailable, sending inline: {exc}")
+        else:
+            try:
+                schedule_outbox_flush()
+                metrics.incr("email:queued")
+                return
+            except Exception as exc:
+                print(f"[email] broker unavailable, sending inline: {exc}")
+                # Письмо ещё в outbox: забираем его сами, если его не успел забрать flush
+                if not get_redis().lrem(EMAIL_OUTBOX_KEY, -1, payload):
+                    return
+    deliver_emails([message])
 
 
 def send_verification_email(email: str, token: str) -> None:
@@ -94,4 +279,3 @@ def send_reset_email(email: str, token: str) -> None:
     subject = "Password reset"
     body = f"Сбросить пароль: {link}"
     _send_email(email, subject, body)
-
@@ -0,0 +1,97 @@
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+from app.core.config import get_settings
+from app.services.redis_client import get_async_redis, get_redis
+
+settings = get_settings()
+
+# На каждого пользователя: stream (история для докачки по Last-Event-ID) и pub/sub канал (live)
+EVENTS_STREAM_PREFIX = "gen:events:stream:"
+EVENTS_CHANNEL_PREFIX = "gen:events:channel:"
+
+
+def _stream_key(user_id: int) -> str:
+    return f"{EVENTS_STREAM_PREFIX}{user_id}"
+
+
+def _channel(user_id: int) -> str:
+    return f"{EVENTS_CHANNEL_PREFIX}{user_id}"
+
+
+def _parse_event_id(event_id: str) -> Tuple[int, int]:
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def publish_task_event(user_id: Optional[int], task_id: str, status: str, **data) -> Optional[str]:
+    """
+    Опубликовать смену статуса задачи генерации. Возвращает id события или None.
+
+    Ошибки Redis только логируются — статус всё равно доступен через /generate/status.
+    """
+    if not user_id:
+        return None
+    payload = {"task_id": task_id, "status": status, **data}
+    try:
+        redis_client = get_redis()
+        event_id = redis_client.xadd(
+            _stream_key(user_id),
+            {"data": json.dumps(payload, ensure_ascii=False)},
+            maxlen=settings.EVENTS_STREAM_MAXLEN,
+            approximate=True,
+        )
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.expire(_stream_key(user_id), settings.EVENTS_STREAM_TTL_SECONDS)
+        pipe.publish(_channel(user_id), json.dumps({"id": event_id, "data": payload}, ensure_ascii=False))
+        pipe.execute()
+        return event_id
+    except Exception as exc:
+        print(f"[events] publish failed for task {task_id}: {exc}")
+        return None
+
+
+async def stream_user_events(
+    user_id: int,
+    last_event_id: Optional[str] = None,
+) -> AsyncIterator[Optional[Tuple[str, dict]]]:
+    """
+    Поток событий пользователя: сначала пропущенные после last_event_id, затем live.
+
+    Отдаёт (event_id, payload) или None, если за EVENTS_HEARTBEAT_SECONDS ничего
+    не пришло — вызывающий код шлёт heartbeat.
+    """
+    redis_client = get_async_redis()
+    pubsub = redis_client.pubsub()
+    # Подписываемся до чтения истории, чтобы не потерять события между ними
+    await pubsub.subscribe(_channel(user_id))
+    try:
+        last_seen: Optional[Tuple[int, int]] = None
+        if last_event_id:
+            try:
+                last_seen = _parse_event_id(last_event_id)
+            except ValueError:
+                last_event_id = None
+        if last_event_id:
+            missed = await redis_client.xrange(_stream_key(user_id), min=f"({last_event_id}", max="+")
+            for event_id, fields in missed:
+                last_seen = _parse_event_id(event_id)
+                yield event_id, json.loads(fields["data"])
+
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=settings.EVENTS_HEARTBEAT_SECONDS,
+            )
+            if message is None:
+                yield None
+                continue
+            envelope = json.loads(message["data"])
+            event_key = _parse_event_id(envelope["id"])
+            if last_seen is not None and event_key <= last_seen:
+                continue
+            last_seen = event_key
+            yield envelope["id"], envelope["data"]
+    finally:
+        await pubsub.unsubscribe(_channel(user_id))
+        await pubsub.aclose()
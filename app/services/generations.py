@@ -1,10 +1,13 @@
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
 
+from sqlalchemy import and_, case, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from app.models.generation import GenerationBalance
 from app.models.user import User
+from app.services.balance_cache import apply_plan_expiry, balance_snapshot, cache_balance, get_cached_balance
 
 
 # Количество начислений по пакетам (mock): (std, hd)
@@ -24,6 +27,20 @@ SUBSCRIPTION_CREDITS: dict[str, Tuple[int, int]] = {
 }
 
 
+def _new_balance_values(user: User) -> dict:
+    return {
+        "user_id": user.id,
+        "email": user.email,
+        "remaining_std": 1,  # одна бесплатная стандартная генерация
+        "used_std": 0,
+        "remaining_hd": 0,
+        "used_hd": 0,
+        "current_plan": "free",
+        "purchased_at": datetime.utcnow(),
+        "plan_expires_at": None,
+    }
+
+
 def _refresh_if_expired(balance: GenerationBalance) -> None:
     if balance.plan_expires_at and balance.plan_expires_at < datetime.utcnow():
         # Сброс до бесплатного плана
@@ -47,55 +64,167 @@ def get_or_create_balance(db: Session, user: User) -> GenerationBalance:
         db.add(balance)
         db.commit()
         db.refresh(balance)
+        cache_balance(balance)
         return balance
-    balance = GenerationBalance(
-        user_id=user.id,
-        email=user.email,
-        remaining_std=1,  # одна бесплатная стандартная генерация
-        used_std=0,
-        remaining_hd=0,
-        used_hd=0,
-        current_plan="free",
-        purchased_at=datetime.utcnow(),
-        plan_expires_at=None,
-    )
+    balance = GenerationBalance(**_new_balance_values(user))
     db.add(balance)
     db.commit()
     db.refresh(balance)
+    cache_balance(balance)
     return balance
 
 
-def consume_generation(db: Session, user: User, is_hd: bool = False) -> GenerationBalance:
-    balance = get_or_create_balance(db, user)
-    _refresh_if_expired(balance)
-    if is_hd:
-        if balance.remaining_hd <= 0:
-            raise ValueError("Лимит HD-генераций исчерпан")
-        balance.remaining_hd -= 1
-        balance.used_hd += 1
-    else:
-        if balance.remaining_std <= 0:
-            raise ValueError("Лимит генераций исчерпан")
-        balance.remaining_std -= 1
-        balance.used_std += 1
-    db.add(balance)
-    db.commit()
-    db.refresh(balance)
+def get_balance_view(db: Session, user: User) -> dict:
+    """
+    Баланс для чтения (поля BALANCE_FIELDS): из Redis, при промахе — SELECT из БД.
+
+    Ничего не пишет в БД, кроме создания строки для пользователя без баланса.
+    Истёкшая подписка показывается сброшенной, а в БД сбросится при следующем списании.
+    """
+    data = get_cached_balance(user.id)
+    if data is None:
+        balance = (
+            db.query(GenerationBalance)
+            .filter(GenerationBalance.user_id == user.id)
+            .first()
+        )
+        if balance is None:
+            balance = get_or_create_balance(db, user)
+        else:
+            cache_balance(balance)
+        data = balance_snapshot(balance)
+    return apply_plan_expiry(data)
+
+
+def _expiry_reset_values(now: datetime) -> dict:
+    """
+    Колонки баланса после сброса истёкшей подписки до бесплатного плана —
+    как в _refresh_if_expired, но выражениями для того же UPDATE.
+    """
+    expired = and_(GenerationBalance.plan_expires_at.is_not(None), GenerationBalance.plan_expires_at < now)
+
+    def _after_reset(column, free_value):
+        return case((expired, free_value), else_=column)
+
+    return {
+        "remaining_std": _after_reset(GenerationBalance.remaining_std, 1),
+        "used_std": _after_reset(GenerationBalance.used_std, 0),
+        "remaining_hd": _after_reset(GenerationBalance.remaining_hd, 0),
+        "used_hd": _after_reset(GenerationBalance.used_hd, 0),
+        "current_plan": _after_reset(GenerationBalance.current_plan, "free"),
+        "plan_expires_at": case((expired, None), else_=GenerationBalance.plan_expires_at),
+        "purchased_at": _after_reset(GenerationBalance.purchased_at, now),
+    }
+
+
+def _update_statement(user_id: int, values: dict, *conditions):
+    return (
+        update(GenerationBalance)
+        .where(GenerationBalance.user_id == user_id, *conditions)
+        .values(**values)
+        .returning(GenerationBalance)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+
+
+def _insert_missing_balance(db: Session, user: User) -> None:
+    """Создать строку баланса, если её ещё нет; параллельный запрос не получит дубль."""
+    db.execute(
+        insert(GenerationBalance)
+        .values(**_new_balance_values(user))
+        .on_conflict_do_nothing(index_elements=[GenerationBalance.user_id])
+    )
+
+
+def _consume_statement(user_id: int, is_hd: bool, count: int):
+    """
+    UPDATE ... WHERE остаток >= count RETURNING: проверка и списание одним
+    оператором, строку блокирует сама БД. Истёкшая подписка сбрасывается до
+    бесплатного плана в том же UPDATE, и списание идёт уже из сброшенного остатка.
+    """
+    values = _expiry_reset_values(datetime.utcnow())
+    remaining, used = ("remaining_hd", "used_hd") if is_hd else ("remaining_std", "used_std")
+    available = values[remaining]
+    values[remaining] = available - count
+    values[used] = values[used] + count
+    return _update_statement(user_id, values, available >= count)
+
+
+def consume_generation(
+    db: Session, user: User, is_hd: bool = False, count: int = 1, commit: bool = True
+) -> GenerationBalance:
+    """
+    Списать count генераций (пакетная генерация списывает сразу все).
+
+    Один UPDATE ... RETURNING вместо чтения, проверки и записи: параллельные
+    запросы не могут потратить одну генерацию дважды. Если строки баланса ещё
+    нет, она создаётся через INSERT ... ON CONFLICT DO NOTHING и UPDATE повторяется.
+
+    commit=False оставляет списание в текущей транзакции; тогда после commit
+    вызывающий код сам обновляет кэш через cache_balance.
+    """
+    statement = _consume_statement(user.id, is_hd, count)
+    balance = db.scalars(statement).first()
+    if balance is None:
+        _insert_missing_balance(db, user)
+        balance = db.scalars(statement).first()
+    if balance is None:
+        raise ValueError("Лимит HD-генераций исчерпан" if is_hd else "Лимит генераций исчерпан")
+    # RETURNING уже вернул актуальную строку: отцепляем её, чтобы commit не вызвал повторный SELECT
+    db.expunge(balance)
+    if commit:
+        db.commit()
+        cache_balance(balance)
     return balance
 
 
-def add_credits(db: Session, user: User, credits_std: int, credits_hd: int, plan: str) -> GenerationBalance:
-    balance = get_or_create_balance(db, user)
-    balance.remaining_std += credits_std
-    balance.remaining_hd += credits_hd
-    balance.current_plan = plan
-    balance.purchased_at = datetime.utcnow()
-    db.add(balance)
+def _apply_balance_update(db: Session, user: User, values: dict) -> GenerationBalance:
+    """
+    Изменить баланс одним UPDATE ... RETURNING (без чтения и записи из Python,
+    параллельное списание не затирается), закоммитить и обновить кэш.
+    Если строки баланса ещё нет, она создаётся и UPDATE повторяется.
+    """
+    statement = _update_statement(user.id, values)
+    balance = db.scalars(statement).first()
+    if balance is None:
+        _insert_missing_balance(db, user)
+        balance = db.scalars(statement).first()
+    db.expunge(balance)
     db.commit()
-    db.refresh(balance)
+    cache_balance(balance)
     return balance
 
 
+def refund_generation(db: Session, user_id: int, is_hd: bool = False, count: int = 1) -> None:
+    """
+    Вернуть count списанных генераций приращением в SQL (без commit): задача так
+    и не ушла в работу. После commit вызывающий код сбрасывает кэш баланса.
+    """
+    remaining, used = (
+        (GenerationBalance.remaining_hd, GenerationBalance.used_hd)
+        if is_hd
+        else (GenerationBalance.remaining_std, GenerationBalance.used_std)
+    )
+    db.execute(
+        update(GenerationBalance)
+        .where(GenerationBalance.user_id == user_id)
+        .values({remaining: remaining + count, used: case((used >= count, used - count), else_=0)})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def add_credits(db: Session, user: User, credits_std: int, credits_hd: int, plan: str) -> GenerationBalance:
+    now = datetime.utcnow()
+    values = _expiry_reset_values(now)
+    values.update(
+        remaining_std=values["remaining_std"] + credits_std,
+        remaining_hd=values["remaining_hd"] + credits_hd,
+        current_plan=plan,
+        purchased_at=now,
+    )
+    return _apply_balance_update(db, user, values)
+
+
 def purchase_plan(db: Session, user: User, plan_id: str) -> Optional[Tuple[GenerationBalance, int, int]]:
     plan_id = plan_id.lower()
     credits: Optional[Tuple[int, int]] = None
@@ -107,27 +236,30 @@ def purchase_plan(db: Session, user: User, plan_id: str) -> Optional[Tuple[Gener
     if not credits:
         return None
 
-    balance = get_or_create_balance(db, user)
-
+    now = datetime.utcnow()
     if plan_id in SUBSCRIPTION_CREDITS:
         # Подписки: ежемесячный пакет, сбрасываем счётчики и устанавливаем срок
-        balance.remaining_std = credits[0]
-        balance.used_std = 0
-        balance.remaining_hd = credits[1]
-        balance.used_hd = 0
-        balance.current_plan = plan_id
-        balance.package_plan_id = None
-        balance.purchased_at = datetime.utcnow()
-        balance.plan_expires_at = datetime.utcnow() + timedelta(days=30)
+        values = {
+            "remaining_std": credits[0],
+            "used_std": 0,
+            "remaining_hd": credits[1],
+            "used_hd": 0,
+            "current_plan": plan_id,
+            "package_plan_id": None,
+            "purchased_at": now,
+            "plan_expires_at": now + timedelta(days=30),
+        }
     else:
-        # Разовые пакеты: просто добавляем к балансу (без срока)
-        balance.remaining_std += credits[0]
-        balance.remaining_hd += credits[1]
-        balance.package_plan_id = plan_id
-        balance.purchased_at = datetime.utcnow()
+        # Разовые пакеты: добавляем к балансу (без срока) приращением в SQL,
+        # истёкшая подписка сбрасывается в том же UPDATE
+        values = _expiry_reset_values(now)
+        values.update(
+            remaining_std=values["remaining_std"] + credits[0],
+            remaining_hd=values["remaining_hd"] + credits[1],
+            package_plan_id=plan_id,
+            purchased_at=now,
+        )
 
-    db.add(balance)
-    db.commit()
-    db.refresh(balance)
+    balance = _apply_balance_update(db, user, values)
     return balance, credits[0], credits[1]
 
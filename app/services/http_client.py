@@ -0,0 +1,95 @@
+import os
+import threading
+from typing import Optional
+
+import httpx
+
+from app.core.config import get_settings
+from app.services import metrics
+
+settings = get_settings()
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+_client_pid: Optional[int] = None
+
+
+def _trace(event_name: str, info: dict) -> None:
+    # httpcore сообщает о каждом новом TCP/TLS-соединении; запросов больше, чем
+    # connect_tcp — значит соединения переиспользуются
+    if event_name == "connection.connect_tcp.complete":
+        metrics.incr("http:connections_opened")
+    elif event_name == "connection.start_tls.complete":
+        metrics.incr("http:tls_handshakes")
+
+
+def _on_request(request: httpx.Request) -> None:
+    request.extensions["trace"] = _trace
+    metrics.incr("http:requests")
+
+
+def _http2_available() -> bool:
+    if not settings.HTTP_CLIENT_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("[http_client] HTTP/2 requested but 'h2' is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def _build_client() -> httpx.Client:
+    return httpx.Client(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_CLIENT_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            settings.HTTP_CLIENT_READ_TIMEOUT,
+            connect=settings.HTTP_CLIENT_CONNECT_TIMEOUT,
+            pool=settings.HTTP_CLIENT_POOL_TIMEOUT,
+        ),
+        event_hooks={"request": [_on_request]},
+        follow_redirects=True,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Общий httpx.Client с пулом keep-alive соединений, один на процесс.
+
+    После fork (prefork-пул Celery) клиент родителя не используется —
+    сокеты нельзя делить между процессами, поэтому создаём новый по pid.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            _client = _build_client()
+            _client_pid = pid
+        return _client
+
+
+def warm_http_client() -> None:
+    """Создать клиент и заранее открыть соединения к хостам из HTTP_CLIENT_WARMUP_URLS."""
+    client = get_http_client()
+    urls = [url.strip() for url in settings.HTTP_CLIENT_WARMUP_URLS.split(",") if url.strip()]
+    for url in urls:
+        try:
+            client.head(url, timeout=settings.HTTP_CLIENT_CONNECT_TIMEOUT)
+        except httpx.HTTPError as exc:
+            print(f"[http_client] warmup {url} failed: {exc}")
+
+
+def close_http_client() -> None:
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
@@ -0,0 +1,70 @@
+"""
+Предобработка исходника перед Gemini.
+
+Вызывается только из задач генерации в воркерах Celery: там каждая задача и так
+занимает свой процесс prefork-пула, поэтому Pillow работает прямо в нём, без
+отдельного пула (дочерние процессы-демоны не могут порождать свои).
+"""
+import io
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.core.config import get_settings
+from app.services import metrics
+
+settings = get_settings()
+
+
+def _prepare(data: bytes, max_edge: int, quality: int) -> Optional[bytes]:
+    """
+    Повернуть по EXIF, уменьшить до max_edge по длинной стороне и пережать в JPEG.
+
+    Возвращает None, если оригинал лучше оставить как есть.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        # 0x0112 — EXIF Orientation; 1 означает, что поворачивать не нужно
+        changed = img.getexif().get(0x0112, 1) != 1
+        oriented = ImageOps.exif_transpose(img)
+        if max(oriented.size) > max_edge:
+            oriented.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            changed = True
+        if oriented.mode != "RGB":
+            if oriented.mode in ("RGBA", "LA", "P"):
+                rgba = oriented.convert("RGBA")
+                background = Image.new("RGB", rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                oriented = background
+            else:
+                oriented = oriented.convert("RGB")
+        buf = io.BytesIO()
+        oriented.save(buf, format="JPEG", quality=quality, optimize=True)
+    encoded = buf.getvalue()
+    # Уже маленькую картинку без поворота не трогаем, если пережатие не помогло
+    if not changed and len(encoded) >= len(data):
+        return None
+    return encoded
+
+
+def preprocess_source(image_bytes: bytes, mime_type: str) -> Tuple[bytes, str]:
+    """
+    Подготовить исходник перед отправкой в Gemini. При любой ошибке возвращает оригинал.
+    """
+    if not settings.SOURCE_PREPROCESS_ENABLED:
+        return image_bytes, mime_type
+    try:
+        with metrics.timed("preprocess"):
+            data = _prepare(image_bytes, settings.SOURCE_MAX_EDGE, settings.SOURCE_JPEG_QUALITY)
+    except Exception as exc:
+        print(f"[preprocess] failed, sending original: {exc}")
+        metrics.incr("preprocess:failed")
+        return image_bytes, mime_type
+
+    if data is None:
+        metrics.incr("preprocess:kept_original")
+        return image_bytes, mime_type
+
+    metrics.incr("preprocess:bytes_in", len(image_bytes))
+    metrics.incr("preprocess:bytes_saved", len(image_bytes) - len(data))
+    print(f"[preprocess] {len(image_bytes)} -> {len(data)} bytes")
+    return data, "image/jpeg"
@@ -0,0 +1,116 @@
+"""
+Проверка JWT с кэшем уже проверенных claims.
+
+Токен доступа живёт минуты, а клиент шлёт его на каждый запрос (включая опрос
+статуса), поэтому полную проверку подписи делаем один раз на токен. Ключ кэша —
+sha256 от секрета и токена, запись живёт не дольше exp.
+
+Бэкенд проверки выбирается JWT_VERIFY_BACKEND:
+- "jose" — python-jose, как и раньше;
+- "hmac" — stdlib hmac для HS256/384/512 (другие алгоритмы уходят в jose).
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Callable, Dict, Optional
+
+from jose import JWTError, jwt
+
+from app.core.config import get_settings
+from app.services import metrics
+from app.services.ttl_cache import TTLCache
+
+settings = get_settings()
+
+
+class TokenInvalid(Exception):
+    """Подпись, формат или срок действия токена не прошли проверку."""
+
+
+def _jose_decode(token: str, secret_key: str, algorithm: str) -> dict:
+    try:
+        return jwt.decode(token, secret_key, algorithms=[algorithm])
+    except JWTError as exc:
+        raise TokenInvalid(str(exc)) from exc
+
+
+_HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _hmac_decode(token: str, secret_key: str, algorithm: str) -> dict:
+    """Проверка HS* подписи без python-jose: те же правила для alg, exp и nbf."""
+    digest = _HMAC_DIGESTS.get(algorithm)
+    if digest is None:
+        return _jose_decode(token, secret_key, algorithm)
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, TypeError) as exc:
+        raise TokenInvalid("Malformed token") from exc
+    if not isinstance(header, dict) or header.get("alg") != algorithm:
+        raise TokenInvalid("The specified alg value is not allowed")
+
+    expected = hmac.new(secret_key.encode(), f"{header_b64}.{payload_b64}".encode(), digest).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise TokenInvalid("Signature verification failed")
+
+    try:
+        claims = json.loads(_b64decode(payload_b64))
+    except ValueError as exc:
+        raise TokenInvalid("Invalid payload") from exc
+    if not isinstance(claims, dict):
+        raise TokenInvalid("Invalid payload")
+
+    now = time.time()
+    for claim in ("exp", "nbf"):
+        if claim in claims and not isinstance(claims[claim], (int, float)):
+            raise TokenInvalid(f"Invalid {claim} claim")
+    if "exp" in claims and claims["exp"] < now:
+        raise TokenInvalid("Signature has expired")
+    if "nbf" in claims and claims["nbf"] > now:
+        raise TokenInvalid("The token is not yet valid (nbf)")
+    return claims
+
+
+BACKENDS: Dict[str, Callable[[str, str, str], dict]] = {
+    "jose": _jose_decode,
+    "hmac": _hmac_decode,
+}
+
+_claims_cache = TTLCache(settings.JWT_CLAIMS_CACHE_MAXSIZE, settings.JWT_CLAIMS_CACHE_MAX_TTL_SECONDS)
+
+
+def decode_token(token: str, secret_key: str, algorithm: Optional[str] = None) -> dict:
+    """
+    Проверить токен и вернуть claims. Бросает TokenInvalid.
+
+    Успешные проверки кэшируются до exp; неуспешные не кэшируются.
+    """
+    algorithm = algorithm or settings.JWT_ALGORITHM
+    cache_key = hashlib.sha256(f"{algorithm}.{secret_key}.{token}".encode()).digest()
+    claims = _claims_cache.get(cache_key)
+    if claims is not None:
+        exp = claims.get("exp")
+        if exp is None or exp >= time.time():
+            metrics.incr("jwt_cache:hit")
+            return claims
+        _claims_cache.pop(cache_key)
+
+    metrics.incr("jwt_cache:miss")
+    claims = BACKENDS[settings.JWT_VERIFY_BACKEND](token, secret_key, algorithm)
+    exp = claims.get("exp")
+    ttl = None if exp is None else exp - time.time()
+    if ttl is None or ttl > 0:
+        _claims_cache.set(cache_key, claims, ttl=ttl)
+    return claims
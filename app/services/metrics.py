@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from app.core.config import get_settings
+from app.services.redis_client import get_redis
+
+settings = get_settings()
+
+# Общий hash в Redis: счётчики со всех процессов API и воркеров суммируются здесь
+METRICS_KEY = "metrics:counters"
+
+_lock = threading.Lock()
+_pending: Dict[str, float] = defaultdict(float)
+_last_flush = time.monotonic()
+
+
+def incr(name: str, amount: float = 1) -> None:
+    """Увеличить счётчик. Значение копится в процессе и периодически уходит в Redis."""
+    global _last_flush
+    with _lock:
+        _pending[name] += amount
+        due = time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL_SECONDS
+    if due:
+        flush()
+
+
+def observe(name: str, seconds: float) -> None:
+    """Записать длительность: count и sum_ms, среднее считается при чтении."""
+    incr(f"{name}:count")
+    incr(f"{name}:sum_ms", seconds * 1000)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def flush() -> None:
+    """Сбросить накопленные значения в Redis одним pipeline. Ошибки Redis не роняют вызывающий код."""
+    global _last_flush
+    with _lock:
+        if not _pending:
+            _last_flush = time.monotonic()
+            return
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for name, value in batch.items():
+            pipe.hincrbyfloat(METRICS_KEY, name, value)
+        pipe.execute()
+    except Exception as exc:
+        print(f"[metrics] flush failed: {exc}")
+        with _lock:
+            for name, value in batch.items():
+                _pending[name] += value
+
+
+def snapshot() -> Dict[str, float]:
+    """Текущие значения всех счётчиков (Redis + ещё не сброшенные локальные)."""
+    flush()
+    try:
+        raw = get_redis().hgetall(METRICS_KEY)
+    except Exception as exc:
+        print(f"[metrics] read failed: {exc}")
+        raw = {}
+    result = {name: float(value) for name, value in raw.items()}
+    with _lock:
+        for name, value in _pending.items():
+            result[name] = result.get(name, 0.0) + value
+    return dict(sorted(result.items()))
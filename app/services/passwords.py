@@ -0,0 +1,112 @@
+"""
+Хэширование и проверка паролей bcrypt в отдельном пуле процессов.
+
+bcrypt занимает CPU на сотни миллисекунд. Эндпоинты синхронные: поток
+threadpool Starlette ждёт результат, но сам хэш считается в другом процессе
+и не держит GIL API. Одновременно в работе и в очереди не больше
+PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_LIMIT операций, поэтому ждущих
+потоков тоже не больше. Сверх лимита, по таймауту и при упавшем пуле
+бросается PasswordPoolBusy, и запрос получает 503 вместо долгого ожидания.
+Упавший пул (BrokenProcessPool) пересоздаётся при следующем вызове.
+"""
+import multiprocessing
+import re
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+import bcrypt
+
+from app.core.config import get_settings
+from app.services import metrics
+
+settings = get_settings()
+
+_BCRYPT_COST_RE = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+_pool_lock = threading.Lock()
+_pool: Optional[Executor] = None
+_slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_LIMIT)
+
+
+class PasswordPoolBusy(Exception):
+    """Пул хэширования переполнен — запрос лучше отклонить сразу."""
+
+
+def _hashpw(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def _get_pool() -> Executor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if multiprocessing.current_process().daemon:
+                    # Демон не может порождать процессы; bcrypt отпускает GIL, хватит потоков
+                    _pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+                else:
+                    _pool = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+    return _pool
+
+
+def _discard_pool(broken: Executor) -> None:
+    """Забыть упавший пул; следующий вызов создаст новый."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+@contextmanager
+def _slot(operation: str) -> Iterator[None]:
+    if not _slots.acquire(blocking=False):
+        metrics.incr("passwords:rejected")
+        raise PasswordPoolBusy(f"password {operation} pool is saturated")
+    try:
+        with metrics.timed(f"passwords:{operation}"):
+            yield
+    finally:
+        _slots.release()
+
+
+def _encode(password: str) -> bytes:
+    # Truncate password to 72 bytes (bcrypt limit)
+    return password.encode("utf-8")[:72]
+
+
+def _run(operation: str, fn: Callable[..., Any], *args: Any) -> Any:
+    with _slot(operation):
+        pool = _get_pool()
+        try:
+            return pool.submit(fn, *args).result(timeout=settings.PASSWORD_HASH_TIMEOUT_SECONDS)
+        except BrokenProcessPool as exc:
+            # Процесс пула убит (OOM и т.п.) — все его future падают, пул больше не примет задач
+            _discard_pool(pool)
+            metrics.incr("passwords:pool_broken")
+            raise PasswordPoolBusy(f"password {operation} pool is broken") from exc
+        except FutureTimeoutError as exc:
+            metrics.incr("passwords:timeout")
+            raise PasswordPoolBusy(f"password {operation} timed out") from exc
+
+
+def hash_password(password: str) -> str:
+    return _run("hash", _hashpw, _encode(password), settings.PASSWORD_BCRYPT_ROUNDS).decode("utf-8")
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return _run("verify", _checkpw, _encode(plain_password), hashed_password.encode("utf-8"))
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Хэш посчитан с другой стоимостью, чем PASSWORD_BCRYPT_ROUNDS."""
+    match = _BCRYPT_COST_RE.match(hashed_password or "")
+    return match is None or int(match.group(1)) != settings.PASSWORD_BCRYPT_ROUNDS
@@ -0,0 +1,175 @@
+import time
+import uuid
+from typing import Optional
+
+from app.core.config import get_settings
+from app.services import metrics
+from app.services.redis_client import get_redis
+
+settings = get_settings()
+
+
+class GovernorBusy(Exception):
+    """Разрешение не получить за отведённое время — задачу лучше переотложить, а не ронять."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name}: rate limit queue is full, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+# Token bucket с адаптивной скоростью. Время берём у Redis, чтобы часы воркеров не влияли.
+# KEYS: bucket hash, waiters zset. ARGV: waiter_id, default_rate, burst, stale_ms.
+# Возвращает {granted, wait_ms, expected_ms}: expected_ms учитывает ждущих впереди этого waiter.
+# Score ждущего — время первой попытки (ZADD NX), поэтому повторные попытки не сдвигают его в конец.
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate') or ARGV[2])
+local burst = tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or burst)
+local ts = tonumber(redis.call('HGET', KEYS[1], 'ts') or now)
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[4]))
+local granted = 0
+local wait_ms = 0
+local expected_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    granted = 1
+    redis.call('ZREM', KEYS[2], ARGV[1])
+else
+    wait_ms = math.ceil((1 - tokens) * 1000 / rate)
+    redis.call('ZADD', KEYS[2], 'NX', now, ARGV[1])
+    local ahead = redis.call('ZRANK', KEYS[2], ARGV[1])
+    expected_ms = wait_ms + math.ceil(ahead * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now, 'rate', tostring(rate))
+redis.call('PEXPIRE', KEYS[1], 3600000)
+redis.call('PEXPIRE', KEYS[2], tonumber(ARGV[4]))
+return {granted, wait_ms, expected_ms}
+"""
+
+# ARGV: mode ('throttle' | 'success'), default_rate, min_rate, max_rate, factor, step
+# При throttle ведро обнуляется вместе с ts: иначе acquire досчитал бы токены от старого ts.
+_ADJUST_SCRIPT = """
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate') or ARGV[2])
+if ARGV[1] == 'throttle' then
+    rate = math.max(tonumber(ARGV[3]), rate * tonumber(ARGV[5]))
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+    redis.call('HSET', KEYS[1], 'tokens', '0', 'ts', now)
+else
+    rate = math.min(tonumber(ARGV[4]), rate + tonumber(ARGV[6]))
+end
+redis.call('HSET', KEYS[1], 'rate', tostring(rate))
+redis.call('PEXPIRE', KEYS[1], 3600000)
+return tostring(rate)
+"""
+
+
+class RateGovernor:
+    """
+    Общий для всех воркеров ограничитель запросов к внешнему API.
+
+    Скорость снижается в factor раз на 429/503 и растёт на step после успешных
+    вызовов (AIMD). Если Redis недоступен, вызовы пропускаются без ограничения.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        min_rate: float,
+        burst: int,
+        decrease_factor: float,
+        increase_step: float,
+    ):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self._bucket_key = f"governor:{name}:bucket"
+        self._waiters_key = f"governor:{name}:waiters"
+        self._acquire = None
+        self._adjust = None
+
+    def _scripts(self):
+        if self._acquire is None:
+            redis_client = get_redis()
+            self._acquire = redis_client.register_script(_ACQUIRE_SCRIPT)
+            self._adjust = redis_client.register_script(_ADJUST_SCRIPT)
+        return self._acquire, self._adjust
+
+    def acquire(self, max_wait: float) -> None:
+        """
+        Дождаться разрешения на один вызов.
+
+        Если по очереди ждущих видно, что разрешение не успеет прийти за max_wait,
+        сразу бросаем GovernorBusy — задача переоткладывается вместо долгого блокирования.
+        """
+        waiter_id = uuid.uuid4().hex
+        started = time.monotonic()
+        stale_ms = int((max_wait + 60) * 1000)
+        while True:
+            try:
+                acquire_script, _ = self._scripts()
+                granted, wait_ms, expected_ms = acquire_script(
+                    keys=[self._bucket_key, self._waiters_key],
+                    args=[waiter_id, self.rate, self.burst, stale_ms],
+                )
+            except Exception as exc:
+                print(f"[governor:{self.name}] redis unavailable, skipping limit: {exc}")
+                metrics.incr(f"governor:{self.name}:fail_open")
+                return
+
+            waited = time.monotonic() - started
+            if granted:
+                metrics.incr(f"governor:{self.name}:permits")
+                metrics.observe(f"governor:{self.name}:wait", waited)
+                return
+
+            remaining = max_wait - waited
+            if expected_ms / 1000 > remaining:
+                self._leave(waiter_id)
+                metrics.incr(f"governor:{self.name}:busy")
+                raise GovernorBusy(self.name, retry_after=expected_ms / 1000)
+            time.sleep(min(wait_ms / 1000, remaining))
+
+    def _leave(self, waiter_id: str) -> None:
+        try:
+            get_redis().zrem(self._waiters_key, waiter_id)
+        except Exception:
+            pass
+
+    def _adjust_rate(self, mode: str) -> Optional[float]:
+        try:
+            _, adjust_script = self._scripts()
+            return float(
+                adjust_script(
+                    keys=[self._bucket_key],
+                    args=[mode, self.rate, self.min_rate, self.rate, self.decrease_factor, self.increase_step],
+                )
+            )
+        except Exception as exc:
+            print(f"[governor:{self.name}] failed to adjust rate: {exc}")
+            return None
+
+    def record_throttle(self) -> None:
+        metrics.incr(f"governor:{self.name}:throttled")
+        rate = self._adjust_rate("throttle")
+        print(f"[governor:{self.name}] throttled by provider, rate -> {rate}")
+
+    def record_success(self) -> None:
+        self._adjust_rate("success")
+
+
+gemini_governor = RateGovernor(
+    "gemini",
+    rate=settings.GEMINI_RATE_PER_SECOND,
+    min_rate=settings.GEMINI_RATE_MIN_PER_SECOND,
+    burst=settings.GEMINI_RATE_BURST,
+    decrease_factor=settings.GEMINI_RATE_DECREASE_FACTOR,
+    increase_step=settings.GEMINI_RATE_INCREASE_STEP,
+)
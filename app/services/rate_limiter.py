@@ -0,0 +1,157 @@
+"""
+Ограничение частоты запросов на Lua-скрипте в Redis.
+
+Несколько лимитов проверяются одним вызовом (один round trip) и атомарно:
+если хотя бы один исчерпан, не списывается ни один. Алгоритмы:
+- "fixed" — фиксированное окно (INCR + PEXPIRE на первом запросе окна);
+- "gcra"  — скользящее окно через GCRA: равномерно восстанавливающаяся квота
+  без всплеска на границе окон, в Redis хранится одно число (TAT).
+
+Время берётся у Redis, поэтому часы разных процессов API не влияют на лимиты.
+"""
+from typing import List, NamedTuple, Optional, Sequence
+
+from app.services import metrics
+from app.services.redis_client import get_redis
+
+FIXED_WINDOW = "fixed"
+GCRA = "gcra"
+
+# KEYS: ключи лимитов. ARGV: cost, затем по 3 значения на ключ: algorithm, limit, window_ms.
+# Возвращает {allowed, remaining_1, reset_ms_1, retry_ms_1, remaining_2, ...}.
+_CHECK_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local allowed = 1
+local result = {}
+local pending = {}
+
+for i, key in ipairs(KEYS) do
+    local base = 1 + (i - 1) * 3
+    local algorithm = ARGV[base + 1]
+    local limit = tonumber(ARGV[base + 2])
+    local window = tonumber(ARGV[base + 3])
+    local remaining, reset_ms, retry_ms
+
+    if algorithm == 'gcra' then
+        local interval = window / limit
+        local tat = tonumber(redis.call('GET', key) or now)
+        if tat < now then tat = now end
+        local new_tat = tat + interval * cost
+        local allow_at = new_tat - window
+        if allow_at > now then
+            allowed = 0
+            retry_ms = math.ceil(allow_at - now)
+            remaining = math.max(0, math.floor((now - (tat - window)) / interval))
+            reset_ms = math.ceil(tat - now)
+        else
+            retry_ms = 0
+            remaining = math.floor((now - allow_at) / interval)
+            reset_ms = math.ceil(new_tat - now)
+            pending[#pending + 1] = {'gcra', key, new_tat, reset_ms}
+        end
+    else
+        local current = tonumber(redis.call('GET', key) or '0')
+        local ttl = redis.call('PTTL', key)
+        if ttl < 0 then ttl = window end
+        if current + cost > limit then
+            allowed = 0
+            retry_ms = ttl
+            remaining = math.max(0, limit - current)
+        else
+            retry_ms = 0
+            remaining = limit - current - cost
+            pending[#pending + 1] = {'fixed', key, cost, ttl}
+        end
+        reset_ms = ttl
+    end
+    result[#result + 1] = remaining
+    result[#result + 1] = reset_ms
+    result[#result + 1] = retry_ms
+end
+
+if allowed == 1 then
+    for _, op in ipairs(pending) do
+        if op[1] == 'gcra' then
+            redis.call('SET', op[2], tostring(op[3]), 'PX', op[4])
+        else
+            redis.call('INCRBY', op[2], op[3])
+            redis.call('PEXPIRE', op[2], op[4])
+        end
+    end
+end
+
+table.insert(result, 1, allowed)
+return result
+"""
+
+
+class Limit(NamedTuple):
+    key: str
+    limit: int
+    window_seconds: float
+    algorithm: str = FIXED_WINDOW
+
+
+class LimitState(NamedTuple):
+    limit: Limit
+    allowed: bool
+    remaining: int
+    reset_after: float  # через сколько секунд квота восстановится полностью / окно сбросится
+    retry_after: float  # через сколько секунд повторить, 0 — если лимит не исчерпан
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    reset_after: float
+    retry_after: float
+    states: List[LimitState]
+
+    def denied_by(self, key: str) -> bool:
+        return any(state.limit.key == key and not state.allowed for state in self.states)
+
+
+_script = None
+
+
+def _check_script():
+    global _script
+    if _script is None:
+        _script = get_redis().register_script(_CHECK_SCRIPT)
+    return _script
+
+
+def check(limits: Sequence[Limit], cost: int = 1) -> Optional[RateLimitResult]:
+    """
+    Проверить и списать cost со всех лимитов одним вызовом Redis.
+
+    None — если Redis недоступен (лимиты не применяются, как и у rate_governor).
+    """
+    if not limits:
+        return None
+    args = [cost]
+    for limit in limits:
+        args += [limit.algorithm, limit.limit, int(limit.window_seconds * 1000)]
+    try:
+        raw = _check_script()(keys=[limit.key for limit in limits], args=args)
+    except Exception as exc:
+        print(f"[rate_limiter] redis unavailable, skipping limits: {exc}")
+        metrics.incr("rate_limiter:fail_open")
+        return None
+
+    states = []
+    for i, limit in enumerate(limits):
+        remaining, reset_ms, retry_ms = (int(value) for value in raw[1 + i * 3: 4 + i * 3])
+        states.append(LimitState(limit, retry_ms == 0, remaining, reset_ms / 1000, retry_ms / 1000))
+
+    allowed = bool(raw[0])
+    metrics.incr("rate_limiter:allowed" if allowed else "rate_limiter:denied")
+    return RateLimitResult(
+        allowed=allowed,
+        remaining=min(state.remaining for state in states),
+        reset_after=max(state.reset_after for state in states),
+        retry_after=max(state.retry_after for state in states),
+        states=states,
+    )
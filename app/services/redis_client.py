@@ -2,6 +2,7 @@ from functools import lru_cache
 from typing import Optional
 
 import redis
+import redis.asyncio as aioredis
 
 from app.core.config import get_settings
 
@@ -15,3 +16,18 @@ def get_redis() -> redis.Redis:
     )
 
 
+@lru_cache
+def get_binary_redis() -> redis.Redis:
+    """Клиент без декодирования ответов — для хранения байтов изображений."""
+    settings = get_settings()
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+@lru_cache
+def get_async_redis() -> aioredis.Redis:
+    """Асинхронный клиент для долгоживущих подписок (SSE/WebSocket) в event loop API."""
+    settings = get_settings()
+    return aioredis.Redis.from_url(
+        settings.REDIS_URL,
+        decode_responses=True,
+    )
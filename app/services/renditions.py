@@ -0,0 +1,182 @@
+"""
+Уменьшенные копии изображений для сетки истории: thumb и preview в WebP.
+
+Копии лежат в S3 рядом с оригиналом: key.jpg → key.thumb.webp, key.preview.webp.
+Имя выводится из ключа оригинала, поэтому общий результат из кэша генераций
+получает одни и те же копии, а повторный запуск ничего не пересчитывает.
+
+Там же живут HD-копии для скачивания (key.hd.png / key.hd.webp): апскейл
+считается один раз на ключ и формат, дальше файл отдаётся из S3.
+"""
+import io
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageOps
+from redis.exceptions import RedisError
+
+from app.core.config import get_settings
+from app.services import metrics
+from app.services.redis_client import get_redis
+from app.services.s3 import (
+    delete_file_from_s3,
+    file_exists_in_s3,
+    get_file_url,
+    get_own_bucket_key,
+    read_file_from_s3,
+    upload_fileobj_to_s3,
+)
+from app.services.upscale import try_upscale_image
+
+settings = get_settings()
+
+RENDITION_NAMES = ("thumb", "preview")
+HD_FORMATS = ("png", "webp")
+
+
+def _rendition_edges() -> Dict[str, int]:
+    return {
+        "thumb": settings.RENDITION_THUMB_EDGE,
+        "preview": settings.RENDITION_PREVIEW_EDGE,
+    }
+
+
+def rendition_key(s3_key: str, name: str, ext: str = "webp") -> str:
+    directory, _, filename = s3_key.rpartition("/")
+    stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+    return f"{directory}/{stem}.{name}.{ext}" if directory else f"{stem}.{name}.{ext}"
+
+
+def hd_format(s3_key: str) -> str:
+    """Формат HD-копии: webp для webp-оригиналов, иначе png (как и раньше при скачивании)."""
+    return "webp" if s3_key.lower().endswith(".webp") else "png"
+
+
+def render_renditions(data: bytes) -> Dict[str, bytes]:
+    """Повернуть по EXIF и ужать оригинал до каждого размера (от большего к меньшему)."""
+    edges = _rendition_edges()
+    result: Dict[str, bytes] = {}
+    with Image.open(io.BytesIO(data)) as img:
+        current = ImageOps.exif_transpose(img)
+        if current.mode not in ("RGB", "RGBA"):
+            current = current.convert("RGBA" if "A" in current.getbands() else "RGB")
+        for name in sorted(edges, key=edges.get, reverse=True):
+            # Каждый следующий размер считаем из предыдущего — так дешевле, чем из оригинала
+            current = current.copy()
+            current.thumbnail((edges[name], edges[name]), Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            current.save(buf, format="WEBP", quality=settings.RENDITION_WEBP_QUALITY, method=4)
+            result[name] = buf.getvalue()
+    return result
+
+
+def ensure_renditions(url: Optional[str]) -> Optional[Dict[str, str]]:
+    """
+    Убедиться, что у изображения есть thumb и preview, и вернуть их ссылки.
+
+    None — если ссылка не из нашего бакета или оригинал уже удалён.
+    """
+    s3_key = get_own_bucket_key(url)
+    if not s3_key:
+        return None
+    keys = {name: rendition_key(s3_key, name) for name in RENDITION_NAMES}
+    if all(file_exists_in_s3(key) for key in keys.values()):
+        metrics.incr("renditions:reused")
+        return {name: get_file_url(key) for name, key in keys.items()}
+
+    data, _ = read_file_from_s3(s3_key)
+    if data is None:
+        return None
+    with metrics.timed("renditions:render"):
+        rendered = render_renditions(data)
+    for name, key in keys.items():
+        if not upload_fileobj_to_s3(io.BytesIO(rendered[name]), key, content_type="image/webp"):
+            raise Exception(f"Failed to upload rendition {key} to S3")
+    metrics.incr("renditions:bytes_in", len(data))
+    metrics.incr("renditions:bytes_out", sum(len(blob) for blob in rendered.values()))
+    return {name: get_file_url(key) for name, key in keys.items()}
+
+
+def _upscale_to(s3_key: str, hd_key: str, fmt: str) -> Optional[str]:
+    data, _ = read_file_from_s3(s3_key)
+    if data is None:
+        return None
+    metrics.incr("hd_download:miss")
+    with metrics.timed("hd_download:upscale"):
+        upscaled = try_upscale_image(data, output_format=fmt)
+    if upscaled is None:
+        # Апскейлер недоступен — отдаём оригинал, но не кэшируем его как HD
+        metrics.incr("hd_download:failed")
+        return s3_key
+    image_bytes, mime_type = upscaled
+    if not upload_fileobj_to_s3(io.BytesIO(image_bytes), hd_key, content_type=mime_type):
+        raise Exception(f"Failed to upload HD rendition {hd_key} to S3")
+    return hd_key
+
+
+def _release(redis_client, lock_key: str) -> None:
+    try:
+        redis_client.delete(lock_key)
+    except RedisError as exc:
+        print(f"[renditions] failed to release {lock_key}: {exc}")
+
+
+def ensure_hd_rendition(s3_key: str) -> Optional[str]:
+    """
+    Вернуть ключ HD-копии, при необходимости посчитав её.
+
+    Одновременные первые запросы на один ключ склеиваются через lock в Redis:
+    апскейлит один, остальные ждут появления файла. None — если оригинала нет;
+    ключ оригинала — если апскейл не удался.
+    """
+    fmt = hd_format(s3_key)
+    hd_key = rendition_key(s3_key, "hd", fmt)
+    if file_exists_in_s3(hd_key):
+        metrics.incr("hd_download:hit")
+        return hd_key
+
+    lock_key = f"hd:lock:{hd_key}"
+    deadline = time.monotonic() + settings.HD_UPSCALE_WAIT_SECONDS
+    try:
+        redis_client = get_redis()
+        waited = False
+        while True:
+            if redis_client.set(lock_key, "1", nx=True, ex=settings.HD_UPSCALE_LOCK_SECONDS):
+                try:
+                    # Файл мог появиться, пока мы ждали чужой lock
+                    if waited and file_exists_in_s3(hd_key):
+                        metrics.incr("hd_download:coalesced")
+                        return hd_key
+                    return _upscale_to(s3_key, hd_key, fmt)
+                finally:
+                    _release(redis_client, lock_key)
+            waited = True
+            time.sleep(0.5)
+            if file_exists_in_s3(hd_key):
+                metrics.incr("hd_download:coalesced")
+                return hd_key
+            if time.monotonic() >= deadline:
+                metrics.incr("hd_download:wait_timeout")
+                return s3_key
+    except RedisError as exc:
+        print(f"[renditions] HD lock unavailable, upscaling directly: {exc}")
+    return _upscale_to(s3_key, hd_key, fmt)
+
+
+def rendition_keys_for(url: Optional[str]) -> List[str]:
+    """Все возможные ключи копий оригинала: превью, миниатюра и HD-версии."""
+    s3_key = get_own_bucket_key(url)
+    if not s3_key:
+        return []
+    keys = [rendition_key(s3_key, name) for name in RENDITION_NAMES]
+    keys += [rendition_key(s3_key, "hd", fmt) for fmt in HD_FORMATS]
+    return keys
+
+
+def delete_renditions_for(url: Optional[str]) -> None:
+    """Удалить копии по ключу оригинала (даже если в записи они ещё не проставлены)."""
+    for key in rendition_keys_for(url):
+        try:
+            delete_file_from_s3(key)
+        except Exception as exc:
+            print(f"[renditions] failed to delete {key}: {exc}")
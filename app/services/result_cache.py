@@ -0,0 +1,76 @@
+import hashlib
+import json
+from typing import Dict, Optional
+
+from app.core.config import get_settings
+from app.services import metrics
+from app.services.redis_client import get_redis
+from app.services.s3 import file_exists_in_s3
+
+settings = get_settings()
+
+CACHE_PREFIX = "gen:cache:"
+
+
+def source_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def build_cache_key(
+    source_hash: str,
+    style: str,
+    style_meta: Optional[Dict[str, Optional[str]]],
+    is_hd: bool,
+) -> str:
+    """Ключ результата: хэш исходника + стиль + выбранные вариации + HD-флаг."""
+    variants = {}
+    if style_meta:
+        variants = {
+            name: style_meta.get(name)
+            for name in ("furniture", "walls", "floors", "ceiling", "lighting", "camera")
+        }
+    payload = json.dumps(
+        {"src": source_hash, "style": style.lower(), "variants": variants, "hd": bool(is_hd)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return CACHE_PREFIX + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_result(cache_key: str) -> Optional[dict]:
+    """
+    Вернуть закэшированный результат генерации или None.
+
+    Объект в S3 мог быть удалён вместе с аплоадом — такую запись считаем промахом.
+    """
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    try:
+        raw = get_redis().get(cache_key)
+    except Exception as exc:
+        print(f"[result_cache] read failed: {exc}")
+        raw = None
+    if raw:
+        entry = json.loads(raw)
+        if file_exists_in_s3(entry["filename"]):
+            metrics.incr("result_cache:hit")
+            return entry
+        try:
+            get_redis().delete(cache_key)
+        except Exception:
+            pass
+    metrics.incr("result_cache:miss")
+    return None
+
+
+def store_result(cache_key: str, entry: dict) -> None:
+    if not settings.RESULT_CACHE_ENABLED:
+        return
+    try:
+        get_redis().setex(
+            cache_key,
+            settings.RESULT_CACHE_TTL_SECONDS,
+            json.dumps(entry, ensure_ascii=False),
+        )
+    except Exception as exc:
+        print(f"[result_cache] write failed: {exc}")
@@ -1,8 +1,13 @@
 import boto3
+import re
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import Optional
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, List, Optional
+from urllib.parse import unquote, urlparse
 
 from app.core.config import get_settings
 
@@ -32,6 +37,7 @@ print(f"DEBUG S3 Config: Region: {settings.AWS_S3_REGION}")
 s3_config = Config(
     region_name=settings.AWS_S3_REGION,
     signature_version='s3v4',
+    max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
     s3={
         'addressing_style': 'virtual'  # Use virtual-hosted-style (bucket.s3.region.amazonaws.com)
     }
@@ -59,6 +65,14 @@ s3_client = boto3.client('s3', **client_kwargs)
 # This ensures regular uploads work correctly with AWS S3
 s3_client_upload = boto3.client('s3', **client_kwargs)
 
+# Потоковая загрузка: файл читается кусками, большие файлы уходят multipart-ом
+upload_transfer_config = TransferConfig(
+    multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=settings.S3_UPLOAD_CHUNK_SIZE,
+    max_concurrency=settings.S3_UPLOAD_MAX_CONCURRENCY,
+    io_chunksize=min(settings.S3_UPLOAD_CHUNK_SIZE, 256 * 1024),
+)
+
 
 def create_presigned_url_upload(
     filename: str, 
@@ -114,24 +128,32 @@ def create_presigned_url_upload(
         return None
 
 
-def create_presigned_url_download(filename: str, expires_in: int = 3600) -> Optional[str]:
+def create_presigned_url_download(
+    filename: str,
+    expires_in: int = 3600,
+    content_disposition: Optional[str] = None,
+) -> Optional[str]:
     """
     Generate a presigned URL for downloading a file from S3.
     
     Args:
         filename: Name of the file to download
         expires_in: URL expiration time in seconds (default: 3600)
+        content_disposition: Content-Disposition S3 should return (ResponseContentDisposition)
     
     Returns:
         Presigned URL string or None if error occurred
     """
+    params = {
+        'Bucket': settings.AWS_S3_BUCKET_NAME,
+        'Key': filename
+    }
+    if content_disposition:
+        params['ResponseContentDisposition'] = content_disposition
     try:
         response = s3_client.generate_presigned_url(
             'get_object',
-            Params={
-                'Bucket': settings.AWS_S3_BUCKET_NAME,
-                'Key': filename
-            },
+            Params=params,
             ExpiresIn=expires_in
         )
         return response
@@ -182,6 +204,10 @@ def upload_file_to_s3(file_path: str, s3_key: str) -> bool:
 def upload_fileobj_to_s3(file_obj, s3_key: str, content_type: str = 'image/jpeg') -> bool:
     """
     Upload a file-like object to S3.
+
+    The object is streamed in S3_UPLOAD_CHUNK_SIZE pieces; above
+    S3_MULTIPART_THRESHOLD it is sent as a multipart upload. Peak memory per
+    call is bounded by roughly chunk size * S3_UPLOAD_MAX_CONCURRENCY.
     
     Args:
         file_obj: File-like object to upload
@@ -192,28 +218,27 @@ def upload_fileobj_to_s3(file_obj, s3_key: str, content_type: str = 'image/jpeg'
         True if successful
     
     Raises:
-        ClientError: If upload fails
+        ClientError, S3UploadFailedError: If upload fails
     """
     try:
         # Reset file pointer to beginning if needed
         if hasattr(file_obj, 'seek'):
             file_obj.seek(0)
-        
-        # Use s3_client_upload for regular operations (without endpoint_url issues)
-        # Try using put_object directly for more control
-        file_obj.seek(0)
-        file_data = file_obj.read()
-        
-        s3_client_upload.put_object(
-            Bucket=settings.AWS_S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=file_data,
-            ContentType=content_type
+
+        s3_client_upload.upload_fileobj(
+            file_obj,
+            settings.AWS_S3_BUCKET_NAME,
+            s3_key,
+            ExtraArgs={'ContentType': content_type},
+            Config=upload_transfer_config,
         )
         return True
-    except ClientError as e:
-        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-        error_message = e.response.get('Error', {}).get('Message', str(e))
+    except (ClientError, S3UploadFailedError) as e:
+        if isinstance(e, ClientError):
+            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+            error_message = e.response.get('Error', {}).get('Message', str(e))
+        else:
+            error_code, error_message = 'UploadFailed', str(e)
         print(f"Error uploading file object to S3: {error_code} - {error_message}")
         # Print more details for debugging
         print(f"Bucket: {settings.AWS_S3_BUCKET_NAME}")
@@ -238,6 +263,85 @@ def _extract_key_from_url(url: str) -> Optional[str]:
     return path or None
 
 
+def get_own_bucket_key(url: str) -> Optional[str]:
+    """
+    Вернуть ключ S3, если ссылка указывает на наш бакет, иначе None.
+
+    Понимает virtual-hosted (bucket.s3[.region].amazonaws.com/key),
+    path-style (s3[.region].amazonaws.com/bucket/key) и кастомный
+    AWS_S3_ENDPOINT_URL (MinIO и т.п.: endpoint/bucket/key).
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    path = unquote(parsed.path.lstrip("/"))
+    bucket = settings.AWS_S3_BUCKET_NAME.lower()
+    bucket_prefix = f"{settings.AWS_S3_BUCKET_NAME}/"
+
+    if settings.AWS_S3_ENDPOINT_URL:
+        endpoint = urlparse(settings.AWS_S3_ENDPOINT_URL.strip())
+        endpoint_host = (endpoint.hostname or "").lower()
+        if host == endpoint_host and parsed.port == endpoint.port:
+            endpoint_path = endpoint.path.strip("/")
+            if endpoint_path:
+                if not path.startswith(endpoint_path + "/"):
+                    return None
+                path = path[len(endpoint_path) + 1:]
+            if path.startswith(bucket_prefix):
+                return path[len(bucket_prefix):] or None
+            return None
+        if host == f"{bucket}.{endpoint_host}":
+            return path or None
+
+    if re.fullmatch(rf"{re.escape(bucket)}\.s3([.-][a-z0-9-]+)?\.amazonaws\.com", host):
+        return path or None
+    if re.fullmatch(r"s3([.-][a-z0-9-]+)?\.amazonaws\.com", host) and path.startswith(bucket_prefix):
+        return path[len(bucket_prefix):] or None
+    return None
+
+
+def read_file_from_s3(s3_key: str) -> tuple[Optional[bytes], Optional[str]]:
+    """
+    Прочитать объект через boto3 ranged GET-ами. Первый запрос узнаёт размер,
+    остальные куски (если объект больше S3_READ_CHUNK_SIZE) качаются параллельно.
+    Возвращает (bytes, content_type) или (None, None), если объекта нет.
+    """
+    chunk_size = settings.S3_READ_CHUNK_SIZE
+    bucket = settings.AWS_S3_BUCKET_NAME
+
+    def _read_range(byte_range: tuple[int, int]) -> bytes:
+        start, end = byte_range
+        part = s3_client_upload.get_object(Bucket=bucket, Key=s3_key, Range=f"bytes={start}-{end}")
+        return part["Body"].read()
+
+    try:
+        first = s3_client_upload.get_object(Bucket=bucket, Key=s3_key, Range=f"bytes=0-{chunk_size - 1}")
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code == "InvalidRange":
+            # Пустой объект: диапазон 0-N для него не удовлетворим
+            return b"", None
+        if code not in ("NoSuchKey", "404"):
+            print(f"Error reading file from S3: {e}")
+        return None, None
+
+    content_type = first.get("ContentType")
+    head = first["Body"].read()
+    content_range = first.get("ContentRange") or ""
+    total = int(content_range.rsplit("/", 1)[-1]) if "/" in content_range else len(head)
+    if total <= len(head):
+        return head, content_type
+
+    ranges = [
+        (start, min(start + chunk_size, total) - 1)
+        for start in range(len(head), total, chunk_size)
+    ]
+    with ThreadPoolExecutor(max_workers=settings.S3_READ_CONCURRENCY) as pool:
+        rest = list(pool.map(_read_range, ranges))
+    return b"".join([head, *rest]), content_type
+
+
 def delete_file_from_s3(s3_key: str) -> bool:
     try:
         s3_client_upload.delete_object(
@@ -250,6 +354,34 @@ def delete_file_from_s3(s3_key: str) -> bool:
         return False
 
 
+S3_DELETE_OBJECTS_LIMIT = 1000  # ограничение DeleteObjects на один запрос
+
+
+def delete_files_from_s3(s3_keys: Iterable[str]) -> List[str]:
+    """
+    Удалить объекты пачками через DeleteObjects (до 1000 ключей за запрос).
+
+    Возвращает ключи, которые удалить не удалось. Отсутствующий ключ ошибкой не считается.
+    """
+    keys = list(dict.fromkeys(key for key in s3_keys if key))
+    failed: List[str] = []
+    for start in range(0, len(keys), S3_DELETE_OBJECTS_LIMIT):
+        chunk = keys[start:start + S3_DELETE_OBJECTS_LIMIT]
+        try:
+            response = s3_client_upload.delete_objects(
+                Bucket=settings.AWS_S3_BUCKET_NAME,
+                Delete={"Objects": [{"Key": key} for key in chunk], "Quiet": True},
+            )
+        except ClientError as e:
+            print(f"Error deleting {len(chunk)} files from S3: {e}")
+            failed.extend(chunk)
+            continue
+        for error in response.get("Errors", []):
+            print(f"Error deleting file {error.get('Key')} from S3: {error.get('Code')} {error.get('Message')}")
+            failed.append(error.get("Key"))
+    return failed
+
+
 def delete_file_by_url(url: str) -> bool:
     key = _extract_key_from_url(url)
     if not key:
@@ -258,6 +390,43 @@ def delete_file_by_url(url: str) -> bool:
     return delete_file_from_s3(key)
 
 
+def open_file_stream(
+    s3_key: str,
+    byte_range: Optional[str] = None,
+    if_none_match: Optional[str] = None,
+    if_modified_since: Optional[datetime] = None,
+) -> Optional[dict]:
+    """
+    Открыть объект для потоковой отдачи без чтения тела.
+
+    Range и условия передаются в S3 как есть, поэтому 304/206 не качают лишних байт.
+    Возвращает ответ get_object с полем StatusCode (200, 206, 304 или 416),
+    либо None, если объекта нет. Для 304/416 поля Body нет.
+    """
+    params = {"Bucket": settings.AWS_S3_BUCKET_NAME, "Key": s3_key}
+    if byte_range:
+        params["Range"] = byte_range
+    if if_none_match:
+        params["IfNoneMatch"] = if_none_match
+    if if_modified_since:
+        params["IfModifiedSince"] = if_modified_since
+    try:
+        obj = s3_client.get_object(**params)
+    except ClientError as e:
+        error = e.response.get("Error", {})
+        code = error.get("Code")
+        if code in ("304", "NotModified"):
+            headers = e.response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+            return {"StatusCode": 304, "ETag": headers.get("etag"), "LastModified": headers.get("last-modified")}
+        if code == "InvalidRange":
+            return {"StatusCode": 416, "ContentLength": error.get("ActualObjectSize")}
+        if code not in ("NoSuchKey", "404"):
+            print(f"Error opening file stream from S3: {e}")
+        return None
+    obj["StatusCode"] = 206 if obj.get("ContentRange") else 200
+    return obj
+
+
 def download_file_from_s3(s3_key: str) -> tuple[Optional[bytes], Optional[str]]:
     """
     Download a file from S3 by key. Returns (bytes, content_type) or (None, None) if not found.
@@ -273,3 +442,14 @@ def download_file_from_s3(s3_key: str) -> tuple[Optional[bytes], Optional[str]]:
         print(f"Error downloading file from S3: {e}")
         return None, None
 
+
+
+def file_exists_in_s3(s3_key: str) -> bool:
+    """Проверить наличие объекта через HEAD без скачивания тела."""
+    try:
+        s3_client.head_object(Bucket=settings.AWS_S3_BUCKET_NAME, Key=s3_key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            print(f"Error checking file in S3: {e}")
+        return False
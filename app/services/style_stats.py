@@ -0,0 +1,219 @@
+"""
+Счётчики популярности стилей.
+
+Каждая завершённая генерация делает HINCRBY в Redis вместо SELECT + UPDATE
+строки style_stats: на популярном стиле это была горячая блокировка.
+Накопленные приращения (style_stats:pending) раз в STYLE_STATS_FLUSH_SECONDS
+переносятся в БД одним INSERT ... ON CONFLICT DO UPDATE. У каждого переноса
+свой flush_id, записанный в style_stat_flushes в той же транзакции: если воркер
+упал после commit, повторный flush увидит id и не прибавит счётчики второй раз.
+
+Для /styles/popular держим итоговые счётчики в style_stats:totals: их
+собирает flush из БД, а между flush растит тот же HINCRBY. Если Redis
+недоступен, приращение пишется в БД сразу (атомарный upsert без SELECT).
+"""
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.core.styles_catalog import get_public_styles
+from app.models.style_stat import StyleStat, StyleStatFlush
+from app.services import metrics
+from app.services.redis_client import get_redis
+
+settings = get_settings()
+
+STYLE_STATS_PENDING_KEY = "style_stats:pending"
+STYLE_STATS_FLUSHING_KEY = "style_stats:flushing"
+STYLE_STATS_TOTALS_KEY = "style_stats:totals"
+STYLE_STATS_FLUSH_SCHEDULED_KEY = "style_stats:flush_scheduled"
+STYLE_STATS_FLUSH_LOCK_KEY = "style_stats:flush_lock"
+STYLE_STATS_FLUSH_ID_KEY = "style_stats:flush_id"
+# Поле-метка в totals: без него хэш создан HINCRBY после истечения TTL и неполон
+_TOTALS_LOADED_FIELD = "__loaded__"
+# id применённых flush нужны, только пока возможен повтор того же flush
+_FLUSH_IDS_KEEP = timedelta(days=1)
+
+# Начать перенос: pending -> flushing с новым flush_id. Если flushing остался от
+# упавшего flush, возвращается его id. nil — переносить нечего.
+_START_FLUSH_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('SET', KEYS[3], ARGV[1])
+    return ARGV[1]
+end
+local flush_id = redis.call('GET', KEYS[3])
+if not flush_id then
+    redis.call('SET', KEYS[3], ARGV[1])
+    flush_id = ARGV[1]
+end
+return flush_id
+"""
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _upsert_statement(counts: Dict[str, int]):
+    statement = insert(StyleStat).values(
+        [{"style_id": style_id, "count": count} for style_id, count in counts.items()]
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[StyleStat.style_id],
+        set_={"count": StyleStat.count + statement.excluded.count},
+    )
+
+
+def _upsert_counts(counts: Dict[str, int]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(_upsert_statement(counts))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _apply_flush(flush_id: str, counts: Dict[str, int]) -> bool:
+    """
+    Прибавить counts в одной транзакции с записью flush_id. False — этот flush
+    уже применён (воркер упал после commit), счётчики не трогаем.
+    """
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            insert(StyleStatFlush)
+            .values(flush_id=flush_id, applied_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=[StyleStatFlush.flush_id])
+            .returning(StyleStatFlush.flush_id)
+        ).first()
+        if claimed is None:
+            return False
+        if counts:
+            db.execute(_upsert_statement(counts))
+        db.query(StyleStatFlush).filter(
+            StyleStatFlush.applied_at < datetime.utcnow() - _FLUSH_IDS_KEEP
+        ).delete(synchronize_session=False)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def record_style_generation(style: Optional[str]) -> bool:
+    """
+    Учесть генерацию стиля. True — если нужно запланировать flush
+    (флаг style_stats:flush_scheduled только что выставлен этим вызовом).
+    """
+    if not style:
+        return False
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby(STYLE_STATS_PENDING_KEY, style, 1)
+        pipe.hincrby(STYLE_STATS_TOTALS_KEY, style, 1)
+        pipe.set(STYLE_STATS_FLUSH_SCHEDULED_KEY, "1", nx=True, ex=int(settings.STYLE_STATS_FLUSH_SECONDS) + 60)
+        return bool(pipe.execute()[2])
+    except Exception as exc:
+        print(f"[style_stat] redis unavailable, writing {style} directly: {exc}")
+    try:
+        _upsert_counts({style: 1})
+    except Exception as exc:
+        print(f"[style_stat] Failed to increment stat for {style}: {exc}")
+    return False
+
+
+def cancel_scheduled_flush() -> None:
+    get_redis().delete(STYLE_STATS_FLUSH_SCHEDULED_KEY)
+
+
+def _load_totals() -> Dict[str, int]:
+    """Счётчики из БД плюс ещё не перенесённые приращения из Redis."""
+    db = SessionLocal()
+    try:
+        totals = {row.style_id: row.count for row in db.query(StyleStat.style_id, StyleStat.count)}
+    finally:
+        db.close()
+    redis_client = get_redis()
+    for key in (STYLE_STATS_FLUSHING_KEY, STYLE_STATS_PENDING_KEY):
+        for style_id, count in redis_client.hgetall(key).items():
+            totals[style_id] = totals.get(style_id, 0) + int(count)
+    return totals
+
+
+def _cache_totals(totals: Dict[str, int]) -> None:
+    pipe = get_redis().pipeline()
+    pipe.delete(STYLE_STATS_TOTALS_KEY)
+    pipe.hset(STYLE_STATS_TOTALS_KEY, mapping={_TOTALS_LOADED_FIELD: 1, **totals})
+    pipe.expire(STYLE_STATS_TOTALS_KEY, settings.STYLE_STATS_TOTALS_TTL_SECONDS)
+    pipe.execute()
+
+
+def flush_style_stats() -> Optional[int]:
+    """
+    Перенести накопленные приращения в style_stats. Возвращает число стилей,
+    None — если идёт другой flush (тогда задачу нужно отложить).
+
+    Флаг style_stats:flush_scheduled снимается только под lock, иначе приращения,
+    пришедшие во время чужого flush, остались бы без запланированного переноса.
+    pending переименовывается в style_stats:flushing, поэтому приращения,
+    пришедшие во время записи, копятся в новом pending. Если запись в БД
+    не удалась, flushing остаётся и подхватывается следующим flush с тем же flush_id.
+    """
+    redis_client = get_redis()
+    token = uuid.uuid4().hex
+    if not redis_client.set(STYLE_STATS_FLUSH_LOCK_KEY, token, nx=True, ex=120):
+        return None
+    try:
+        redis_client.delete(STYLE_STATS_FLUSH_SCHEDULED_KEY)
+        flush_id = redis_client.eval(
+            _START_FLUSH_SCRIPT,
+            3,
+            STYLE_STATS_PENDING_KEY,
+            STYLE_STATS_FLUSHING_KEY,
+            STYLE_STATS_FLUSH_ID_KEY,
+            uuid.uuid4().hex,
+        )
+        if not flush_id:
+            # pending пуст — переносить нечего
+            return 0
+        counts = {style_id: int(count) for style_id, count in redis_client.hgetall(STYLE_STATS_FLUSHING_KEY).items()}
+        applied = _apply_flush(flush_id, counts)
+        redis_client.delete(STYLE_STATS_FLUSHING_KEY, STYLE_STATS_FLUSH_ID_KEY)
+        _cache_totals(_load_totals())
+        if applied:
+            metrics.incr("style_stats:flushed", sum(counts.values()))
+        else:
+            metrics.incr("style_stats:flush_replayed")
+        return len(counts)
+    finally:
+        redis_client.eval(_RELEASE_SCRIPT, 1, STYLE_STATS_FLUSH_LOCK_KEY, token)
+
+
+def popular_styles(limit: int) -> List[Dict[str, object]]:
+    """Стили каталога по убыванию числа генераций (из style_stats:totals, при промахе — из БД)."""
+    try:
+        totals = get_redis().hgetall(STYLE_STATS_TOTALS_KEY)
+        if totals.pop(_TOTALS_LOADED_FIELD, None) is None:
+            totals = _load_totals()
+            _cache_totals(totals)
+            metrics.incr("style_stats:totals_rebuilt")
+    except Exception as exc:
+        print(f"[style_stat] redis unavailable, reading totals from db: {exc}")
+        db = SessionLocal()
+        try:
+            totals = {row.style_id: row.count for row in db.query(StyleStat.style_id, StyleStat.count)}
+        finally:
+            db.close()
+
+    styles = [dict(style, count=int(totals.get(style["id"], 0))) for style in get_public_styles()]
+    styles.sort(key=lambda style: style["count"], reverse=True)
+    return styles[:limit]
@@ -1,54 +1,93 @@
+from typing import Optional, Tuple
+
 import httpx
-from typing import Tuple
 
 from app.core.config import get_settings
+from app.services.http_client import get_http_client
 
 settings = get_settings()
 
+# Ответы Stability, после которых вызов стоит повторить
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpscaleTemporarilyUnavailable(Exception):
+    """Stability перегружен или недоступен — вызов стоит повторить позже."""
+
 
-def upscale_image_fast(image_bytes: bytes, output_format: str = "webp") -> Tuple[bytes, str]:
+def try_upscale_image(
+    image_bytes: bytes,
+    output_format: str = "webp",
+    raise_transient: bool = False,
+) -> Optional[Tuple[bytes, str]]:
     """
     Upscale image 4x using Stability Fast Upscaler.
 
-    Returns (image_bytes, mime_type). On failure or missing key returns original.
+    Returns (image_bytes, mime_type), or None on failure or missing key.
+    With raise_transient, 429/5xx and connection errors raise
+    UpscaleTemporarilyUnavailable instead of returning None.
     """
     api_key = settings.STABILITY_AI_KEY
     if not api_key:
-        return image_bytes, f"image/{output_format}"
+        return None
 
     # Ensure allowed format
     if output_format not in {"png", "jpeg", "webp"}:
         output_format = "png"
 
     try:
-        with httpx.Client(timeout=60.0) as client:
-            resp = client.post(
-                "https://api.stability.ai/v2beta/stable-image/upscale/fast",
-                headers={
-                    "authorization": f"Bearer {api_key}",
-                    "accept": "image/*",
-                },
-                files={
-                    "image": ("image", image_bytes, "application/octet-stream"),
-                },
-                data={
-                    "output_format": output_format,
-                },
-            )
+        resp = get_http_client().post(
+            "https://api.stability.ai/v2beta/stable-image/upscale/fast",
+            headers={
+                "authorization": f"Bearer {api_key}",
+                "accept": "image/*",
+            },
+            files={
+                "image": ("image", image_bytes, "application/octet-stream"),
+            },
+            data={
+                "output_format": output_format,
+            },
+        )
 
         if resp.status_code == 200:
             mime = resp.headers.get("content-type", f"image/{output_format}")
             return resp.content, mime
+        if raise_transient and resp.status_code in TRANSIENT_STATUS_CODES:
+            raise UpscaleTemporarilyUnavailable(f"Upscale error: {resp.status_code}")
 
         # If API returns JSON error, log minimal info
         try:
             print(f"Upscale error: {resp.status_code} - {resp.json()}")
         except Exception:
             print(f"Upscale error: {resp.status_code} - {resp.text}")
-        return image_bytes, f"image/{output_format}"
+        return None
 
+    except UpscaleTemporarilyUnavailable:
+        raise
+    except httpx.TransportError as exc:
+        if raise_transient:
+            raise UpscaleTemporarilyUnavailable(f"Upscale connection error: {exc}") from exc
+        print(f"Upscale exception: {exc}")
+        return None
     except Exception as exc:
         print(f"Upscale exception: {exc}")
-        return image_bytes, f"image/{output_format}"
+        return None
+
 
+def upscale_image_fast(
+    image_bytes: bytes,
+    output_format: str = "webp",
+    raise_transient: bool = False,
+) -> Tuple[bytes, str]:
+    """
+    Upscale image 4x using Stability Fast Upscaler.
 
+    Returns (image_bytes, mime_type). On failure or missing key returns original.
+    """
+    result = try_upscale_image(image_bytes, output_format, raise_transient=raise_transient)
+    if result is None:
+        if output_format not in {"png", "jpeg", "webp"}:
+            output_format = "png"
+        return image_bytes, f"image/{output_format}"
+    return result
@@ -0,0 +1,127 @@
+"""
+Двухуровневый кэш пользователя для get_current_user.
+
+Первый уровень — TTL LRU в памяти процесса, второй — общий Redis. Кэшируются
+только поля, которые нужны обработчикам запросов; hashed_password и токены
+в кэш не попадают и при обращении догружаются из БД.
+
+Инвалидация: удаляем ключ в Redis и рассылаем id по pub/sub, чтобы каждый
+процесс API выкинул свою локальную копию. Если подписка отвалилась, локальный
+уровень очищается целиком, а короткий локальный TTL ограничивает устаревание.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from app.core.config import get_settings
+from app.services import metrics
+from app.services.redis_client import get_redis
+from app.services.ttl_cache import TTLCache
+
+settings = get_settings()
+
+USER_CACHE_PREFIX = "user:cache:"
+INVALIDATE_CHANNEL = "user:cache:invalidate"
+
+# Поля User, которые читают обработчики (UserResponse, биллинг, генерация)
+CACHED_FIELDS = ("id", "email", "created_at", "generation_count", "status")
+
+
+_local = TTLCache(settings.USER_CACHE_LOCAL_MAXSIZE, settings.USER_CACHE_LOCAL_TTL_SECONDS)
+_listener_lock = threading.Lock()
+_listener_pid: Optional[int] = None
+
+
+def _listen_invalidations() -> None:
+    while True:
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            for message in pubsub.listen():
+                try:
+                    _local.pop(int(message["data"]))
+                except (TypeError, ValueError):
+                    continue
+        except Exception as exc:
+            print(f"[user_cache] invalidation listener error: {exc}")
+        # Пока подписки не было, могли пропустить инвалидации
+        _local.clear()
+        time.sleep(5)
+
+
+def _ensure_listener() -> None:
+    """Подписка на инвалидации — одна на процесс, переживает fork воркеров uvicorn."""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _local.clear()
+        threading.Thread(target=_listen_invalidations, name="user-cache-invalidation", daemon=True).start()
+        _listener_pid = os.getpid()
+
+
+def _serialize(data: Dict[str, Any]) -> str:
+    return json.dumps(data, default=lambda value: value.isoformat())
+
+
+def _deserialize(raw: str) -> Dict[str, Any]:
+    data = json.loads(raw)
+    if data.get("created_at"):
+        data["created_at"] = datetime.fromisoformat(data["created_at"])
+    return data
+
+
+def get_cached_user(user_id: int) -> Optional[Dict[str, Any]]:
+    """Поля пользователя из кэша (сначала память процесса, затем Redis) или None."""
+    if not settings.USER_CACHE_ENABLED:
+        return None
+    _ensure_listener()
+
+    data = _local.get(user_id)
+    if data is not None:
+        metrics.incr("user_cache:local_hit")
+        return dict(data)
+
+    try:
+        raw = get_redis().get(f"{USER_CACHE_PREFIX}{user_id}")
+    except Exception as exc:
+        print(f"[user_cache] redis read failed: {exc}")
+        raw = None
+    if raw is None:
+        metrics.incr("user_cache:miss")
+        return None
+
+    data = _deserialize(raw)
+    _local.set(user_id, data)
+    metrics.incr("user_cache:redis_hit")
+    return dict(data)
+
+
+def cache_user(user) -> None:
+    if not settings.USER_CACHE_ENABLED:
+        return
+    data = {field: getattr(user, field) for field in CACHED_FIELDS}
+    _local.set(user.id, data)
+    try:
+        get_redis().setex(f"{USER_CACHE_PREFIX}{user.id}", settings.USER_CACHE_REDIS_TTL_SECONDS, _serialize(data))
+    except Exception as exc:
+        print(f"[user_cache] redis write failed: {exc}")
+
+
+def invalidate_user(user_id: Optional[int]) -> None:
+    """Вызывать после commit любого изменения кэшируемых полей пользователя."""
+    if not user_id:
+        return
+    _local.pop(user_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.delete(f"{USER_CACHE_PREFIX}{user_id}")
+        pipe.publish(INVALIDATE_CHANNEL, str(user_id))
+        pipe.execute()
+    except Exception as exc:
+        print(f"[user_cache] invalidation failed for {user_id}: {exc}")
@@ -0,0 +1,55 @@
+"""
+Сверка кэша балансов (balance_cache) с Postgres.
+"""
+import sys
+from typing import Optional
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models.generation import GenerationBalance
+from app.services import metrics
+from app.services.balance_cache import find_drift, invalidate_balance
+from app.workers.celery_app import celery_app
+
+settings = get_settings()
+
+
+@celery_app.task(name="billing.reconcile_balances", soft_time_limit=300, time_limit=360)
+def reconcile_balances(batch_size: Optional[int] = None, after_id: int = 0) -> int:
+    """
+    Найти закэшированные балансы, которые расходятся с БД, и удалить их из кэша.
+
+    Удаляем, а не перезаписываем: пока идёт сверка, строку может изменить
+    списание, и перезапись вернула бы старое значение. Следующее чтение
+    возьмёт баланс из БД. Идёт по id пачками и перезапускает себя.
+    """
+    batch_size = batch_size or settings.BALANCE_RECONCILE_BATCH_SIZE
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(GenerationBalance)
+            .filter(GenerationBalance.id > after_id)
+            .order_by(GenerationBalance.id)
+            .limit(batch_size)
+            .all()
+        )
+    finally:
+        db.close()
+
+    drifted = find_drift(rows)
+    for user_id in drifted:
+        invalidate_balance(user_id)
+    if drifted:
+        metrics.incr("balance_cache:drift", len(drifted))
+        print(f"[billing] balance cache drift for users {drifted}")
+
+    if len(rows) == batch_size:
+        reconcile_balances.delay(batch_size, rows[-1].id)
+    return len(drifted)
+
+
+if __name__ == "__main__":
+    # python -m app.workers.billing [batch_size] — запустить сверку через очередь
+    batch = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    result = reconcile_balances.delay(batch)
+    print(f"reconcile started: {result.id}")
@@ -1,6 +1,22 @@
+import time
+
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, worker_process_init, worker_process_shutdown
+from kombu import Queue
 
 from app.core.config import get_settings
+from app.workers.queues import (
+    DEFAULT_QUEUE,
+    GENERATION_QUEUES,
+    PIPELINE_QUEUES,
+    QUEUE_FREE,
+    QUEUE_PIPELINE_FETCH,
+    QUEUE_PIPELINE_FINALIZE,
+    QUEUE_PIPELINE_STORE,
+    QUEUE_PIPELINE_UPSCALE,
+    QUEUE_EMAIL,
+    QUEUE_RENDITIONS,
+)
 
 settings = get_settings()
 
@@ -12,7 +28,7 @@ celery_app = Celery(
     "ai_service",
     broker=broker_url,
     backend=result_backend,
-    include=["app.workers.tasks"]
+    include=["app.workers.tasks", "app.workers.pipeline", "app.workers.renditions", "app.workers.mail", "app.workers.billing", "app.workers.uploads"]
 )
 
 celery_app.conf.update(
@@ -24,5 +40,67 @@ celery_app.conf.update(
     task_track_started=True,
     task_time_limit=300,  # 5 minutes
     task_soft_time_limit=240,  # 4 minutes
+    task_default_queue=DEFAULT_QUEUE,
+    task_queues=[Queue(DEFAULT_QUEUE)] + [Queue(name) for name in GENERATION_QUEUES + PIPELINE_QUEUES + (QUEUE_RENDITIONS, QUEUE_EMAIL)],
+    # Очередь генерации выбирает create_generate_task по тарифу; без явной очереди — бесплатная
+    task_routes={
+        "generate_image_task": {"queue": QUEUE_FREE},
+        "pipeline.generate": {"queue": QUEUE_FREE},
+        "pipeline.fetch_source": {"queue": QUEUE_PIPELINE_FETCH},
+        "pipeline.upscale": {"queue": QUEUE_PIPELINE_UPSCALE},
+        "pipeline.store": {"queue": QUEUE_PIPELINE_STORE},
+        "pipeline.finalize": {"queue": QUEUE_PIPELINE_FINALIZE},
+        "renditions.*": {"queue": QUEUE_RENDITIONS},
+        "email.*": {"queue": QUEUE_EMAIL},
+    },
+    # Воркер на нескольких очередях сначала разбирает более приоритетные (порядок в -Q)
+    broker_transport_options={"queue_order_strategy": "priority"},
+    # Периодические задачи (./start_celery.sh beat); от двойного запуска задачи защищены lock в Redis
+    beat_schedule={
+        "uploads-reap-expired": {
+            "task": "uploads.reap_expired",
+            "schedule": settings.UPLOAD_REAPER_INTERVAL_SECONDS,
+        },
+    },
 )
 
+
+@before_task_publish.connect
+def _stamp_enqueued_at(headers=None, **kwargs) -> None:
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+@task_prerun.connect
+def _record_queue_wait(task=None, **kwargs) -> None:
+    """Время ожидания в очереди: от публикации до старта задачи, отдельно по очередям."""
+    from app.services import metrics
+
+    request = task.request
+    enqueued_at = getattr(request, "enqueued_at", None) or (request.headers or {}).get("enqueued_at")
+    if not enqueued_at:
+        return
+    queue = (request.delivery_info or {}).get("routing_key") or DEFAULT_QUEUE
+    metrics.observe(f"queue_wait:{queue}", max(0.0, time.time() - float(enqueued_at)))
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs) -> None:
+    """Прогреваем общий HTTP-пул в каждом дочернем процессе воркера."""
+    from app.services.http_client import warm_http_client
+
+    try:
+        warm_http_client()
+    except Exception as exc:
+        print(f"[celery] HTTP client warmup failed: {exc}")
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**kwargs) -> None:
+    from app.services import metrics
+    from app.services.email import close_email_connections
+    from app.services.http_client import close_http_client
+
+    close_http_client()
+    close_email_connections()
+    metrics.flush()
@@ -0,0 +1,100 @@
+"""
+Отправка писем из outbox пачками в отдельной очереди email.
+"""
+import json
+import uuid
+from typing import List
+
+from app.core.config import get_settings
+from app.services.email import (
+    EMAIL_FLUSH_LOCK_KEY,
+    EMAIL_FLUSH_SCHEDULED_KEY,
+    ack_outbox_batch,
+    claim_outbox_batch,
+    deliver_emails,
+)
+from app.services.redis_client import get_redis
+from app.workers.celery_app import celery_app
+
+settings = get_settings()
+
+# Lock дольше time_limit задачи: после падения воркера его снимет TTL
+FLUSH_LOCK_SECONDS = 180
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def schedule_outbox_flush() -> None:
+    """
+    Запланировать flush через EMAIL_BATCH_WINDOW_SECONDS, если он ещё не запланирован.
+
+    Все письма, пришедшие за окно, уйдут одной пачкой.
+    """
+    redis_client = get_redis()
+    # Флаг с запасом по TTL: если задача потерялась, следующее письмо запланирует новую
+    ttl = int(settings.EMAIL_BATCH_WINDOW_SECONDS) + 60
+    if not redis_client.set(EMAIL_FLUSH_SCHEDULED_KEY, "1", nx=True, ex=ttl):
+        return
+    try:
+        flush_outbox.apply_async(countdown=settings.EMAIL_BATCH_WINDOW_SECONDS)
+    except Exception:
+        redis_client.delete(EMAIL_FLUSH_SCHEDULED_KEY)
+        raise
+
+
+def _deliver_claimed(raw: List[str]) -> int:
+    messages = []
+    for item in raw:
+        try:
+            messages.append(json.loads(item))
+        except ValueError:
+            print(f"[email] dropping malformed outbox entry: {item[:200]}")
+    failed = deliver_emails(messages) if messages else []
+    if failed:
+        deliver_emails_task.apply_async((failed,), countdown=_backoff(0))
+    # Если публикация повтора упала, пачка остаётся в processing и уйдёт ещё раз (at-least-once)
+    ack_outbox_batch(raw)
+    return len(messages) - len(failed)
+
+
+@celery_app.task(name="email.flush_outbox", soft_time_limit=120, time_limit=150)
+def flush_outbox() -> int:
+    redis_client = get_redis()
+    # Снимаем флаг до чтения: письма, пришедшие во время отправки, запланируют следующий flush
+    redis_client.delete(EMAIL_FLUSH_SCHEDULED_KEY)
+    token = uuid.uuid4().hex
+    if not redis_client.set(EMAIL_FLUSH_LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_SECONDS):
+        # Другой flush ещё идёт и может не увидеть новые письма — откладываем себя
+        schedule_outbox_flush()
+        return 0
+    sent = 0
+    try:
+        while True:
+            batch = claim_outbox_batch()
+            if not batch:
+                break
+            sent += _deliver_claimed(batch)
+    finally:
+        redis_client.eval(_RELEASE_SCRIPT, 1, EMAIL_FLUSH_LOCK_KEY, token)
+    return sent
+
+
+def _backoff(retries: int) -> int:
+    return min(settings.EMAIL_RETRY_BACKOFF_MAX_SECONDS, 2 ** (retries + 2))
+
+
+@celery_app.task(bind=True, name="email.deliver", soft_time_limit=120, time_limit=150)
+def deliver_emails_task(self, messages: List[dict]) -> int:
+    """Повторная отправка писем, которые не ушли в flush. Повторяются только неотправленные."""
+    failed = deliver_emails(messages)
+    if failed:
+        if self.request.retries >= settings.EMAIL_MAX_RETRIES:
+            print(f"[email] giving up on {len(failed)} messages after {self.request.retries} retries")
+            return len(messages) - len(failed)
+        raise self.retry(args=(failed,), countdown=_backoff(self.request.retries + 1), max_retries=None)
+    return len(messages)
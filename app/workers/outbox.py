@@ -0,0 +1,184 @@
+"""
+Transactional outbox для задач генерации.
+
+Запрос на генерацию одной транзакцией списывает кредит, обновляет аплоад и
+счётчик и пишет задачу в generation_outbox. В брокер её публикует relay —
+отдельный процесс (python -m app.workers.outbox или ./start_celery.sh outbox).
+Если брокер недоступен, строки остаются в таблице и уходят при следующем
+проходе, поэтому оплаченная генерация не теряется.
+
+Relay будит LPUSH в outbox:wakeup после commit, а без него он просыпается
+раз в OUTBOX_RELAY_POLL_SECONDS. Строки берутся FOR UPDATE SKIP LOCKED, так
+что relay можно запускать в нескольких экземплярах. Доставка at-least-once:
+если relay упал между публикацией и commit, задача уйдёт повторно.
+
+Ошибка брокера останавливает проход: остальные строки ждут следующего. Любая
+другая ошибка касается только своей строки: она считается в attempts, а после
+OUTBOX_MAX_ATTEMPTS строка помечается dead_at, кредиты возвращаются, а задачи
+получают FAILURE, чтобы клиент не ждал.
+"""
+import json
+import time
+from datetime import datetime
+from typing import List, Optional, Set
+
+from celery import group, states
+from kombu.exceptions import OperationalError as BrokerError
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models.outbox import GenerationOutbox
+from app.services import metrics
+from app.services.balance_cache import invalidate_balance
+from app.services.events import publish_task_event
+from app.services.generations import refund_generation
+from app.services.redis_client import get_redis
+from app.workers.celery_app import celery_app
+from app.workers.pipeline import build_generation_pipeline
+
+settings = get_settings()
+
+OUTBOX_WAKEUP_KEY = "outbox:wakeup"
+
+# Брокер недоступен: повторять весь проход позже, а не тратить попытки строк
+BROKER_ERRORS = (BrokerError, OSError)
+
+
+def add_to_outbox(db: Session, jobs: List[dict], batch_id: Optional[str] = None) -> None:
+    """
+    Записать задачу в outbox текущей транзакции (без commit).
+
+    jobs — аргументы build_generation_pipeline с заранее выданным job_id;
+    для пакета публикуется group с task_id=batch_id.
+    """
+    db.add(
+        GenerationOutbox(
+            job_key=batch_id or jobs[0]["job_id"],
+            payload=json.dumps({"batch_id": batch_id, "jobs": jobs}),
+        )
+    )
+
+
+def wake_relay() -> None:
+    """Разбудить relay после commit; без этого задача уйдёт при следующем опросе."""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.lpush(OUTBOX_WAKEUP_KEY, "1")
+        pipe.ltrim(OUTBOX_WAKEUP_KEY, 0, 0)
+        pipe.execute()
+    except Exception as exc:
+        print(f"[outbox] wakeup failed: {exc}")
+
+
+def _publish(payload: dict) -> None:
+    jobs = payload["jobs"]
+    batch_id = payload.get("batch_id")
+    if batch_id:
+        group(build_generation_pipeline(**job)[0] for job in jobs).apply_async(task_id=batch_id)
+    else:
+        build_generation_pipeline(**jobs[0])[0].apply_async()
+
+
+def _dead_letter(db: Session, row: GenerationOutbox, payload: Optional[dict]) -> List[dict]:
+    """Снять строку с публикации и вернуть кредиты (в транзакции relay). Возвращает её задачи."""
+    row.dead_at = datetime.utcnow()
+    metrics.incr("outbox:dead_lettered")
+    print(f"[outbox] giving up on {row.job_key} after {row.attempts} attempts: {row.last_error}")
+    jobs = (payload or {}).get("jobs") or []
+    refunds = {}
+    for job in jobs:
+        key = (job["user_id"], bool(job["is_hd"]))
+        refunds[key] = refunds.get(key, 0) + 1
+    for (user_id, is_hd), count in refunds.items():
+        refund_generation(db, user_id, is_hd=is_hd, count=count)
+    return jobs
+
+
+def _fail_jobs(jobs: List[dict]) -> None:
+    """После commit: пометить задачи FAILURE в result backend и оповестить клиента."""
+    error = RuntimeError("Не удалось поставить генерацию в очередь, кредит возвращён")
+    for job in jobs:
+        try:
+            celery_app.backend.store_result(job["job_id"], error, states.FAILURE)
+        except Exception as exc:
+            print(f"[outbox] failed to store failure for {job['job_id']}: {exc}")
+        publish_task_event(
+            job["user_id"], job["job_id"], "FAILURE", style_id=job.get("style"), error=str(error)
+        )
+
+
+def relay_outbox(batch_size: Optional[int] = None) -> int:
+    """Опубликовать до batch_size задач из outbox. Возвращает число опубликованных."""
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    db = SessionLocal()
+    failed_jobs: List[dict] = []
+    refunded: Set[int] = set()
+    try:
+        rows = (
+            db.query(GenerationOutbox)
+            .filter(GenerationOutbox.dead_at.is_(None))
+            .order_by(GenerationOutbox.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        published = 0
+        for row in rows:
+            payload = None
+            try:
+                payload = json.loads(row.payload)
+                _publish(payload)
+            except BROKER_ERRORS as exc:
+                # Брокер недоступен — остальные строки попробуем в следующий проход
+                row.attempts += 1
+                row.last_error = str(exc)[:1000]
+                metrics.incr("outbox:publish_failed")
+                print(f"[outbox] broker unavailable, publishing {row.job_key} later: {exc}")
+                break
+            except Exception as exc:
+                # Ошибка самой строки: не мешает следующим, после лимита попыток — dead-letter
+                row.attempts += 1
+                row.last_error = str(exc)[:1000]
+                metrics.incr("outbox:publish_failed")
+                print(f"[outbox] publish failed for {row.job_key}: {exc}")
+                if row.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    jobs = _dead_letter(db, row, payload)
+                    failed_jobs += jobs
+                    refunded.update(job["user_id"] for job in jobs)
+                continue
+            metrics.observe("outbox:lag", (datetime.utcnow() - row.created_at).total_seconds())
+            db.delete(row)
+            published += 1
+        db.commit()
+    finally:
+        db.close()
+    for user_id in refunded:
+        invalidate_balance(user_id)
+    _fail_jobs(failed_jobs)
+    if published:
+        metrics.incr("outbox:published", published)
+    return published
+
+
+def run_relay() -> None:
+    """Цикл relay: публикуем, пока есть строки, затем ждём wakeup или таймаут опроса."""
+    redis_client = get_redis()
+    print("[outbox] relay started")
+    while True:
+        try:
+            published = relay_outbox()
+        except Exception as exc:
+            print(f"[outbox] relay error: {exc}")
+            time.sleep(settings.OUTBOX_RELAY_POLL_SECONDS)
+            continue
+        if published == settings.OUTBOX_RELAY_BATCH_SIZE:
+            continue
+        try:
+            redis_client.blpop(OUTBOX_WAKEUP_KEY, timeout=settings.OUTBOX_RELAY_POLL_SECONDS)
+        except Exception:
+            time.sleep(settings.OUTBOX_RELAY_POLL_SECONDS)
+
+
+if __name__ == "__main__":
+    run_relay()
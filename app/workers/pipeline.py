@@ -0,0 +1,246 @@
+"""
+Генерация как цепочка стадий: fetch → generate → upscale → store → finalize.
+
+Каждая стадия — отдельная Celery-задача в своей очереди со своими лимитами,
+поэтому медленный Gemini не держит слоты воркеров загрузки и записи в S3,
+а повтор стадии не повторяет уже выполненные дорогие шаги. Между стадиями
+через брокер передаётся только небольшой dict со ссылками; байты изображений
+лежат в blob_store. id последней стадии (finalize) — это job_id, который
+получает клиент: по нему работают /generate/status и события.
+"""
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+import httpx
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+from celery import chain, states
+from celery.canvas import Signature
+from sqlalchemy.exc import OperationalError
+
+from app.core.config import get_settings
+from app.services.ai import TRANSIENT_PROVIDER_ERRORS, fetch_source_image, generate_image
+from app.services.blob_store import BLOB_PREFIX, BlobMissing, delete_blobs, get_blob, put_blob
+from app.services.events import publish_task_event
+from app.services.rate_governor import GovernorBusy
+from app.services.upscale import UpscaleTemporarilyUnavailable
+from app.workers.celery_app import celery_app
+from app.workers.queues import (
+    QUEUE_PIPELINE_FETCH,
+    QUEUE_PIPELINE_FINALIZE,
+    QUEUE_PIPELINE_STORE,
+    QUEUE_PIPELINE_UPSCALE,
+    stage_queue,
+)
+from app.workers.tasks import (
+    _finish_generation,
+    _prepare_generation,
+    _result_filename,
+    _store_generated,
+    _upscale_hd,
+)
+
+settings = get_settings()
+
+
+def _blob_name(job: dict, kind: str) -> str:
+    return f"pipeline:{job['job_id']}:{kind}"
+
+
+def _mark_progress(job: dict, stage: str) -> None:
+    """Показать клиенту текущую стадию: и в result backend (для /status), и событием."""
+    try:
+        celery_app.backend.store_result(job["job_id"], {"stage": stage}, states.STARTED)
+    except Exception as exc:
+        print(f"[pipeline] failed to store progress for {job['job_id']}: {exc}")
+    publish_task_event(job["user_id"], job["job_id"], "STARTED", style_id=job["style"], stage=stage)
+
+
+@celery_app.task(
+    bind=True,
+    name="pipeline.fetch_source",
+    autoretry_for=(httpx.TransportError,),
+    retry_backoff=True,
+    max_retries=3,
+    soft_time_limit=60,
+    time_limit=90,
+)
+def fetch_source_stage(self, job: dict) -> dict:
+    """Скачать исходник, выбрать вариации и проверить кэш результатов."""
+    _mark_progress(job, "fetch")
+    source, prompt, style_meta, cache_key, cached = _prepare_generation(
+        job["image_url"], job["style"], job["is_hd"], job["new_variation"], job.get("batch_id")
+    )
+    job = {**job, "prompt": prompt, "style_meta": style_meta, "cache_key": cache_key}
+    if cached:
+        # Дальнейшие стадии пропускают работу и передают job дальше до finalize
+        job.update(
+            cached=True,
+            filename=cached["filename"],
+            result_url=cached["result_url"],
+            style_meta=cached.get("style_meta"),
+        )
+        return job
+    source_bytes, source_mime = source
+    job["source_ref"] = put_blob(_blob_name(job, "source"), source_bytes, source_mime)
+    return job
+
+
+@celery_app.task(
+    bind=True,
+    name="pipeline.generate",
+    autoretry_for=TRANSIENT_PROVIDER_ERRORS,
+    retry_backoff=True,
+    max_retries=3,
+    soft_time_limit=240,
+    time_limit=300,
+)
+def generate_stage(self, job: dict) -> dict:
+    if job.get("cached"):
+        return job
+    _mark_progress(job, "generate")
+    try:
+        source = get_blob(job["source_ref"])
+    except BlobMissing:
+        source = fetch_source_image(job["image_url"])
+
+    try:
+        image_bytes, mime_type, style_meta = generate_image(
+            job["image_url"],
+            job["style"],
+            prompt=job["prompt"],
+            style_meta=job["style_meta"],
+            source=source,
+        )
+    except GovernorBusy as exc:
+        # Провайдер перегружен: повторяем только эту стадию, исходник уже в blob_store
+        raise self.retry(exc=exc, countdown=exc.retry_after, max_retries=settings.GEMINI_TASK_MAX_RETRIES)
+
+    print(f"[pipeline] job {job['job_id']} generated, size: {len(image_bytes)} bytes")
+    result_ref = put_blob(_blob_name(job, "result"), image_bytes, mime_type)
+    delete_blobs(job["source_ref"])
+    return {**job, "source_ref": None, "result_ref": result_ref, "style_meta": style_meta}
+
+
+@celery_app.task(
+    bind=True,
+    name="pipeline.upscale",
+    autoretry_for=(UpscaleTemporarilyUnavailable,),
+    retry_backoff=True,
+    max_retries=3,
+    soft_time_limit=120,
+    time_limit=150,
+)
+def upscale_stage(self, job: dict) -> dict:
+    if job.get("cached"):
+        return job
+    _mark_progress(job, "upscale")
+    image_bytes, _ = get_blob(job["result_ref"])
+    # Последняя попытка не бросает: при недоступном Stability отдаём исходный размер, как раньше
+    image_bytes, mime_type = _upscale_hd(image_bytes, raise_transient=self.request.retries < self.max_retries)
+    result_ref = put_blob(_blob_name(job, "result"), image_bytes, mime_type)
+    return {**job, "result_ref": result_ref}
+
+
+@celery_app.task(
+    bind=True,
+    name="pipeline.store",
+    autoretry_for=(ClientError, S3UploadFailedError),
+    retry_backoff=True,
+    max_retries=3,
+    soft_time_limit=60,
+    time_limit=90,
+)
+def store_stage(self, job: dict) -> dict:
+    if job.get("cached"):
+        return job
+    _mark_progress(job, "store")
+    image_bytes, mime_type = get_blob(job["result_ref"])
+    # Имя от job_id: повтор стадии перезапишет тот же объект, а не создаст новый
+    filename = _result_filename(job["style"], mime_type, job["created_at"], job["job_id"][:8])
+    result_url = _store_generated(image_bytes, mime_type, filename, job["cache_key"], job["style_meta"])
+    return {**job, "filename": filename, "result_url": result_url}
+
+
+@celery_app.task(
+    bind=True,
+    name="pipeline.finalize",
+    autoretry_for=(OperationalError,),
+    retry_backoff=True,
+    max_retries=5,
+    soft_time_limit=30,
+    time_limit=60,
+)
+def finalize_stage(self, job: dict) -> dict:
+    result = _finish_generation(
+        job["job_id"],
+        job["upload_id"],
+        job["user_id"],
+        job["style"],
+        job["is_hd"],
+        job["result_url"],
+        job["filename"],
+        job.get("style_meta"),
+        cached=bool(job.get("cached")),
+        batch_id=job.get("batch_id"),
+    )
+    delete_blobs(job.get("result_ref"))
+    return result
+
+
+@celery_app.task(name="pipeline.failed")
+def pipeline_failed(request, exc, traceback, job_id: str, user_id: Optional[int] = None, style: Optional[str] = None) -> None:
+    """Errback цепочки: помечаем job_id как FAILURE, чтобы клиент не ждал вечно."""
+    error_msg = str(exc)
+    print(f"[pipeline] job {job_id} failed at {request.task}: {error_msg}")
+    try:
+        celery_app.backend.store_result(job_id, exc, states.FAILURE)
+    except Exception as backend_exc:
+        print(f"[pipeline] failed to store failure for {job_id}: {backend_exc}")
+    publish_task_event(user_id, job_id, "FAILURE", style_id=style, error=error_msg)
+    delete_blobs(f"{BLOB_PREFIX}pipeline:{job_id}:source", f"{BLOB_PREFIX}pipeline:{job_id}:result")
+
+
+def build_generation_pipeline(
+    image_url: str,
+    style: str,
+    upload_id: Optional[int],
+    user_id: Optional[int],
+    is_hd: bool,
+    new_variation: bool,
+    generate_queue: str,
+    batch_id: Optional[str] = None,
+    job_id: Optional[str] = None,
+) -> Tuple[Signature, str]:
+    """
+    Собрать цепочку стадий для одной генерации. Возвращает (signature, job_id).
+
+    Стадия generate идёт в очередь тарифа (generate_queue), остальные — в очереди
+    своей стадии того же тарифа (stage_queue). job_id передаётся, если он уже
+    выдан клиенту (outbox).
+    """
+    job_id = job_id or str(uuid.uuid4())
+    job = {
+        "job_id": job_id,
+        "image_url": image_url,
+        "style": style,
+        "upload_id": upload_id,
+        "user_id": user_id,
+        "is_hd": is_hd,
+        "new_variation": new_variation,
+        "batch_id": batch_id,
+        "created_at": datetime.utcnow().strftime("%Y%m%d_%H%M%S"),
+    }
+    stages = [
+        fetch_source_stage.s(job).set(queue=stage_queue(QUEUE_PIPELINE_FETCH, generate_queue)),
+        generate_stage.s().set(queue=generate_queue),
+    ]
+    if is_hd:
+        stages.append(upscale_stage.s().set(queue=stage_queue(QUEUE_PIPELINE_UPSCALE, generate_queue)))
+    stages += [
+        store_stage.s().set(queue=stage_queue(QUEUE_PIPELINE_STORE, generate_queue)),
+        finalize_stage.s().set(task_id=job_id, queue=stage_queue(QUEUE_PIPELINE_FINALIZE, generate_queue)),
+    ]
+    pipeline = chain(*stages).on_error(pipeline_failed.s(job_id=job_id, user_id=user_id, style=style))
+    return pipeline, job_id
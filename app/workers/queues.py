@@ -0,0 +1,94 @@
+"""
+Очереди генерации по тарифу и HD-флагу.
+
+Отдельные очереди позволяют держать свои пулы воркеров для платных и HD-задач,
+чтобы всплеск бесплатных генераций не задерживал оплаченные.
+"""
+import sys
+from typing import Dict, Optional, Tuple
+
+from app.core.config import get_settings
+from app.models.generation import GenerationBalance
+
+settings = get_settings()
+
+DEFAULT_QUEUE = "celery"
+QUEUE_PAID_HD = "generate.paid.hd"
+QUEUE_PAID = "generate.paid"
+QUEUE_FREE_HD = "generate.free.hd"
+QUEUE_FREE = "generate.free"
+
+# Порядок = приоритет: воркер, слушающий несколько очередей, сначала разбирает левые
+GENERATION_QUEUES = (QUEUE_PAID_HD, QUEUE_PAID, QUEUE_FREE_HD, QUEUE_FREE)
+PAID_GENERATION_QUEUES = (QUEUE_PAID_HD, QUEUE_PAID)
+
+# Остальные стадии конвейера генерации (стадия generate идёт в очередь тарифа).
+# У платных генераций у каждой стадии своя очередь <стадия>.paid (см. stage_queue)
+QUEUE_PIPELINE_FETCH = "pipeline.fetch"
+QUEUE_PIPELINE_UPSCALE = "pipeline.upscale"
+QUEUE_PIPELINE_STORE = "pipeline.store"
+QUEUE_PIPELINE_FINALIZE = "pipeline.finalize"
+PAID_STAGE_SUFFIX = ".paid"
+
+PIPELINE_QUEUES = (
+    QUEUE_PIPELINE_FINALIZE + PAID_STAGE_SUFFIX,
+    QUEUE_PIPELINE_STORE + PAID_STAGE_SUFFIX,
+    QUEUE_PIPELINE_UPSCALE + PAID_STAGE_SUFFIX,
+    QUEUE_PIPELINE_FETCH + PAID_STAGE_SUFFIX,
+    QUEUE_PIPELINE_FINALIZE,
+    QUEUE_PIPELINE_STORE,
+    QUEUE_PIPELINE_UPSCALE,
+    QUEUE_PIPELINE_FETCH,
+)
+
+# Уменьшенные копии для истории — фоновая работа с самым низким приоритетом
+QUEUE_RENDITIONS = "renditions"
+
+# Транзакционные письма: короткие задачи, отдельный пул, чтобы не ждать генерации
+QUEUE_EMAIL = "email"
+
+
+def is_paid_balance(balance: Optional[GenerationBalance]) -> bool:
+    """Платный тариф: активная подписка или купленный разовый пакет."""
+    if balance is None:
+        return False
+    return (balance.current_plan or "free") != "free" or bool(balance.package_plan_id)
+
+
+def generation_queue(balance: Optional[GenerationBalance], is_hd: bool) -> str:
+    if is_paid_balance(balance):
+        return QUEUE_PAID_HD if is_hd else QUEUE_PAID
+    return QUEUE_FREE_HD if is_hd else QUEUE_FREE
+
+
+def stage_queue(queue: str, generate_queue: str) -> str:
+    """Очередь стадии конвейера для тарифа генерации: платные идут в <queue>.paid."""
+    if generate_queue in PAID_GENERATION_QUEUES:
+        return queue + PAID_STAGE_SUFFIX
+    return queue
+
+
+def worker_options() -> Dict[str, Tuple[int, int]]:
+    """(concurrency, prefetch_multiplier) для воркера каждой очереди."""
+    options = {
+        QUEUE_PAID_HD: (settings.GENERATE_QUEUE_PAID_HD_CONCURRENCY, settings.GENERATE_QUEUE_PAID_HD_PREFETCH),
+        QUEUE_PAID: (settings.GENERATE_QUEUE_PAID_CONCURRENCY, settings.GENERATE_QUEUE_PAID_PREFETCH),
+        QUEUE_FREE_HD: (settings.GENERATE_QUEUE_FREE_HD_CONCURRENCY, settings.GENERATE_QUEUE_FREE_HD_PREFETCH),
+        QUEUE_FREE: (settings.GENERATE_QUEUE_FREE_CONCURRENCY, settings.GENERATE_QUEUE_FREE_PREFETCH),
+        QUEUE_PIPELINE_FETCH: (settings.PIPELINE_FETCH_CONCURRENCY, settings.PIPELINE_FETCH_PREFETCH),
+        QUEUE_PIPELINE_UPSCALE: (settings.PIPELINE_UPSCALE_CONCURRENCY, settings.PIPELINE_UPSCALE_PREFETCH),
+        QUEUE_PIPELINE_STORE: (settings.PIPELINE_STORE_CONCURRENCY, settings.PIPELINE_STORE_PREFETCH),
+        QUEUE_PIPELINE_FINALIZE: (settings.PIPELINE_FINALIZE_CONCURRENCY, settings.PIPELINE_FINALIZE_PREFETCH),
+        QUEUE_RENDITIONS: (settings.RENDITIONS_CONCURRENCY, settings.RENDITIONS_PREFETCH),
+        QUEUE_EMAIL: (settings.EMAIL_CONCURRENCY, settings.EMAIL_PREFETCH),
+    }
+    # Платные очереди стадий — с теми же лимитами, что и бесплатные
+    for queue in (QUEUE_PIPELINE_FETCH, QUEUE_PIPELINE_UPSCALE, QUEUE_PIPELINE_STORE, QUEUE_PIPELINE_FINALIZE):
+        options[queue + PAID_STAGE_SUFFIX] = options[queue]
+    return options
+
+
+if __name__ == "__main__":
+    # Используется start_celery.sh: печатает "<concurrency> <prefetch>" для очереди
+    concurrency, prefetch = worker_options()[sys.argv[1]]
+    print(concurrency, prefetch)
@@ -0,0 +1,208 @@
+"""
+Фоновое построение thumb/preview для аплоадов и результатов генерации.
+
+Задачи идут в отдельную очередь renditions со своим пулом воркеров,
+чтобы обработка изображений не занимала слоты генерации.
+"""
+import sys
+from typing import Optional, Tuple
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models.generation_result import GenerationResult
+from app.models.upload import Upload
+from app.services.renditions import RENDITION_NAMES, ensure_renditions
+from app.workers.celery_app import celery_app
+
+settings = get_settings()
+
+RENDITION_FIELDS = ("before", "after")
+
+
+def _missing_filter(field: str):
+    source = getattr(Upload, f"{field}_url")
+    thumb = getattr(Upload, f"{field}_thumb_url")
+    return (source != None) & (thumb == None)
+
+
+@celery_app.task(
+    name="renditions.build",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+    soft_time_limit=60,
+    time_limit=90,
+)
+def build_renditions(upload_id: int, field: str) -> Optional[dict]:
+    """Построить копии для before или after и записать их ссылки в Upload."""
+    db = SessionLocal()
+    try:
+        upload = db.query(Upload).filter(Upload.id == upload_id).first()
+        if not upload:
+            print(f"[renditions] upload {upload_id} not found")
+            return None
+        source_url = getattr(upload, f"{field}_url")
+        # Читаем оригинал без открытой транзакции: S3 и Pillow могут занять секунды
+        db.rollback()
+        urls = ensure_renditions(source_url)
+        if not urls:
+            return None
+
+        # Пока считали, after_url мог смениться новой генерацией — тогда не перетираем
+        updated = (
+            db.query(Upload)
+            .filter(Upload.id == upload_id, getattr(Upload, f"{field}_url") == source_url)
+            .update(
+                {f"{field}_{name}_url": urls[name] for name in RENDITION_NAMES},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if updated:
+            print(f"[renditions] upload {upload_id} {field} renditions ready")
+        return urls
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@celery_app.task(
+    name="renditions.build_result",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+    soft_time_limit=60,
+    time_limit=90,
+)
+def build_result_renditions(job_id: str) -> Optional[dict]:
+    """
+    Построить копии для результата генерации и записать их в generation_results.
+
+    Если этот результат сейчас after_url аплоада, те же ссылки пишутся и в
+    after_thumb_url/after_preview_url — копии у одного ключа S3 общие.
+    """
+    db = SessionLocal()
+    try:
+        result = db.query(GenerationResult).filter(GenerationResult.job_id == job_id).first()
+        if not result:
+            print(f"[renditions] result {job_id} not found")
+            return None
+        upload_id, source_url = result.upload_id, result.result_url
+        db.rollback()
+        urls = ensure_renditions(source_url)
+        if not urls:
+            return None
+
+        db.query(GenerationResult).filter(GenerationResult.job_id == job_id).update(
+            {f"{name}_url": urls[name] for name in RENDITION_NAMES},
+            synchronize_session=False,
+        )
+        db.query(Upload).filter(Upload.id == upload_id, Upload.after_url == source_url).update(
+            {f"after_{name}_url": urls[name] for name in RENDITION_NAMES},
+            synchronize_session=False,
+        )
+        db.commit()
+        print(f"[renditions] result {job_id} renditions ready")
+        return urls
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def enqueue_renditions(upload_id: Optional[int], field: str) -> None:
+    """Поставить построение копий в очередь; сбой брокера не должен ронять основной запрос."""
+    if not upload_id:
+        return
+    try:
+        build_renditions.delay(upload_id, field)
+    except Exception as exc:
+        print(f"[renditions] failed to enqueue upload {upload_id} {field}: {exc}")
+
+
+def enqueue_result_renditions(job_id: str) -> None:
+    """То же для строки generation_results: копии строятся для каждого результата пакета."""
+    try:
+        build_result_renditions.delay(job_id)
+    except Exception as exc:
+        print(f"[renditions] failed to enqueue result {job_id}: {exc}")
+
+
+def _backfill_uploads(batch_size: int, after_id: int) -> Tuple[int, int, bool]:
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Upload.id, Upload.before_url, Upload.before_thumb_url, Upload.after_url, Upload.after_thumb_url)
+            .filter(Upload.id > after_id, _missing_filter("before") | _missing_filter("after"))
+            .order_by(Upload.id)
+            .limit(batch_size)
+            .all()
+        )
+    finally:
+        db.close()
+
+    queued = 0
+    for row in rows:
+        for field in RENDITION_FIELDS:
+            if getattr(row, f"{field}_url") and not getattr(row, f"{field}_thumb_url"):
+                build_renditions.delay(row.id, field)
+                queued += 1
+    print(f"[renditions] backfill uploads after id {after_id}: {len(rows)} uploads, {queued} tasks")
+    return queued, rows[-1].id if rows else after_id, len(rows) == batch_size
+
+
+def _backfill_results(batch_size: int, after_id: int) -> Tuple[int, int, bool]:
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(GenerationResult.id, GenerationResult.job_id)
+            .filter(GenerationResult.id > after_id, GenerationResult.thumb_url == None)
+            .order_by(GenerationResult.id)
+            .limit(batch_size)
+            .all()
+        )
+    finally:
+        db.close()
+
+    for row in rows:
+        build_result_renditions.delay(row.job_id)
+    print(f"[renditions] backfill results after id {after_id}: {len(rows)} tasks")
+    return len(rows), rows[-1].id if rows else after_id, len(rows) == batch_size
+
+
+@celery_app.task(name="renditions.backfill", soft_time_limit=240, time_limit=300)
+def backfill_renditions(
+    batch_size: Optional[int] = None,
+    after_id: int = 0,
+    after_result_id: Optional[int] = None,
+) -> int:
+    """
+    Поставить в очередь копии для существующих записей без них.
+
+    Сначала идёт по uploads (before и after), затем по generation_results —
+    по id пачками, перезапуская себя со следующей пачкой, поэтому одна
+    задача не держит воркер на всей таблице.
+    """
+    batch_size = batch_size or settings.RENDITIONS_BACKFILL_BATCH_SIZE
+    if after_result_id is None:
+        queued, last_id, more = _backfill_uploads(batch_size, after_id)
+        if more:
+            backfill_renditions.delay(batch_size, last_id)
+        else:
+            backfill_renditions.delay(batch_size, last_id, 0)
+        return queued
+
+    queued, last_id, more = _backfill_results(batch_size, after_result_id)
+    if more:
+        backfill_renditions.delay(batch_size, after_id, last_id)
+    return queued
+
+
+if __name__ == "__main__":
+    # python -m app.workers.renditions [batch_size] — запустить backfill через очередь
+    batch = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    result = backfill_renditions.delay(batch)
+    print(f"backfill started: {result.id}")
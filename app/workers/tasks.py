@@ -1,19 +1,42 @@
 import uuid
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 import io
 
+from celery.exceptions import Retry
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import OperationalError
+
+from app.core.config import get_settings
 from app.core.database import SessionLocal
+from app.models.generation_result import GenerationResult
 from app.models.upload import Upload
 from app.workers.celery_app import celery_app
-from app.services.ai import generate_image
+from app.services.ai import build_generation_prompt, fetch_shared_source, fetch_source_image, generate_image
+from app.services import result_cache, style_stats
+from app.services.events import publish_task_event
+from app.services.rate_governor import GovernorBusy
 from app.services.s3 import upload_fileobj_to_s3, get_file_url
-from app.services.upscale import upscale_image_fast
-from app.models.style_stat import StyleStat
+from app.services.upscale import UpscaleTemporarilyUnavailable, upscale_image_fast
+from app.workers.renditions import enqueue_result_renditions
+
+settings = get_settings()
 
 
-def _update_upload_after(upload_id: int, user_id: Optional[int], result_url: str, style: Optional[str]) -> None:
-    """Записать ссылку на готовое изображение в Upload после генерации."""
+def _update_upload_after(
+    upload_id: int,
+    user_id: Optional[int],
+    result_url: str,
+    style: Optional[str],
+    job_id: str,
+    batch_id: Optional[str] = None,
+) -> None:
+    """
+    Записать результат генерации: строку generation_results и after_url в Upload.
+
+    after_url/style — последний готовый результат; у пакета стилей каждый
+    результат остаётся в generation_results отдельной строкой по job_id.
+    """
     db = SessionLocal()
     try:
         upload = db.query(Upload).filter(Upload.id == upload_id).first()
@@ -24,12 +47,25 @@ def _update_upload_after(upload_id: int, user_id: Optional[int], result_url: str
             print(f"[generate_image_task] Upload {upload_id} does not belong to user {user_id}")
             return
 
+        if upload.after_url != result_url:
+            # Копии прошлого результата больше не относятся к этой записи
+            upload.after_thumb_url = None
+            upload.after_preview_url = None
         upload.after_url = result_url
         if style:
             upload.style = style
         db.add(upload)
+        db.execute(
+            insert(GenerationResult)
+            .values(job_id=job_id, upload_id=upload_id, batch_id=batch_id, style=style, result_url=result_url)
+            .on_conflict_do_nothing(index_elements=[GenerationResult.job_id])
+        )
         db.commit()
         print(f"[generate_image_task] Updated upload {upload_id} with after_url")
+    except OperationalError:
+        # БД недоступна — пусть повторится finalize, а не потеряется результат
+        db.rollback()
+        raise
     except Exception as exc:
         db.rollback()
         print(f"[generate_image_task] Failed to update upload {upload_id}: {exc}")
@@ -38,23 +74,167 @@ def _update_upload_after(upload_id: int, user_id: Optional[int], result_url: str
 
 
 def _increment_style_stat(style: Optional[str]) -> None:
-    if not style:
+    if not style_stats.record_style_generation(style):
         return
-    db = SessionLocal()
     try:
-        stat = db.query(StyleStat).filter(StyleStat.style_id == style).first()
-        if not stat:
-            stat = StyleStat(style_id=style, count=1)
-            db.add(stat)
-        else:
-            stat.count = (stat.count or 0) + 1
-            db.add(stat)
-        db.commit()
+        flush_style_stats_task.apply_async(countdown=settings.STYLE_STATS_FLUSH_SECONDS)
     except Exception as exc:
-        db.rollback()
-        print(f"[style_stat] Failed to increment stat for {style}: {exc}")
-    finally:
-        db.close()
+        # Флаг снимаем, чтобы flush запланировала следующая генерация
+        print(f"[style_stat] Failed to schedule flush: {exc}")
+        style_stats.cancel_scheduled_flush()
+
+
+@celery_app.task(name="styles.flush_stats", soft_time_limit=60, time_limit=90)
+def flush_style_stats_task() -> int:
+    flushed = style_stats.flush_style_stats()
+    if flushed is None:
+        # Идёт другой flush: флаг не снят, поэтому перенос за нами — откладываем себя
+        try:
+            flush_style_stats_task.apply_async(countdown=settings.STYLE_STATS_FLUSH_SECONDS)
+        except Exception as exc:
+            print(f"[style_stat] Failed to reschedule flush: {exc}")
+            style_stats.cancel_scheduled_flush()
+        return 0
+    return flushed
+
+
+def _publish_success(user_id: Optional[int], task_id: str, result: dict) -> None:
+    publish_task_event(
+        user_id,
+        task_id,
+        "SUCCESS",
+        result_url=result["result_url"],
+        filename=result["filename"],
+        style_id=result["style_id"],
+        style_meta=result["style_meta"],
+        cached=result["cached"],
+    )
+
+
+EXT_MAP = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+}
+
+
+def _result_filename(style: str, mime_type: str, timestamp: str, unique_id: str) -> str:
+    ext = EXT_MAP.get(mime_type.lower(), "png")
+    return f"generated/{style}/{timestamp}_{unique_id}.{ext}"
+
+
+def _prepare_generation(
+    image_url: str,
+    style: str,
+    is_hd: bool,
+    new_variation: bool,
+    batch_id: Optional[str],
+) -> Tuple[Tuple[bytes, str], str, Optional[dict], str, Optional[dict]]:
+    """
+    Скачать исходник, выбрать вариации стиля и проверить кэш результатов.
+
+    Возвращает (source, prompt, style_meta, cache_key, cached_entry_or_None).
+    """
+    if batch_id:
+        source = fetch_shared_source(batch_id, image_url)
+    else:
+        source = fetch_source_image(image_url)
+    source_hash = result_cache.source_digest(source[0])
+
+    # Вариации стиля выбираются от хэша исходника, чтобы повторный запуск
+    # того же фото с тем же стилем попадал в кэш; new_variation — случайные
+    prompt, style_meta = build_generation_prompt(
+        style,
+        variant_seed=None if new_variation else source_hash,
+    )
+    cache_key = result_cache.build_cache_key(source_hash, style, style_meta, is_hd)
+
+    cached = None if new_variation else result_cache.get_cached_result(cache_key)
+    if cached:
+        print(f"Result cache hit: key={cached['filename']}")
+    return source, prompt, style_meta, cache_key, cached
+
+
+def _upscale_hd(image_bytes: bytes, raise_transient: bool = False) -> Tuple[bytes, str]:
+    try:
+        image_bytes, mime_type = upscale_image_fast(
+            image_bytes, output_format="webp", raise_transient=raise_transient
+        )
+        print(f"HD upscale done, size: {len(image_bytes)} bytes, mime: {mime_type}")
+        return image_bytes, mime_type
+    except UpscaleTemporarilyUnavailable:
+        raise
+    except Exception as exc:
+        raise Exception(f"Не удалось выполнить HD-генерацию: {exc}")
+
+
+def _store_generated(
+    image_bytes: bytes,
+    mime_type: str,
+    result_filename: str,
+    cache_key: str,
+    style_meta: Optional[dict],
+) -> str:
+    """Залить результат в S3, запомнить его в кэше и вернуть публичную ссылку."""
+    # Upload result to S3
+    image_file_obj = io.BytesIO(image_bytes)
+    print(f"Uploading to S3: key={result_filename}, mime={mime_type}, bytes={len(image_bytes)}")
+    upload_success = upload_fileobj_to_s3(
+        image_file_obj,
+        result_filename,
+        content_type=mime_type
+    )
+    
+    if not upload_success:
+        raise Exception("Failed to upload generated image to S3")
+    
+    print(f"Uploaded to S3 successfully: key={result_filename}")
+
+    # Get public URL for the result
+    result_url = get_file_url(result_filename)
+
+    result_cache.store_result(
+        cache_key,
+        {
+            "filename": result_filename,
+            "result_url": result_url,
+            "mime_type": mime_type,
+            "style_meta": style_meta,
+        },
+    )
+    return result_url
+
+
+def _finish_generation(
+    task_id: str,
+    upload_id: Optional[int],
+    user_id: Optional[int],
+    style: str,
+    is_hd: bool,
+    result_url: str,
+    filename: str,
+    style_meta: Optional[dict],
+    cached: bool,
+    batch_id: Optional[str] = None,
+) -> dict:
+    """Записать after-изображение, посчитать стиль и оповестить клиента."""
+    if upload_id:
+        _update_upload_after(upload_id, user_id, result_url, style, task_id, batch_id)
+        # Копии строятся по строке результата и попадают и в after_* аплоада
+        enqueue_result_renditions(task_id)
+    _increment_style_stat(style)
+
+    result = {
+        "status": "success",
+        "result_url": result_url,
+        "filename": filename,
+        "style_id": style,
+        "style_meta": style_meta,
+        "is_hd": is_hd,
+        "cached": cached,
+    }
+    _publish_success(user_id, task_id, result)
+    return result
 
 
 @celery_app.task(bind=True, name="generate_image_task")
@@ -65,22 +245,53 @@ def generate_image_task(
     upload_id: Optional[int] = None,
     user_id: Optional[int] = None,
     is_hd: bool = False,
+    new_variation: bool = False,
+    batch_id: Optional[str] = None,
 ) -> dict:
     """
     Celery task to generate an image using AI API.
+
+    All stages run in one task. The API enqueues the staged pipeline
+    (app.workers.pipeline) instead; this task stays for direct callers.
     
     Args:
         image_url: URL of the input image
         style: Style to apply
+        new_variation: Skip the result cache and pick fresh random style variants
+        batch_id: Batch this task belongs to; tasks of one batch share the fetched source
     
     Returns:
         Dictionary with result_url or error message
     """
     try:
         print(f"Starting image generation task: image_url={image_url}, style={style}, is_hd={is_hd}")
+        publish_task_event(user_id, self.request.id, "STARTED", style_id=style)
+
+        source, prompt, style_meta, cache_key, cached = _prepare_generation(
+            image_url, style, is_hd, new_variation, batch_id
+        )
+        if cached:
+            return _finish_generation(
+                self.request.id,
+                upload_id,
+                user_id,
+                style,
+                is_hd,
+                cached["result_url"],
+                cached["filename"],
+                cached.get("style_meta"),
+                cached=True,
+                batch_id=batch_id,
+            )
         
         # Generate image (synchronous call)
-        image_bytes, mime_type, style_meta = generate_image(image_url, style)
+        image_bytes, mime_type, style_meta = generate_image(
+            image_url,
+            style,
+            prompt=prompt,
+            style_meta=style_meta,
+            source=source,
+        )
         
         if image_bytes is None:
             raise Exception("Failed to generate image: generate_image returned None")
@@ -89,55 +300,40 @@ def generate_image_task(
 
         # HD upscale if requested
         if is_hd:
-            try:
-                image_bytes, mime_type = upscale_image_fast(image_bytes, output_format="webp")
-                print(f"HD upscale done, size: {len(image_bytes)} bytes, mime: {mime_type}")
-            except Exception as exc:
-                raise Exception(f"Не удалось выполнить HD-генерацию: {exc}")
+            image_bytes, mime_type = _upscale_hd(image_bytes)
         
         # Generate unique filename for result
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         unique_id = str(uuid.uuid4())[:8]
-        ext_map = {
-            "image/png": "png",
-            "image/jpeg": "jpg",
-            "image/webp": "webp",
-        }
-        ext = ext_map.get(mime_type.lower(), "png")
-        result_filename = f"generated/{style}/{timestamp}_{unique_id}.{ext}"
-        
-        # Upload result to S3
-        image_file_obj = io.BytesIO(image_bytes)
-        print(f"Uploading to S3: key={result_filename}, mime={mime_type}, bytes={len(image_bytes)}")
-        upload_success = upload_fileobj_to_s3(
-            image_file_obj,
+        result_filename = _result_filename(style, mime_type, timestamp, unique_id)
+        result_url = _store_generated(image_bytes, mime_type, result_filename, cache_key, style_meta)
+
+        return _finish_generation(
+            self.request.id,
+            upload_id,
+            user_id,
+            style,
+            is_hd,
+            result_url,
             result_filename,
-            content_type=mime_type
+            style_meta,
+            cached=False,
+            batch_id=batch_id,
         )
         
-        if not upload_success:
-            raise Exception("Failed to upload generated image to S3")
-        
-        print(f"Uploaded to S3 successfully: key={result_filename}")
-
-        # Get public URL for the result
-        result_url = get_file_url(result_filename)
-
-        if upload_id:
-            _update_upload_after(upload_id, user_id, result_url, style)
-        _increment_style_stat(style)
-        
-        return {
-            "status": "success",
-            "result_url": result_url,
-            "filename": result_filename,
-            "style_id": style,
-            "style_meta": style_meta,
-            "is_hd": is_hd,
-        }
-        
+    except Retry:
+        raise
+    except GovernorBusy as e:
+        # Провайдер перегружен: не роняем задачу, а возвращаем её в очередь
+        if self.request.retries < settings.GEMINI_TASK_MAX_RETRIES:
+            print(f"generate_image_task deferred: {e}")
+            raise self.retry(countdown=e.retry_after, max_retries=settings.GEMINI_TASK_MAX_RETRIES)
+        error_msg = str(e)
+        print(f"Error in generate_image_task: {error_msg}")
+        publish_task_event(user_id, self.request.id, "FAILURE", style_id=style, error=error_msg)
+        raise Exception(error_msg) from e
     except Exception as e:
         error_msg = str(e)
         print(f"Error in generate_image_task: {error_msg}")
+        publish_task_event(user_id, self.request.id, "FAILURE", style_id=style, error=error_msg)
         raise Exception(error_msg) from e
-
@@ -0,0 +1,178 @@
+"""
+Удаление просроченных аплоадов по расписанию (Celery beat, uploads.reap_expired).
+
+Раньше просроченные записи чистил GET /upload на каждом запросе: по одному
+DELETE в S3 на файл и commit до ответа пользователю. Теперь это делает одна
+задача под lock в Redis (на все ноды один исполнитель): выбирает пачку по
+частичному индексу ix_uploads_expires_at, удаляет файлы и их копии через
+DeleteObjects по 1000 ключей и записи одним DELETE ... WHERE id IN.
+
+Ключи, которые S3 не удалил, попадают в множество uploads:reaper:retry_keys и
+повторяются в начале следующего запуска, поэтому файлы не остаются без записи
+навсегда. Если и Redis недоступен, аплоады с такими ключами не удаляются из БД.
+"""
+import uuid
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+
+from redis.exceptions import RedisError
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models.generation_result import GenerationResult
+from app.models.upload import Upload
+from app.services import metrics
+from app.services.redis_client import get_redis
+from app.services.renditions import rendition_keys_for
+from app.services.s3 import delete_files_from_s3, get_own_bucket_key
+from app.workers.celery_app import celery_app
+
+settings = get_settings()
+
+REAPER_LOCK_KEY = "uploads:reaper:lock"
+REAPER_RETRY_KEYS_KEY = "uploads:reaper:retry_keys"
+# Сколько ключей из retry_keys повторять за запуск (один запрос DeleteObjects)
+REAPER_RETRY_BATCH = 1000
+
+# Снимаем lock, только если он ещё наш (мог истечь и достаться другой ноде)
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _keys_for(url: Optional[str]) -> List[str]:
+    s3_key = get_own_bucket_key(url)
+    if not s3_key:
+        return []
+    return [s3_key, *rendition_keys_for(url)]
+
+
+def shared_result_urls(db, urls: Iterable[str], upload_ids: List[int]) -> Set[str]:
+    """
+    Результаты из urls, на которые ссылаются другие аплоады: файл мог быть
+    выдан им из кэша генераций, такой не удаляем.
+    """
+    urls = {url for url in urls if url}
+    if not urls:
+        return set()
+    shared = {
+        url
+        for (url,) in db.query(Upload.after_url)
+        .filter(Upload.after_url.in_(urls), Upload.id.not_in(upload_ids))
+        .distinct()
+    }
+    shared.update(
+        url
+        for (url,) in db.query(GenerationResult.result_url)
+        .filter(GenerationResult.result_url.in_(urls), GenerationResult.upload_id.not_in(upload_ids))
+        .distinct()
+    )
+    return shared
+
+
+def _retry_failed_keys(redis_client) -> None:
+    """Повторить удаление ключей, которые не удались в прошлых запусках."""
+    try:
+        keys = redis_client.spop(REAPER_RETRY_KEYS_KEY, REAPER_RETRY_BATCH)
+        if not keys:
+            return
+        failed = delete_files_from_s3(keys)
+        if failed:
+            redis_client.sadd(REAPER_RETRY_KEYS_KEY, *failed)
+            metrics.incr("uploads:reaper_s3_failed", len(failed))
+    except RedisError as exc:
+        print(f"[uploads] failed to retry S3 keys: {exc}")
+        return
+    metrics.incr("uploads:reaper_s3_retried", len(keys) - len(failed))
+
+
+def _reap_batch(db, redis_client, now) -> int:
+    rows = (
+        db.query(Upload.id, Upload.before_url, Upload.after_url)
+        .filter(Upload.expires_at.is_not(None), Upload.expires_at < now)
+        .order_by(Upload.expires_at)
+        .limit(settings.UPLOAD_REAPER_BATCH_SIZE)
+        .all()
+    )
+    if not rows:
+        return 0
+    ids = [row.id for row in rows]
+
+    # Все результаты аплоада: after_url и строки generation_results (по стилю пакета)
+    result_urls = {row.id: {row.after_url} - {None} for row in rows}
+    for upload_id, url in db.query(GenerationResult.upload_id, GenerationResult.result_url).filter(
+        GenerationResult.upload_id.in_(ids)
+    ):
+        result_urls[upload_id].add(url)
+    shared = shared_result_urls(db, set().union(*result_urls.values()), ids)
+
+    keys_by_row = {}
+    for row in rows:
+        keys = _keys_for(row.before_url)
+        for url in result_urls[row.id] - shared:
+            keys += _keys_for(url)
+        keys_by_row[row.id] = keys
+    failed = set(delete_files_from_s3(key for keys in keys_by_row.values() for key in keys))
+    if failed:
+        metrics.incr("uploads:reaper_s3_failed", len(failed))
+        try:
+            redis_client.sadd(REAPER_RETRY_KEYS_KEY, *failed)
+        except RedisError as exc:
+            # Ключи некуда отложить — оставляем записи, их файлы удалит следующий запуск
+            print(f"[uploads] failed to queue {len(failed)} keys for retry: {exc}")
+            ids = [upload_id for upload_id in ids if not failed.intersection(keys_by_row[upload_id])]
+            if not ids:
+                return 0
+
+    db.query(GenerationResult).filter(GenerationResult.upload_id.in_(ids)).delete(synchronize_session=False)
+    db.query(Upload).filter(Upload.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    metrics.incr("uploads:reaped", len(ids))
+    return len(ids)
+
+
+@celery_app.task(name="uploads.reap_expired", soft_time_limit=600, time_limit=660)
+def reap_expired_uploads() -> int:
+    """Удалить все просроченные аплоады. Если lock занят другой нодой — ничего не делает."""
+    redis_client = get_redis()
+    token = uuid.uuid4().hex
+    lock_seconds = settings.UPLOAD_REAPER_LOCK_SECONDS
+    try:
+        if not redis_client.set(REAPER_LOCK_KEY, token, nx=True, ex=lock_seconds):
+            return 0
+    except RedisError as exc:
+        # Без lock не запускаемся: две ноды удаляли бы одни и те же файлы
+        print(f"[uploads] reaper lock unavailable: {exc}")
+        return 0
+
+    reaped = 0
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        _retry_failed_keys(redis_client)
+        while True:
+            batch = _reap_batch(db, redis_client, now)
+            reaped += batch
+            if batch < settings.UPLOAD_REAPER_BATCH_SIZE:
+                break
+            if not redis_client.eval(_EXTEND_SCRIPT, 1, REAPER_LOCK_KEY, token, lock_seconds):
+                print("[uploads] reaper lock lost, stopping")
+                break
+    finally:
+        db.close()
+        try:
+            redis_client.eval(_RELEASE_SCRIPT, 1, REAPER_LOCK_KEY, token)
+        except RedisError as exc:
+            print(f"[uploads] failed to release reaper lock: {exc}")
+    if reaped:
+        print(f"[uploads] reaped {reaped} expired uploads")
+    return reaped
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк проверки access-токена на запрос.
+
+Сравнивает:
+- jose            — прежний путь: jwt.decode с проверкой подписи на каждый запрос;
+- hmac            — бэкенд "hmac" без кэша;
+- cached (jose)   — decode_token с кэшем claims: первый запрос проверяет подпись,
+                    остальные берут claims из кэша;
+- cached (hmac)   — то же с бэкендом "hmac".
+
+Токены подписываются JWT_SECRET_KEY из .env. Redis не нужен: метрики
+копятся в процессе.
+
+Использование:
+    python bench_auth.py              # 20000 запросов на 50 разных токенах
+    python bench_auth.py 100000 500   # свои число запросов и токенов
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+DEFAULT_REQUESTS = 20000
+DEFAULT_TOKENS = 50
+
+
+def _make_tokens(count: int, secret_key: str, algorithm: str) -> list:
+    from jose import jwt
+
+    expire = datetime.now(timezone.utc) + timedelta(minutes=15)
+    return [jwt.encode({"sub": str(i), "exp": expire}, secret_key, algorithm=algorithm) for i in range(count)]
+
+
+def _run(label: str, decode, tokens: list, requests: int) -> None:
+    started = time.perf_counter()
+    for i in range(requests):
+        claims = decode(tokens[i % len(tokens)])
+        assert claims["sub"] == str(i % len(tokens))
+    elapsed = time.perf_counter() - started
+    print(f"{label:>14} | {elapsed:>8.3f} | {elapsed / requests * 1e6:>10.1f} | {requests / elapsed:>10.0f}")
+
+
+def main() -> None:
+    from app.core.config import get_settings
+    from app.services import jwt_verify
+
+    settings = get_settings()
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUESTS
+    token_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_TOKENS
+    secret_key, algorithm = settings.JWT_SECRET_KEY, settings.JWT_ALGORITHM
+    tokens = _make_tokens(token_count, secret_key, algorithm)
+
+    print(f"{requests} requests, {token_count} tokens, {algorithm}")
+    print(f"{'path':>14} | {'total, s':>8} | {'us/request':>10} | {'req/s':>10}")
+    print("-" * 52)
+    _run("jose", lambda token: jwt_verify._jose_decode(token, secret_key, algorithm), tokens, requests)
+    _run("hmac", lambda token: jwt_verify._hmac_decode(token, secret_key, algorithm), tokens, requests)
+    for backend in ("jose", "hmac"):
+        settings.JWT_VERIFY_BACKEND = backend
+        jwt_verify._claims_cache.clear()
+        _run(f"cached ({backend})", lambda token: jwt_verify.decode_token(token, secret_key), tokens, requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Проверка списания генераций под конкурентной нагрузкой против БД из .env (DATABASE_URL).
+
+Создаёт временного пользователя с балансом CREDITS генераций и запускает
+THREADS параллельных списаний, каждое в своей сессии. Для каждого режима
+печатает число успешных списаний, итоговый остаток и время:
+- legacy — прежняя схема: прочитать баланс, проверить, записать;
+- atomic — consume_generation: один UPDATE ... RETURNING.
+
+Ожидается, что atomic списывает ровно CREDITS раз и остаток равен 0;
+у legacy успешных списаний может быть больше, чем генераций (двойное списание).
+Пользователь и баланс удаляются после замера.
+
+Использование:
+    python bench_credits.py            # 50 генераций, 200 потоков
+    python bench_credits.py 100 500
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+DEFAULT_CREDITS = 50
+DEFAULT_THREADS = 200
+
+
+def _legacy_consume(db, user) -> None:
+    from app.models.generation import GenerationBalance
+
+    balance = db.query(GenerationBalance).filter(GenerationBalance.user_id == user.id).first()
+    if balance.remaining_std < 1:
+        raise ValueError("Лимит генераций исчерпан")
+    balance.remaining_std -= 1
+    balance.used_std += 1
+    db.commit()
+
+
+def _run(label: str, consume, user_id: int, credits: int, threads: int) -> bool:
+    from app.core.database import SessionLocal
+    from app.models.generation import GenerationBalance
+    from app.models.user import User
+
+    with SessionLocal() as db:
+        balance = db.query(GenerationBalance).filter(GenerationBalance.user_id == user_id).one()
+        balance.remaining_std = credits
+        balance.used_std = 0
+        db.commit()
+
+    succeeded = 0
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def _worker() -> None:
+        nonlocal succeeded
+        with SessionLocal() as db:
+            user = db.get(User, user_id)
+            start.wait()
+            try:
+                consume(db, user)
+            except ValueError:
+                return
+            with lock:
+                succeeded += 1
+
+    workers = [threading.Thread(target=_worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    with SessionLocal() as db:
+        balance = db.query(GenerationBalance).filter(GenerationBalance.user_id == user_id).one()
+        remaining, used = balance.remaining_std, balance.used_std
+    correct = succeeded == credits and remaining == 0 and used == credits
+    print(
+        f"{label:>7} | {succeeded:>9} | {remaining:>9} | {used:>6} | {elapsed * 1000:>8.0f} | "
+        f"{'ok' if correct else 'DOUBLE SPEND'}"
+    )
+    return correct
+
+
+def main() -> None:
+    from sqlalchemy import create_engine
+
+    from app.core.database import SessionLocal, engine
+    from app.models.generation import GenerationBalance
+    from app.models.user import User
+    from app.services.generations import consume_generation, get_or_create_balance
+
+    credits = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CREDITS
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THREADS
+    # Каждому потоку нужно своё соединение, иначе меряется ожидание пула
+    SessionLocal.configure(bind=create_engine(engine.url, pool_size=threads, max_overflow=0))
+
+    with SessionLocal() as db:
+        user = User(email=f"bench-credits-{uuid.uuid4().hex[:8]}@example.com", hashed_password="-")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+    atomic_ok = False
+    try:
+        with SessionLocal() as db:
+            get_or_create_balance(db, db.get(User, user_id))
+
+        print(f"{credits} credits, {threads} concurrent requests")
+        print(f"{'mode':>7} | {'succeeded':>9} | {'remaining':>9} | {'used':>6} | {'time, ms':>8} | result")
+        print("-" * 62)
+        _run("legacy", _legacy_consume, user_id, credits, threads)
+        atomic_ok = _run("atomic", consume_generation, user_id, credits, threads)
+    finally:
+        # Удаляем по id запросами, без загрузки объектов: сессия замера могла остаться в ошибке
+        with SessionLocal() as db:
+            db.query(GenerationBalance).filter(GenerationBalance.user_id == user_id).delete(synchronize_session=False)
+            db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+            db.commit()
+    if not atomic_ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности логина: bcrypt в потоке запроса против пула процессов.
+
+Имитирует всплеск логинов в общем threadpool Starlette (40 потоков) и
+параллельно «лёгкую» ручку, которой тоже нужен поток из этого пула. Для каждого
+режима печатает логины/с, число отклонённых (503) и задержку лёгкой ручки.
+
+БД не нужна: меряется только проверка пароля.
+
+Использование:
+    python bench_login.py              # 200 логинов, cost 12
+    python bench_login.py 500 10       # свои число логинов и cost
+"""
+
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+STARLETTE_THREADS = 40
+DEFAULT_LOGINS = 200
+DEFAULT_ROUNDS = 12
+PASSWORD = "correct horse battery staple"
+
+
+def _light_endpoint_latencies(pool: ThreadPoolExecutor, stop: threading.Event) -> list:
+    """Задержка «лёгкой» ручки: ждёт свободный поток и сразу возвращается."""
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        pool.submit(lambda: None).result()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+    return latencies
+
+
+def _run(label: str, verify, hashed: str, logins: int) -> None:
+    from app.services.passwords import PasswordPoolBusy
+
+    rejected = 0
+    lock = threading.Lock()
+
+    def _login() -> None:
+        nonlocal rejected
+        try:
+            assert verify(PASSWORD, hashed)
+        except PasswordPoolBusy:
+            with lock:
+                rejected += 1
+
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=STARLETTE_THREADS) as pool:
+        latencies = []
+        probe = threading.Thread(target=lambda: latencies.extend(_light_endpoint_latencies(pool, stop)))
+        probe.start()
+        started = time.perf_counter()
+        futures = [pool.submit(_login) for _ in range(logins)]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        probe.join()
+
+    done = logins - rejected
+    p50 = statistics.median(latencies) * 1000 if latencies else 0.0
+    p99 = sorted(latencies)[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    print(f"{label:>8} | {done / elapsed:>8.1f} | {rejected:>8} | {p50:>8.1f} | {p99:>8.1f}")
+
+
+def main() -> None:
+    import bcrypt
+
+    from app.core.config import get_settings
+    from app.services import passwords
+
+    settings = get_settings()
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_LOGINS
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ROUNDS
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=rounds)).decode()
+
+    def _inline(plain: str, hashed_password: str) -> bool:
+        return bcrypt.checkpw(plain.encode("utf-8")[:72], hashed_password.encode("utf-8"))
+
+    print(
+        f"{logins} logins, cost {rounds}, {STARLETTE_THREADS} request threads, "
+        f"pool {settings.PASSWORD_HASH_WORKERS} workers + {settings.PASSWORD_HASH_QUEUE_LIMIT} queued"
+    )
+    print(f"{'mode':>8} | {'logins/s':>8} | {'rejected':>8} | {'light p50':>8} | {'light p99':>8} (ms)")
+    print("-" * 60)
+    _run("inline", _inline, hashed, logins)
+    _run("pool", passwords.verify_password, hashed, logins)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк проверки лимитов регистрации (4 ключа) против Redis из .env (REDIS_URL).
+
+Сравнивает:
+- legacy — прежний _rate_limit: INCR + EXPIRE на каждый ключ (8 round trip);
+- fixed  — rate_limiter.check с фиксированным окном, один вызов Lua на все ключи;
+- gcra   — то же со скользящим окном (GCRA).
+
+Ключи создаются с префиксом bench:ratelimit: и удаляются после замера.
+
+Использование:
+    python bench_ratelimit.py          # 2000 проверок
+    python bench_ratelimit.py 10000
+"""
+
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+DEFAULT_CHECKS = 2000
+# Лимиты заведомо не исчерпываются: меряем стоимость самой проверки
+LIMITS = [("ip:day", 24 * 3600), ("ip:10m", 600), ("domain:day", 24 * 3600), ("domain:hour", 3600)]
+BIG_LIMIT = 10 ** 9
+
+
+def _legacy(redis_client, keys: list) -> None:
+    for key, window in keys:
+        current = redis_client.incr(key)
+        if current == 1:
+            redis_client.expire(key, window)
+
+
+def _run(label: str, check, checks: int) -> None:
+    latencies = []
+    for _ in range(checks):
+        started = time.perf_counter()
+        check()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    print(f"{label:>7} | {p50:>9.0f} | {p99:>9.0f} | {checks / sum(latencies):>9.0f}")
+
+
+def main() -> None:
+    from app.services import rate_limiter
+    from app.services.redis_client import get_redis
+
+    checks = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CHECKS
+    redis_client = get_redis()
+    prefix = f"bench:ratelimit:{uuid.uuid4().hex[:8]}"
+    keys = [(f"{prefix}:{name}", window) for name, window in LIMITS]
+
+    def _limits(algorithm: str) -> list:
+        return [
+            rate_limiter.Limit(f"{key}:{algorithm}", BIG_LIMIT, window, algorithm)
+            for key, window in keys
+        ]
+
+    fixed_limits = _limits(rate_limiter.FIXED_WINDOW)
+    gcra_limits = _limits(rate_limiter.GCRA)
+
+    print(f"{checks} checks x {len(keys)} keys")
+    print(f"{'mode':>7} | {'p50, us':>9} | {'p99, us':>9} | {'checks/s':>9}")
+    print("-" * 44)
+    try:
+        _run("legacy", lambda: _legacy(redis_client, keys), checks)
+        _run("fixed", lambda: rate_limiter.check(fixed_limits), checks)
+        _run("gcra", lambda: rate_limiter.check(gcra_limits), checks)
+    finally:
+        redis_client.delete(*[key for key, _ in keys], *[limit.key for limit in fixed_limits + gcra_limits])
+
+
+if __name__ == "__main__":
+    main()
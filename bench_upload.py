@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк загрузки файлов в S3: старый путь (read() целиком + put_object)
+против потоковой загрузки upload_fileobj_to_s3.
+
+Каждый замер идёт в отдельном процессе, чтобы пиковый RSS не смешивался.
+Работает с бакетом из .env (можно указать локальный MinIO через AWS_S3_ENDPOINT_URL).
+
+Использование:
+    python bench_upload.py                 # размеры по умолчанию: 1 5 10 25 50 MB
+    python bench_upload.py 1 50            # свои размеры в MB
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+DEFAULT_SIZES_MB = [1, 5, 10, 25, 50]
+SPOOL_MAX_SIZE = 1024 * 1024  # как у Starlette UploadFile
+
+
+def _make_spooled_body(size_mb: int):
+    """Имитация тела multipart-запроса: SpooledTemporaryFile, как его отдаёт Starlette."""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    block = os.urandom(1024 * 1024)
+    for _ in range(size_mb):
+        body.write(block)
+    body.seek(0)
+    return body
+
+
+def _rss_mb() -> float:
+    # ru_maxrss на Linux в KB, на macOS в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def run_child(mode: str, size_mb: int) -> None:
+    import io
+
+    from app.core.config import get_settings
+    from app.services.s3 import delete_file_from_s3, s3_client_upload, upload_fileobj_to_s3
+
+    settings = get_settings()
+    body = _make_spooled_body(size_mb)
+    key = f"bench/{mode}_{size_mb}mb_{os.getpid()}.bin"
+    baseline_rss = _rss_mb()
+
+    started = time.perf_counter()
+    if mode == "legacy":
+        content = body.read()
+        file_obj = io.BytesIO(content)
+        file_obj.seek(0)
+        s3_client_upload.put_object(
+            Bucket=settings.AWS_S3_BUCKET_NAME,
+            Key=key,
+            Body=file_obj.read(),
+            ContentType="application/octet-stream",
+        )
+    else:
+        upload_fileobj_to_s3(body, key, content_type="application/octet-stream")
+    elapsed = time.perf_counter() - started
+
+    delete_file_from_s3(key)
+    print(f"{elapsed:.6f} {_rss_mb() - baseline_rss:.1f}")
+
+
+def main() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES_MB
+    print(f"{'size':>6} | {'mode':>9} | {'time, s':>8} | {'MB/s':>7} | {'peak RSS +MB':>12}")
+    print("-" * 56)
+    for size_mb in sizes:
+        for mode in ("legacy", "streaming"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", mode, str(size_mb)],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip().splitlines()[-1]
+            elapsed, rss_delta = (float(value) for value in output.split())
+            print(
+                f"{size_mb:>4}MB | {mode:>9} | {elapsed:>8.2f} | "
+                f"{size_mb / elapsed:>7.1f} | {rss_delta:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк истории аплоадов GET /upload против БД из .env (DATABASE_URL).
+
+Создаёт временного пользователя с ROWS аплоадами (по умолчанию 10 000) и сравнивает:
+- legacy  — прежний список: все записи ORM-объектами и UploadRecord;
+- first   — первая страница keyset-пагинации (limit 50);
+- deep    — страница из середины истории (по cursor);
+- style   — первая страница с фильтром по стилю;
+- result  — первая страница только с результатом (has_result=true).
+
+Перед замером выполняет run_simple_migrations (индекс ix_uploads_created_by_created_at_id)
+и ANALYZE uploads. Пользователь и его аплоады удаляются после замера.
+
+Использование:
+    python bench_upload_list.py            # 10 000 аплоадов, 50 повторов
+    python bench_upload_list.py 50000 20
+"""
+
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+DEFAULT_ROWS = 10_000
+DEFAULT_REPEATS = 50
+PAGE_SIZE = 50
+STYLES = ("loft", "scandi", "minimal", "classic")
+
+
+def _seed(db, user_id: int, rows: int) -> None:
+    from app.models.upload import Upload
+
+    now = datetime.utcnow()
+    values = [
+        {
+            "before_url": f"https://bench.example.com/uploads/{user_id}/{i}.jpg",
+            "after_url": f"https://bench.example.com/generated/{user_id}/{i}.png" if i % 3 else None,
+            "style": STYLES[i % len(STYLES)],
+            "created_by": user_id,
+            "created_at": now - timedelta(minutes=i),
+            "expires_at": now + timedelta(days=30),
+        }
+        for i in range(rows)
+    ]
+    db.bulk_insert_mappings(Upload, values)
+    db.commit()
+
+
+def _legacy(db, user) -> int:
+    from app.api.upload import UploadRecord
+    from app.models.upload import Upload
+
+    uploads = (
+        db.query(Upload)
+        .filter(Upload.created_by == user.id)
+        .order_by(Upload.created_at.desc())
+        .all()
+    )
+    return len([UploadRecord.model_validate(upload) for upload in uploads])
+
+
+def _page(db, user, cursor=None, style=None, has_result=None) -> int:
+    from fastapi import Response
+
+    from app.api.upload import list_uploads
+
+    return len(list_uploads(Response(), PAGE_SIZE, cursor, style, has_result, current_user=user, db=db))
+
+
+def _run(label: str, fn, repeats: int) -> None:
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        count = fn()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{label:>7} | {count:>6} | {p50:>8.2f} | {p99:>8.2f}")
+
+
+def main() -> None:
+    from sqlalchemy import text
+
+    from app.api.upload import _encode_cursor
+    from app.core.database import SessionLocal, engine, run_simple_migrations
+    from app.models.upload import Upload
+    from app.models.user import User
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REPEATS
+    run_simple_migrations()
+
+    db = SessionLocal()
+    user = User(email=f"bench-uploads-{uuid.uuid4().hex[:8]}@example.com", hashed_password="-")
+    db.add(user)
+    db.commit()
+    try:
+        _seed(db, user.id, rows)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE uploads"))
+        middle = (
+            db.query(Upload.created_at, Upload.id)
+            .filter(Upload.created_by == user.id)
+            .order_by(Upload.created_at.desc(), Upload.id)
+            .offset(rows // 2)
+            .first()
+        )
+        deep_cursor = _encode_cursor(middle.created_at, middle.id)
+
+        print(f"{rows} uploads per user, page {PAGE_SIZE}, {repeats} repeats")
+        print(f"{'mode':>7} | {'rows':>6} | {'p50, ms':>8} | {'p99, ms':>8}")
+        print("-" * 40)
+        _run("legacy", lambda: _legacy(db, user), max(1, repeats // 10))
+        _run("first", lambda: _page(db, user), repeats)
+        _run("deep", lambda: _page(db, user, cursor=deep_cursor), repeats)
+        _run("style", lambda: _page(db, user, style=STYLES[1]), repeats)
+        _run("result", lambda: _page(db, user, has_result=True), repeats)
+    finally:
+        db.rollback()
+        db.query(Upload).filter(Upload.created_by == user.id).delete(synchronize_session=False)
+        db.query(User).filter(User.id == user.id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,37 @@
 #!/bin/bash
 # Скрипт для запуска Celery worker
+#
+# Без аргументов — один воркер на все очереди (платные/HD разбираются первыми).
+# С именем очереди — отдельный пул с её concurrency/prefetch из настроек:
+#   ./start_celery.sh generate.paid.hd
+#   ./start_celery.sh generate.free
+#   ./start_celery.sh pipeline.fetch
+#   ./start_celery.sh pipeline.store.paid
+#   ./start_celery.sh renditions
+#   ./start_celery.sh email
+#
+# ./start_celery.sh outbox — relay, публикующий задачи генерации из outbox в брокер.
+# ./start_celery.sh beat — планировщик периодических задач (удаление просроченных аплоадов).
 
 cd "$(dirname "$0")"
 source .venv/bin/activate
 
-echo "🚀 Запуск Celery worker..."
-celery -A app.workers.celery_app worker --loglevel=info
-
+QUEUE="$1"
 
+if [ "$QUEUE" = "outbox" ]; then
+    echo "🚀 Запуск relay outbox..."
+    python -m app.workers.outbox
+elif [ "$QUEUE" = "beat" ]; then
+    echo "🚀 Запуск Celery beat..."
+    celery -A app.workers.celery_app beat --loglevel=info
+elif [ -z "$QUEUE" ]; then
+    echo "🚀 Запуск Celery worker (все очереди)..."
+    celery -A app.workers.celery_app worker --loglevel=info \
+        -Q email,pipeline.finalize.paid,pipeline.store.paid,pipeline.finalize,pipeline.store,generate.paid.hd,generate.paid,pipeline.upscale.paid,pipeline.fetch.paid,generate.free.hd,generate.free,pipeline.upscale,pipeline.fetch,celery,renditions
+else
+    read -r CONCURRENCY PREFETCH < <(python -m app.workers.queues "$QUEUE" | tail -n 1)
+    echo "🚀 Запуск Celery worker: queue=$QUEUE concurrency=$CONCURRENCY prefetch=$PREFETCH"
+    celery -A app.workers.celery_app worker --loglevel=info \
+        -Q "$QUEUE" -n "$QUEUE@%h" \
+        --concurrency="$CONCURRENCY" --prefetch-multiplier="$PREFETCH"
+fi
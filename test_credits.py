@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Тест атомарного списания генераций (consume_generation) под конкурентной нагрузкой.
+
+Нужен PostgreSQL из .env (DATABASE_URL): на другой БД тест пропускается.
+Создаёт временного пользователя, запускает THREADS параллельных списаний,
+каждое в своей сессии и своём соединении, и проверяет, что успешных списаний
+ровно столько, сколько было генераций, а остаток равен 0. Пользователь и
+баланс удаляются после теста.
+
+Использование:
+    python -m pytest -q test_credits.py
+"""
+
+import os
+import sys
+import threading
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+CREDITS = 20
+THREADS = 60
+
+
+@pytest.fixture
+def session_factory():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import sessionmaker
+
+    try:
+        # Импорт app поднимает приложение и выполняет миграции — уже здесь нужна БД
+        from app.core.database import engine
+    except OperationalError as exc:
+        pytest.skip(f"БД недоступна: {exc}")
+
+    if engine.dialect.name != "postgresql":
+        pytest.skip("нужен PostgreSQL в DATABASE_URL")
+    # Каждому потоку своё соединение, иначе потоки ждут пул, а не друг друга
+    test_engine = create_engine(engine.url, pool_size=THREADS, max_overflow=0)
+    try:
+        with test_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError as exc:
+        test_engine.dispose()
+        pytest.skip(f"PostgreSQL недоступен: {exc}")
+    yield sessionmaker(bind=test_engine, autocommit=False, autoflush=False)
+    test_engine.dispose()
+
+
+@pytest.fixture
+def user_id(session_factory):
+    from app.models.generation import GenerationBalance
+    from app.models.user import User
+
+    with session_factory() as db:
+        user = User(email=f"test-credits-{uuid.uuid4().hex[:8]}@example.com", hashed_password="-")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+    try:
+        yield user_id
+    finally:
+        with session_factory() as db:
+            db.query(GenerationBalance).filter(GenerationBalance.user_id == user_id).delete(synchronize_session=False)
+            db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+            db.commit()
+
+
+def _consume_concurrently(session_factory, user_id: int) -> int:
+    from app.models.user import User
+    from app.services.generations import consume_generation
+
+    succeeded = 0
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(THREADS)
+
+    def _worker() -> None:
+        nonlocal succeeded
+        with session_factory() as db:
+            user = db.get(User, user_id)
+            start.wait()
+            try:
+                consume_generation(db, user)
+            except ValueError:
+                return
+            except Exception as exc:
+                errors.append(exc)
+                return
+            with lock:
+                succeeded += 1
+
+    workers = [threading.Thread(target=_worker) for _ in range(THREADS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert not errors, errors
+    return succeeded
+
+
+def _balance(session_factory, user_id: int):
+    from app.models.generation import GenerationBalance
+
+    with session_factory() as db:
+        return db.query(GenerationBalance).filter(GenerationBalance.user_id == user_id).one()
+
+
+def test_concurrent_consume_spends_exactly_available_credits(session_factory, user_id):
+    from app.models.generation import GenerationBalance
+    from app.models.user import User
+
+    with session_factory() as db:
+        user = db.get(User, user_id)
+        db.add(GenerationBalance(user_id=user_id, email=user.email, remaining_std=CREDITS))
+        db.commit()
+
+    succeeded = _consume_concurrently(session_factory, user_id)
+
+    balance = _balance(session_factory, user_id)
+    assert succeeded == CREDITS
+    assert balance.remaining_std == 0
+    assert balance.used_std == CREDITS
+
+
+def test_concurrent_first_consume_creates_one_balance(session_factory, user_id):
+    # Баланса ещё нет: все потоки промахиваются, создают строку через
+    # INSERT ... ON CONFLICT DO NOTHING и списывают единственную бесплатную генерацию
+    succeeded = _consume_concurrently(session_factory, user_id)
+
+    balance = _balance(session_factory, user_id)
+    assert succeeded == 1
+    assert balance.remaining_std == 0
+    assert balance.used_std == 1